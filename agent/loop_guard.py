@@ -0,0 +1,160 @@
+# agent/loop_guard.py
+import json
+import logging
+import re
+import threading
+import time
+
+from agent.routing import ERROR_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Read-only tools whose result cannot change within one question
+MEMOIZABLE_TOOLS = {"inspect_schema", "analyze_data", "find_dashboard_chart", "lookup_values"}
+# Earlier failures of the same call (or with the same error) before it is no longer run
+MAX_REPEATED_ERRORS = 2
+# Errors naming the identifier that caused them; a call that no longer
+# contains that identifier is a correction, not a repeat
+IDENTIFIER_ERROR_PATTERN = re.compile(
+    r"(?:no such (?:column|table|function)|ambiguous column name):\s*([^\s,;()]+)", re.IGNORECASE
+)
+# Loop hints in one question before the agent is made to answer
+MAX_LOOP_HINTS = 2
+DEFAULT_MAX_STEPS = 12
+DEFAULT_MAX_SECONDS = 180
+
+MEMO_NOTE = "(Identical call already made for this question; returning the earlier result.)\n"
+LOOP_ERROR = "Error: Repeated failing call, not executed."
+FINAL_ANSWER_PROMPT = (
+    "STOP USING TOOLS: {reason}. Answer the user now with the information gathered so far. "
+    "If the question could not be fully answered, say what is missing and what was tried."
+)
+
+
+def _normalize(args):
+    """Arguments as one comparable string (whitespace and trailing ';' ignored)."""
+    def clean(value):
+        return " ".join(value.split()).rstrip(";").strip() if isinstance(value, str) else value
+    return json.dumps({key: clean(value) for key, value in sorted(args.items())}, default=str)
+
+
+def _same_cause(error, args):
+    """True if `error` names an identifier that the (normalized) arguments still use."""
+    match = IDENTIFIER_ERROR_PATTERN.search(error)
+    if not match:
+        return False
+    identifier = match.group(1).strip("'\"[]`")
+    return re.search(rf"(?<![\w.]){re.escape(identifier)}(?!\w)", args, re.IGNORECASE) is not None
+
+
+def _earlier_calls(turn):
+    """(call, ToolMessage) pairs of the tool calls already answered in this turn."""
+    results = {m.tool_call_id: m for m in turn if getattr(m, "type", None) == "tool"}
+    return [
+        (call, results[call["id"]])
+        for message in turn if getattr(message, "type", None) == "ai"
+        for call in (getattr(message, "tool_calls", None) or [])
+        if call["id"] in results
+    ]
+
+
+class RunGuard:
+    """
+    Per-question guard rails for the ReAct loop.
+
+    - memoizes identical read-only tool calls within a question
+    - stops calls that already failed MAX_REPEATED_ERRORS times, either with
+      identical arguments or with the same error about an identifier (column,
+      table, function) the new arguments still use, and returns a summarised
+      hint; a call that drops that identifier always runs
+    - makes the agent answer without tools once the question used
+      max_steps model steps, max_seconds, or MAX_LOOP_HINTS loop hints
+
+    `stats` counts memoized and stopped calls (together: tool_calls_saved,
+    calls that were not run) and forced answers.
+    """
+
+    def __init__(self, max_steps=DEFAULT_MAX_STEPS, max_seconds=DEFAULT_MAX_SECONDS):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.stats = {
+            "memoized_calls": 0,
+            "loops_stopped": 0,
+            "forced_answers": 0,
+            "tool_calls_saved": 0,
+            "tool_seconds_saved": 0.0,
+        }
+
+    def _count(self, **amounts):
+        with self._lock:
+            for field, amount in amounts.items():
+                self.stats[field] += amount
+
+    def check_call(self, turn, call):
+        """
+        Decide whether a tool call needs to run.
+
+        Args:
+            turn: Messages of the current question
+            call: Tool call dict ({"name", "args", "id"})
+
+        Returns:
+            Content to answer with instead of running the tool, or None
+        """
+        args = _normalize(call["args"])
+        identical = []
+        by_error = {}
+        for earlier, result in _earlier_calls(turn):
+            if earlier["name"] != call["name"]:
+                continue
+            earlier_args = _normalize(earlier["args"])
+            error = " ".join(str(result.content).split())
+            if ERROR_PATTERN.match(error):
+                if earlier_args == args:
+                    identical.append((earlier, result))
+                if earlier_args == args or _same_cause(error, args):
+                    by_error.setdefault(error, []).append((earlier, result))
+            elif earlier_args == args and call["name"] in MEMOIZABLE_TOOLS:
+                seconds = (result.response_metadata or {}).get("seconds", 0.0)
+                self._count(memoized_calls=1, tool_calls_saved=1, tool_seconds_saved=seconds)
+                logger.info(f"Memoized {call['name']} call reused ({seconds:.2f}s saved)")
+                return MEMO_NOTE + str(result.content)
+
+        failures = max([identical, *by_error.values()], key=len)
+        if len(failures) < MAX_REPEATED_ERRORS:
+            return None
+        self._count(loops_stopped=1, tool_calls_saved=1)
+        logger.info(f"Stopped repeated failing {call['name']} call ({len(failures)} earlier failures)")
+        lines = [f"{LOOP_ERROR} It repeats {len(failures)} earlier calls that failed:"]
+        for n, (earlier, result) in enumerate(failures, 1):
+            arguments = " ".join(_normalize(earlier["args"]).split())[:300]
+            error = " ".join(str(result.content).split())[:300]
+            lines.append(f"{n}. {arguments} -> {error}")
+        lines.append(
+            "Do not retry this approach. Re-check table and column names with inspect_schema, "
+            "try a different or simpler query, or answer with what you already know."
+        )
+        return "\n".join(lines)
+
+    def stop_reason(self, turn, started):
+        """
+        Why the agent must answer now instead of calling more tools, or None.
+
+        Args:
+            turn: Messages of the current question
+            started: time.time() when the question arrived
+        """
+        steps = sum(1 for m in turn if getattr(m, "type", None) == "ai")
+        hints = sum(1 for m in turn if getattr(m, "type", None) == "tool" and str(m.content).startswith(LOOP_ERROR))
+        if steps >= self.max_steps:
+            reason = f"the step budget of {self.max_steps} steps for this question is used up"
+        elif time.time() - started >= self.max_seconds:
+            reason = f"the time budget of {self.max_seconds}s for this question is used up"
+        elif hints >= MAX_LOOP_HINTS:
+            reason = "the same failing calls keep being repeated"
+        else:
+            return None
+        self._count(forced_answers=1)
+        logger.info(f"Forcing a final answer after {steps} steps: {reason}")
+        return reason
@@ -0,0 +1,129 @@
+# agent/memory.py
+import logging
+import sqlite3
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+
+logger = logging.getLogger(__name__)
+
+MEMORY_DB = "agent_memory.sqlite"
+# Tokens of conversation history (including the current turn) sent to the model
+DEFAULT_MEMORY_TOKENS = 6000
+# Prior query results kept as references once their turn has been trimmed
+LEDGER_ENTRIES = 8
+LEDGER_RESULT_CHARS = 400
+LEDGER_QUESTION_CHARS = 200
+
+
+def create_checkpointer(path=MEMORY_DB):
+    """
+    Checkpointer that persists conversation threads across agent calls.
+
+    Uses the SQLite checkpointer when langgraph-checkpoint-sqlite is
+    installed, otherwise an in-process one (lost on restart).
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+
+        # Shared by the Streamlit script threads
+        conn = sqlite3.connect(path, check_same_thread=False)
+        return SqliteSaver(conn)
+    except ImportError:
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        logger.warning("langgraph-checkpoint-sqlite not installed; conversation memory is in-process only")
+        return InMemorySaver()
+
+
+def _short(text, limit, indent=None):
+    """Truncate to `limit` chars; whitespace is collapsed unless an indent keeps the lines."""
+    text = str(text).strip()
+    text = text if len(text) <= limit else text[:limit - 1] + "…"
+    if indent is None:
+        return " ".join(text.split())
+    return text.replace("\n", "\n" + indent)
+
+
+def current_turn(messages):
+    """Messages of the current question: from the last user message on."""
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    return messages[last_human:]
+
+
+def _question(message):
+    """The task of a prompt built by the app/CLI, or the whole message."""
+    content = str(message.content)
+    for line in content.splitlines():
+        if line.startswith("Task:"):
+            return line[len("Task:"):].strip()
+    return content
+
+
+def query_ledger(messages, limit=LEDGER_ENTRIES):
+    """
+    Queries run by analyze_data in `messages`, with the question that led to
+    them and the start of their result.
+
+    Returns:
+        List of dicts with "question", "query" and "result", oldest first
+    """
+    results = {m.tool_call_id: m.content for m in messages if isinstance(m, ToolMessage)}
+    ledger = []
+    question = ""
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            question = _question(message)
+        elif isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                if call["name"] == "analyze_data" and call["id"] in results:
+                    ledger.append({
+                        "question": question,
+                        "query": call["args"].get("query", ""),
+                        "result": results[call["id"]],
+                    })
+    return ledger[-limit:]
+
+
+def _format_ledger(ledger):
+    lines = ["Earlier in this conversation (older turns were trimmed) these queries were run:"]
+    for n, entry in enumerate(ledger, 1):
+        lines.append(f"[Q{n}] Question: {_short(entry['question'], LEDGER_QUESTION_CHARS)}")
+        lines.append(f"      SQL: {entry['query']}")
+        lines.append(f"      Result: {_short(entry['result'], LEDGER_RESULT_CHARS, indent='      ')}")
+    lines.append("Reuse or refine these queries for follow-up questions instead of starting over.")
+    return "\n".join(lines)
+
+
+def bound_history(messages, max_tokens=DEFAULT_MEMORY_TOKENS):
+    """
+    Fit a conversation into a token budget before it is sent to the model.
+
+    The current turn (from the last user message on) is always kept; earlier
+    turns are kept newest first while they fit, starting on a user message
+    so tool calls and their results stay paired. Queries of the trimmed
+    turns are summarised in a leading system message so follow-ups can
+    reuse them.
+    """
+    current = current_turn(messages)
+    history = messages[:len(messages) - len(current)]
+    if not history:
+        return list(messages)
+
+    budget = max(max_tokens - count_tokens_approximately(current), 0)
+    kept = trim_messages(
+        history,
+        max_tokens=budget,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+        allow_partial=False,
+    ) if budget else []
+    dropped = history[:len(history) - len(kept)]
+    if not dropped:
+        return list(messages)
+
+    ledger = query_ledger(dropped)
+    logger.info(f"Conversation trimmed: {len(dropped)} messages dropped, {len(ledger)} queries kept as references")
+    prefix = [SystemMessage(content=_format_ledger(ledger))] if ledger else []
+    return prefix + kept + current
@@ -1,15 +1,98 @@
 # agent/orchestrator.py
 from langchain_openai import ChatOpenAI
 from tools.analysis_tool import DataAnalysisTool
+from tools.result_encoder import DEFAULT_TOKEN_BUDGET
 from tools.schema_tool import SchemaTool
 from tools.visualization_tool import VisualizationTool
+from tools.timeseries_tool import TimeSeriesTool
+from tools.value_lookup_tool import ValueLookupTool
+from tools.export_tool import ExportTool
+from tools.dashboard_tool import DashboardTool, registry_names
+from data.export import export_limits
+from data.dashboards import load_specs
+from data.db_registry import load_config
+from data.connections import schema_alias
+from agent.tool_executor import ConcurrentToolExecutor, DEFAULT_MAX_WORKERS
+from agent.memory import DEFAULT_MEMORY_TOKENS, bound_history
+from agent.routing import DEFAULT_ROUTING, ModelRouter
+from agent.loop_guard import DEFAULT_MAX_SECONDS, DEFAULT_MAX_STEPS, FINAL_ANSWER_PROMPT, RunGuard
+
+
+def _build_graph_agent(llm, tools, system_message, max_parallel_tools,
+                       checkpointer=None, memory_tokens=DEFAULT_MEMORY_TOKENS,
+                       fast_llm=None, routing=None, federated=False, limits=None):
+    """
+    Build a ReAct-style LangGraph agent whose tool step runs independent
+    tool calls concurrently (see ConcurrentToolExecutor).
+
+    With a checkpointer, each thread_id keeps its conversation between
+    calls; the history sent to the model is bounded by memory_tokens.
+    With a fast_llm, each step is routed between it and llm by a
+    ModelRouter, available as `agent.router`.
+    Each question is watched by a RunGuard (`agent.guard`, settings from
+    limits): repeated calls are memoized or stopped, and once the step or
+    time limit is reached the model answers without tools.
+    """
+    import time
+    from langgraph.graph import StateGraph, MessagesState, START
+    from langgraph.prebuilt import tools_condition
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from agent.memory import current_turn
+
+    class AgentState(MessagesState):
+        # time.time() when the current question arrived
+        turn_started: float
+
+    model = llm.bind_tools(tools)
+    router = None
+    if fast_llm is not None:
+        router = ModelRouter(model, fast_llm.bind_tools(tools), routing=routing, federated=federated)
+        model = router
+    limits = limits or {}
+    guard = RunGuard(
+        max_steps=limits.get("max_steps", DEFAULT_MAX_STEPS),
+        max_seconds=limits.get("max_seconds", DEFAULT_MAX_SECONDS),
+    )
+
+    def call_model(state, config):
+        messages = state["messages"]
+        started = time.time() if isinstance(messages[-1], HumanMessage) else state.get("turn_started") or time.time()
+        prompt = [SystemMessage(content=system_message)] + bound_history(messages, memory_tokens)
+        reason = guard.stop_reason(current_turn(messages), started)
+        if reason:
+            # Without tools bound the model can only answer
+            response = llm.invoke(prompt + [SystemMessage(content=FINAL_ANSWER_PROMPT.format(reason=reason))], config)
+        else:
+            response = model.invoke(prompt, config)
+        return {"messages": [response], "turn_started": started}
+
+    graph = StateGraph(AgentState)
+    graph.add_node("agent", call_model)
+    graph.add_node("tools", ConcurrentToolExecutor(tools, max_workers=max_parallel_tools, guard=guard))
+    graph.add_edge(START, "agent")
+    graph.add_conditional_edges("agent", tools_condition)
+    graph.add_edge("tools", "agent")
+    agent = graph.compile(checkpointer=checkpointer)
+    agent.router = router
+    agent.guard = guard
+    return agent
 
 
 def build_agent(
     api_key: str = None, 
     temperature: float = 0, 
     model: str = "gpt-4o",
-    db_path: str = None
+    db_path: str = None,
+    databases: dict = None,
+    max_parallel_tools: int = DEFAULT_MAX_WORKERS,
+    approximate: bool = False,
+    checkpointer=None,
+    memory_tokens: int = DEFAULT_MEMORY_TOKENS,
+    http_client=None,
+    user_role: str = None,
+    export_progress=None,
+    fast_model: str = None,
+    result_token_budget: int = None
 ):
     """
     Build and return a LangChain agent executor with data analysis tools.
@@ -19,20 +102,61 @@ def build_agent(
         temperature: LLM temperature for response randomness
         model: OpenAI model to use (default: gpt-4o)
         db_path: Path to SQLite database file
+        databases: Optional mapping of database name -> path. When given, the
+            agent runs in federated mode: one read-only connection with every
+            database ATTACHed, so cross-database joins run inside SQLite.
+        max_parallel_tools: Worker threads for independent schema/query
+            tool calls within one agent step (1 runs them serially)
+        approximate: Run queries on large tables against row samples and
+            return scaled, labelled estimates (single database only)
+        checkpointer: Optional LangGraph checkpointer (see
+            agent.memory.create_checkpointer). Enables follow-up questions:
+            invoke with config={"configurable": {"thread_id": ...}}
+        memory_tokens: Token budget for the conversation history sent to
+            the model; older turns are trimmed to references of their queries
+        http_client: Optional httpx.Client for the OpenAI API, e.g. one
+            keep-alive client shared by every agent of a server process
+        user_role: Role of the user; roles with export_limits in config.yaml
+            get the export_data tool for full-result downloads
+        export_progress: Optional callable(rows, bytes, max_rows) reporting
+            the progress of running exports
+        fast_model: Smaller model for simple planning/summarization steps
+            (see agent/routing.py); defaults to model_routing in config.yaml.
+            Routing is off when it is the same as `model`
+        result_token_budget: Upper bound on tokens of each query result
+            returned to the model; defaults to result_token_budget in config.yaml
         
     Returns:
         Configured agent executor
     """
     try:
-        if not db_path:
+        if not db_path and not databases:
             raise ValueError("db_path is required for database operations")
         
+        config = load_config()
+        if result_token_budget is None:
+            result_token_budget = config.get("result_token_budget", DEFAULT_TOKEN_BUDGET)
+
         # --- Initialize Tools ---
         tools = [
-            SchemaTool(db_path=db_path),
-            DataAnalysisTool(db_path=db_path),
+            SchemaTool(db_path=db_path, databases=databases),
+            ValueLookupTool(db_path=db_path, databases=databases),
+            DataAnalysisTool(
+                db_path=db_path, databases=databases, approximate=approximate, token_budget=result_token_budget
+            ),
             VisualizationTool(db_path=db_path),
+            TimeSeriesTool(db_path=db_path, databases=databases),
         ]
+        can_export = bool(export_limits(user_role)["max_rows"])
+        if can_export:
+            tools.append(ExportTool(
+                db_path=db_path, databases=databases, role=user_role, progress_callback=export_progress
+            ))
+        # Only offered when config.yaml defines dashboard charts for these databases
+        names = registry_names(db_path, databases)
+        has_dashboards = any(spec["database"] in names for spec in load_specs(config))
+        if has_dashboards:
+            tools.append(DashboardTool(db_path=db_path, databases=databases))
         
         # Validate tools
         if not all(tools):
@@ -42,12 +166,25 @@ def build_agent(
         llm = ChatOpenAI(
             model=model,
             temperature=temperature,
-            api_key=api_key
+            api_key=api_key,
+            http_client=http_client
         )
+        # Simple steps go to a smaller, faster model (see agent/routing.py)
+        routing = dict(DEFAULT_ROUTING, **config.get("model_routing", {}))
+        if fast_model is None and routing["enabled"]:
+            fast_model = routing["fast_model"]
+        fast_llm = None
+        if fast_model and fast_model != model:
+            fast_llm = ChatOpenAI(
+                model=fast_model,
+                temperature=temperature,
+                api_key=api_key,
+                http_client=http_client
+            )
 
         # Try LangGraph first (most modern and compatible)
         try:
-            from langgraph.prebuilt import create_react_agent
+            import langgraph  # noqa: F401
             
             # Create system message that teaches the LLM about SQL reserved words
             system_message = """You are a helpful data analysis assistant with access to a SQLite database.
@@ -62,15 +199,61 @@ def build_agent(
                                 When analyzing data:
                                 - Always start by using get_schema to understand available tables
                                 - Use analyze_data tool to execute SQL queries
+                                - When the user names a value to filter on (a country, artist, genre, status...),
+                                  call lookup_values to get its exact stored spelling instead of SELECT DISTINCT/LIKE
                                 - For the user, db_name, and other parameters, extract them from the user's message
                                 - Be specific and thorough in your analysis
                                 - If you get a syntax error with "Order", remember to use [Order]
+                                - For trends over time, use plot_time_series: it groups by day/week/month/quarter in SQL
                                 - Provide clear, actionable insights"""
 
-            agent = create_react_agent(
-                model=llm,
-                tools=tools,
-                prompt=system_message
+            if can_export:
+                system_message += """
+
+                                EXPORTS:
+                                - When the user wants to download or export data, use export_data with the query
+                                - Mention the returned file path in your response; do not paste the rows"""
+
+            if has_dashboards:
+                system_message += """
+
+                                DASHBOARDS:
+                                - For chart requests, first call find_dashboard_chart with the question
+                                - If it returns a matching chart, answer with that chart's path (do not re-run the query)"""
+
+            if checkpointer is not None:
+                system_message += """
+
+                                CONVERSATION MEMORY:
+                                - Earlier questions, queries and results of this conversation are available
+                                - For follow-up questions, refine the previous queries instead of starting over
+                                - Only inspect the schema again if the follow-up needs tables not used so far"""
+
+            if databases:
+                schemas = ", ".join(
+                    f"{schema_alias(name)} ({name})" for name in databases
+                )
+                system_message += f"""
+
+                                FEDERATED MODE:
+                                - Several databases are attached as schemas: {schemas}
+                                - ALWAYS prefix tables with their schema, e.g. northwind.[Order]
+                                - You may JOIN tables from different schemas in a single query"""
+
+            if approximate and not databases:
+                system_message += """
+
+                                APPROXIMATE MODE:
+                                - Queries on large tables run against a sample and are labelled APPROXIMATE RESULT
+                                - COUNT/SUM values are scaled estimates; <column>_ci95 gives the 95% error margin
+                                - Mention that figures are approximate when reporting them
+                                - Call analyze_data with exact=true when the user needs exact figures"""
+
+            agent = _build_graph_agent(
+                llm, tools, system_message, max_parallel_tools,
+                checkpointer=checkpointer, memory_tokens=memory_tokens,
+                fast_llm=fast_llm, routing=routing, federated=bool(databases),
+                limits=config.get("agent_limits", {})
             )
             print("✓ Using LangGraph agent")
             return agent
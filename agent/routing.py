@@ -0,0 +1,185 @@
+# agent/routing.py
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from agent.memory import _question, current_turn
+
+logger = logging.getLogger(__name__)
+
+FAST = "fast"
+STRONG = "strong"
+# Latencies kept per route for the percentiles in stats()
+LATENCY_WINDOW = 500
+
+# Used when config.yaml has no model_routing section
+DEFAULT_ROUTING = {
+    "enabled": True,
+    "fast_model": "gpt-4o-mini",
+    # Questions longer than this go to the strong model from the first step
+    "complex_question_chars": 400,
+    # Tool results longer than this are summarized by the strong model
+    "large_result_chars": 4000,
+    "complex_keywords": [
+        "compare", "correlation", "correlate", "versus", "vs", "growth", "year over year",
+        "cohort", "retention", "percentile", "median", "rank", "forecast", "why", "explain",
+        "breakdown", "share of", "ratio",
+    ],
+}
+
+# Tool messages starting like this report a failed call (see the tools' error strings)
+ERROR_PATTERN = re.compile(r"^\s*(?:\w+ )?Error\b", re.IGNORECASE)
+
+
+def _usable(response):
+    """A step is usable if it calls tools correctly or answers with text."""
+    if getattr(response, "invalid_tool_calls", None):
+        return False
+    return bool(getattr(response, "tool_calls", None) or str(response.content).strip())
+
+
+class ModelRouter:
+    """
+    Picks the model for each agent step: the fast model for simple planning
+    and summarization steps, the strong one on complexity signals.
+
+    The strong model is used for the rest of a turn when:
+    - the question is long or contains complex-analysis keywords
+    - the agent works on several attached databases (federated mode)
+    - a tool call of the turn failed (bad SQL, plotting error, ...)
+    - a tool returned a large result to summarize
+    A fast step whose output is unusable (invalid tool call, empty answer)
+    is retried once on the strong model.
+
+    Per-route call counts, latency percentiles and success rates are kept
+    in `stats()`; a step counts as failed when it raised, was unusable or
+    one of the tool calls it requested failed.
+    """
+
+    def __init__(self, strong_model, fast_model, routing=None, federated=False):
+        """
+        Args:
+            strong_model: Chat model (with tools bound) for complex steps
+            fast_model: Smaller chat model (with tools bound) for simple steps
+            routing: Settings overriding DEFAULT_ROUTING (model_routing in config.yaml)
+            federated: True when the agent queries several attached databases
+        """
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.routing = dict(DEFAULT_ROUTING, **(routing or {}))
+        self.federated = federated
+        self._keywords = re.compile(
+            r"\b(?:" + "|".join(re.escape(keyword) for keyword in self.routing["complex_keywords"]) + r")\b",
+            re.IGNORECASE,
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            route: {"calls": 0, "failures": 0, "escalations": 0, "seconds": 0.0,
+                    "latencies": deque(maxlen=LATENCY_WINDOW)}
+            for route in (FAST, STRONG)
+        }
+
+    def choose(self, messages):
+        """
+        Route for the next step.
+
+        Returns:
+            (route, reason) with route FAST or STRONG
+        """
+        turn = current_turn(messages)
+        question = _question(turn[0]) if turn else ""
+        if self.federated:
+            return STRONG, "federated"
+        if len(question) > self.routing["complex_question_chars"]:
+            return STRONG, "long question"
+        match = self._keywords.search(question)
+        if match:
+            return STRONG, f"keyword '{match.group(0).lower()}'"
+        for message in turn:
+            if getattr(message, "type", None) != "tool":
+                continue
+            if ERROR_PATTERN.match(str(message.content)):
+                return STRONG, f"{message.name} error"
+        last = turn[-1] if turn else None
+        if getattr(last, "type", None) == "tool" and len(str(last.content)) > self.routing["large_result_chars"]:
+            return STRONG, "large result"
+        return FAST, "simple step"
+
+    def invoke(self, messages, config=None):
+        """Run one agent step on the routed model; messages start with the system prompt."""
+        self._score_previous_step(messages)
+        route, reason = self.choose(messages)
+        response = self._call(route, messages, config)
+        if route == FAST and (response is None or not _usable(response)):
+            logger.info("Fast model step unusable, escalating to the strong model")
+            self._count(FAST, "escalations")
+            route, reason = STRONG, "escalated"
+            response = self._call(STRONG, messages, config, reraise=True)
+        # Remembered on the message so the next step can score this one
+        response.response_metadata["route"] = route
+        logger.info(f"Model route: {route} ({reason})")
+        return response
+
+    def _call(self, route, messages, config, reraise=False):
+        start = time.perf_counter()
+        try:
+            response = self.models[route].invoke(messages, config)
+        except Exception:
+            self._record(route, time.perf_counter() - start, failed=True)
+            if route == STRONG or reraise:
+                raise
+            return None
+        failed = not _usable(response)
+        self._record(route, time.perf_counter() - start, failed=failed)
+        return response
+
+    def _score_previous_step(self, messages):
+        """A step whose tool calls failed counts as a failure of its route."""
+        tool_results = []
+        for message in reversed(messages):
+            if getattr(message, "type", None) == "tool":
+                tool_results.append(message)
+                continue
+            if getattr(message, "type", None) == "ai" and tool_results:
+                route = (getattr(message, "response_metadata", None) or {}).get("route")
+                if route in self._stats and any(ERROR_PATTERN.match(str(m.content)) for m in tool_results):
+                    self._count(route, "failures")
+            break
+
+    def _record(self, route, seconds, failed):
+        with self._lock:
+            stats = self._stats[route]
+            stats["calls"] += 1
+            stats["failures"] += int(failed)
+            stats["seconds"] += seconds
+            stats["latencies"].append(seconds)
+
+    def _count(self, route, field):
+        with self._lock:
+            self._stats[route][field] += 1
+
+    def stats(self):
+        """
+        Per-route counters.
+
+        Returns:
+            Dict of route -> {calls, failures, escalations, success_rate,
+            avg_seconds, p50_seconds, p95_seconds}
+        """
+        with self._lock:
+            report = {}
+            for route, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                calls = stats["calls"]
+                report[route] = {
+                    "calls": calls,
+                    "failures": stats["failures"],
+                    "escalations": stats["escalations"],
+                    "success_rate": round(1 - stats["failures"] / calls, 3) if calls else None,
+                    "avg_seconds": round(stats["seconds"] / calls, 3) if calls else 0.0,
+                    "p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+                    "p95_seconds": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3)
+                    if latencies else 0.0,
+                }
+            return report
@@ -0,0 +1,131 @@
+# agent/tool_executor.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import ToolMessage
+
+from agent.memory import current_turn
+
+logger = logging.getLogger(__name__)
+
+# Read-only tools that use their own pooled connection and can run side by side.
+# Plotting stays serial because matplotlib's pyplot state is not thread-safe.
+PARALLEL_SAFE_TOOLS = {"inspect_schema", "analyze_data", "lookup_values"}
+DEFAULT_MAX_WORKERS = 4
+# Threads of the executor shared by every agent; each agent is limited to its max_workers
+SHARED_WORKERS = 16
+
+_SHARED_POOL = None
+_SHARED_POOL_LOCK = threading.Lock()
+
+
+def _shared_pool():
+    """Process-wide thread pool, so rebuilding agents does not leak threads."""
+    global _SHARED_POOL
+    with _SHARED_POOL_LOCK:
+        if _SHARED_POOL is None:
+            _SHARED_POOL = ThreadPoolExecutor(max_workers=SHARED_WORKERS, thread_name_prefix="agent-tool")
+        return _SHARED_POOL
+
+
+class ConcurrentToolExecutor:
+    """
+    LangGraph node that executes the tool calls of one agent step.
+
+    Independent read-only calls (e.g. schema plus two aggregates) run on a
+    shared thread pool, at most max_workers at a time per agent; everything
+    else runs serially. Results are returned
+    in the order the model requested them, and the wall-clock time saved
+    versus running every call back to back is recorded in `stats`.
+
+    With a RunGuard (agent/loop_guard.py), repeated read-only calls are
+    answered from earlier results and repeated failing calls are not run.
+    """
+
+    def __init__(self, tools, max_workers=DEFAULT_MAX_WORKERS, guard=None):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_workers = max_workers
+        self.guard = guard
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1))
+        self._lock = threading.Lock()
+        self.stats = {
+            "steps": 0,
+            "tool_calls": 0,
+            "parallel_steps": 0,
+            "serial_seconds": 0.0,
+            "wall_seconds": 0.0,
+            "saved_seconds": 0.0,
+        }
+
+    def _run_call(self, call, config):
+        """Run one tool call and return (ToolMessage, elapsed seconds)."""
+        start = time.perf_counter()
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            content = f"Error: unknown tool '{call['name']}'. Available: {', '.join(self.tools_by_name)}"
+        else:
+            try:
+                content = tool.invoke(call["args"], config)
+            except Exception as e:
+                content = f"Error running {call['name']}: {e}"
+
+        elapsed = time.perf_counter() - start
+        # The run time is kept so a memoized repeat can report the time it saved
+        message = ToolMessage(
+            content=str(content), name=call["name"], tool_call_id=call["id"],
+            response_metadata={"seconds": round(elapsed, 3)},
+        )
+        return message, elapsed
+
+    def _run_slot(self, call, config):
+        """_run_call within this agent's share of the shared pool."""
+        with self._slots:
+            return self._run_call(call, config)
+
+    def __call__(self, state, config=None):
+        calls = state["messages"][-1].tool_calls
+        start = time.perf_counter()
+
+        results = [None] * len(calls)
+        if self.guard is not None:
+            turn = current_turn(state["messages"])
+            for i, call in enumerate(calls):
+                content = self.guard.check_call(turn, call)
+                if content is not None:
+                    results[i] = (ToolMessage(content=content, name=call["name"], tool_call_id=call["id"]), 0.0)
+
+        pending = [i for i in range(len(calls)) if results[i] is None]
+        parallel = [i for i in pending if calls[i]["name"] in PARALLEL_SAFE_TOOLS]
+        if len(parallel) < 2 or self.max_workers < 2:
+            parallel = []
+
+        futures = {i: _shared_pool().submit(self._run_slot, calls[i], config) for i in parallel}
+        for i in pending:
+            if i not in futures:
+                results[i] = self._run_call(calls[i], config)
+        for i, future in futures.items():
+            results[i] = future.result()
+
+        wall = time.perf_counter() - start
+        serial = sum(elapsed for _, elapsed in results)
+        self._record(len(calls), bool(parallel), serial, wall)
+
+        return {"messages": [message for message, _ in results]}
+
+    def _record(self, n_calls, ran_parallel, serial, wall):
+        saved = max(serial - wall, 0.0)
+        with self._lock:
+            self.stats["steps"] += 1
+            self.stats["tool_calls"] += n_calls
+            self.stats["parallel_steps"] += int(ran_parallel)
+            self.stats["serial_seconds"] += serial
+            self.stats["wall_seconds"] += wall
+            self.stats["saved_seconds"] += saved
+
+        if ran_parallel:
+            logger.info(
+                f"Ran {n_calls} tool calls in {wall:.2f}s "
+                f"(serial would take {serial:.2f}s, saved {saved:.2f}s)"
+            )
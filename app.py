@@ -6,6 +6,7 @@ import glob
 import time
 import logging
 import sqlite3
+import uuid
 from yaml.loader import SafeLoader
 import streamlit_authenticator as stauth
 from dotenv import load_dotenv
@@ -14,7 +15,15 @@ from omegaconf import OmegaConf
 
 # Import custom modules
 from agent.orchestrator import build_agent
-from data.db_registry import DATABASES, USER_DB_ACCESS
+from agent.memory import DEFAULT_MEMORY_TOKENS, create_checkpointer
+from data.db_registry import DATABASES, USER_DB_ACCESS, FEDERATED_ROLES, start_registry_watcher
+from data.shared_cache import get_cache
+from data.export import EXPORT_FILE_PATTERN
+from data.dashboards import list_dashboards, start_dashboard_scheduler
+from data.metrics import (
+    DAY_SECONDS, NORMAL, UsageCallback, budget_status, get_metrics_store, record_request_metrics,
+)
+from data.chat_history import BoundedChatHistory, CHAT_HISTORY_DIR, PAGE_SIZE, live_log_paths, memory_report
 
 # ============================================================================
 # CONFIGURATION
@@ -23,7 +32,10 @@ from data.db_registry import DATABASES, USER_DB_ACCESS
 
 IMAGES_DIR = "generated_images"
 IMAGE_MAX_AGE_HOURS = 1
+EXPORT_MIME_TYPES = {".gz": "application/gzip", ".parquet": "application/vnd.apache.parquet"}
+CHAT_HISTORY_MAX_AGE_HOURS = 24
 RATE_LIMIT_SECONDS = 2
+FEDERATED_OPTION = "All databases (federated)"
 
 # Logging setup
 logging.basicConfig(
@@ -44,6 +56,9 @@ st.set_page_config(
 )
 load_dotenv()
 os.makedirs(IMAGES_DIR, exist_ok=True)
+# Picks up new/changed databases and config.yaml edits (one thread per process)
+start_registry_watcher()
+start_dashboard_scheduler()
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -65,14 +80,16 @@ def load_auth_config():
         st.stop()
 
 
-def cleanup_old_files(directory=IMAGES_DIR, extension="*.png", max_age_hours=IMAGE_MAX_AGE_HOURS):
-    """Remove old generated files to prevent disk space issues."""
+def cleanup_old_files(directory=IMAGES_DIR, extension="*.png", max_age_hours=IMAGE_MAX_AGE_HOURS, keep=()):
+    """Remove old generated files to prevent disk space issues; absolute paths in `keep` are left alone."""
     pattern = os.path.join(directory, extension)
     files = glob.glob(pattern)
     current_time = time.time()
     
     for file in files:
         try:
+            if os.path.abspath(file) in keep:
+                continue
             if current_time - os.path.getmtime(file) > (max_age_hours * 3600):
                 os.remove(file)
                 logger.info(f"Cleaned up old file: {file}")
@@ -80,6 +97,12 @@ def cleanup_old_files(directory=IMAGES_DIR, extension="*.png", max_age_hours=IMA
             logger.warning(f"Could not remove {file}: {e}")
 
 
+def cleanup_exports():
+    """Remove old data exports (they can be large) on the same schedule as images."""
+    for extension in ("export_*.csv.gz", "export_*.parquet"):
+        cleanup_old_files(extension=extension)
+
+
 def validate_database(db_path):
     """Validate that the database file exists and is accessible."""
     if not os.path.exists(db_path):
@@ -115,12 +138,60 @@ def extract_response(response):
 
 def reset_chat():
     """Reset chat state and clean up resources."""
-    st.session_state.messages = []
+    if st.session_state.get("messages") is not None:
+        st.session_state.messages.clear()
+    st.session_state.messages = None
+    st.session_state.history_pages = 0
     st.session_state.agent = None
+    # A new conversation thread: the agent forgets the previous one
+    st.session_state.thread_id = None
     cleanup_old_files()
+    cleanup_exports()
     logger.info("Chat reset")
 
 
+def render_message(msg, key_prefix="hist"):
+    """Render one chat history entry (text and/or image with download button)."""
+    with st.chat_message(msg["role"]):
+        if "content" in msg:
+            st.markdown(msg["content"])
+        if "image" in msg:
+            if os.path.exists(msg["image"]):
+                st.image(msg["image"])
+                
+                # Add download button for historical images
+                with open(msg["image"], "rb") as file:
+                    st.download_button(
+                        label="📥 Download",
+                        data=file,
+                        file_name=os.path.basename(msg["image"]),
+                        mime="image/png",
+                        key=f"{key_prefix}_{os.path.basename(msg['image'])}"
+                    )
+        if "export" in msg and os.path.exists(msg["export"]):
+            export_download_button(msg["export"], key=f"{key_prefix}_{os.path.basename(msg['export'])}")
+
+
+def export_download_button(export_path, key):
+    """Download button for a data export; the file is only read when clicked."""
+    size_mb = os.path.getsize(export_path) / (1024 * 1024)
+    st.download_button(
+        label=f"📦 Download data ({size_mb:.1f} MB)",
+        data=lambda: open(export_path, "rb").read(),
+        file_name=os.path.basename(export_path),
+        mime=EXPORT_MIME_TYPES.get(os.path.splitext(export_path)[1], "application/octet-stream"),
+        key=key,
+        on_click="ignore"
+    )
+
+
+def report_export_progress(rows, size, max_rows):
+    """Progress of a running export, shown under the assistant's spinner."""
+    placeholder = st.session_state.get("export_progress")
+    if placeholder is not None:
+        placeholder.caption(f"📦 Exporting... {rows:,} rows written ({size / (1024 * 1024):.1f} MB, limit {max_rows:,} rows)")
+
+
 def check_rate_limit():
     """Enforce rate limiting to prevent spam."""
     if "last_query_time" not in st.session_state:
@@ -137,16 +208,29 @@ def check_rate_limit():
     return True
 
 
-def build_agent_safely(db_path):
+@st.cache_resource
+def get_checkpointer():
+    """Conversation checkpointer shared by all sessions (one thread per chat)."""
+    return create_checkpointer()
+
+
+def build_agent_safely(db_path, databases=None, approximate=False, user_role=None, model="gpt-4o",
+                       memory_tokens=None):
     """Build agent with error handling."""
     try:
         agent = build_agent(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o",
+            model=model,
             temperature=0,
-            db_path=db_path
+            db_path=db_path,
+            databases=databases,
+            approximate=approximate,
+            checkpointer=get_checkpointer(),
+            memory_tokens=memory_tokens or DEFAULT_MEMORY_TOKENS,
+            user_role=user_role,
+            export_progress=report_export_progress
         )
-        logger.info(f"Agent built successfully for: {db_path}")
+        logger.info(f"Agent built successfully for: {db_path or ', '.join(databases)}")
         return agent
     except Exception as e:
         st.error(f"❌ Failed to build agent: {e}")
@@ -154,8 +238,9 @@ def build_agent_safely(db_path):
         st.stop()
 
 
-def invoke_agent_safely(agent, prompt, user_role, db_path):
-    """Invoke agent with proper error handling."""
+def invoke_agent_safely(agent, prompt, user_role, db_path, thread_id=None, username=None, database=None,
+                        budget=None):
+    """Invoke agent with proper error handling, recording tokens, cost and latency."""
     final_prompt = (
         f"User Role: {user_role}\n"
         f"Database Path: {db_path}\n"
@@ -166,21 +251,35 @@ def invoke_agent_safely(agent, prompt, user_role, db_path):
         f"and mention the full path in your response."
     )
     
-    if hasattr(agent, 'invoke'):
-        try:
-            return agent.invoke(
-                {"messages": [("user", final_prompt)]},
-                config={"recursion_limit": 50}
-            )
-        except (TypeError, ValueError):
-            return agent.invoke({"input": final_prompt})
-    else:
-        return agent(final_prompt)
+    start = time.perf_counter()
+    result = None
+    status = "error"
+    # Counts model calls as they finish, so failed requests are charged too
+    usage_callback = UsageCallback()
+    try:
+        if hasattr(agent, 'invoke'):
+            try:
+                result = agent.invoke(
+                    {"messages": [("user", final_prompt)]},
+                    config={"recursion_limit": 50, "configurable": {"thread_id": thread_id},
+                            "callbacks": [usage_callback]}
+                )
+            except (TypeError, ValueError):
+                result = agent.invoke({"input": final_prompt})
+        else:
+            result = agent(final_prompt)
+        status = "ok"
+        return result
+    finally:
+        record_request_metrics(
+            result, status, time.perf_counter() - start, username, user_role, database or db_path, budget,
+            partial_usage=usage_callback.usage(),
+        )
 
 
 def handle_image_display(final_answer):
     """Detect and display generated images from agent response."""
-    image_match = re.search(rf"{IMAGES_DIR}/[\w-]+\.png", final_answer)
+    image_match = re.search(rf"{IMAGES_DIR}/(?:dashboards/)?[\w-]+\.png", final_answer)
     
     if image_match:
         img_path = os.path.normpath(image_match.group(0))
@@ -207,6 +306,23 @@ def handle_image_display(final_answer):
             
             logger.info(f"Image displayed: {img_path}")
 
+
+def handle_export_download(final_answer):
+    """Offer data exports mentioned in the agent response for download."""
+    export_match = re.search(rf"{IMAGES_DIR}/{EXPORT_FILE_PATTERN}", final_answer)
+    
+    if export_match:
+        export_path = os.path.normpath(export_match.group(0))
+        
+        # Security: ensure path is within IMAGES_DIR
+        if export_path.startswith(IMAGES_DIR) and os.path.exists(export_path):
+            export_download_button(export_path, key=f"download_{os.path.basename(export_path)}")
+            st.session_state.messages.append({
+                "role": "assistant",
+                "export": export_path
+            })
+            logger.info(f"Export offered: {export_path}")
+
 # ============================================================================
 # AUTHENTICATION
 # ============================================================================
@@ -269,15 +385,102 @@ elif st.session_state["authentication_status"]:
             logger.warning(f"User {username} has no database access")
             st.stop()
         
+        db_options = list(available_dbs.keys())
+        if user_role in FEDERATED_ROLES and len(available_dbs) > 1:
+            db_options.append(FEDERATED_OPTION)
+        
         selected_db_name = st.selectbox(
             "Select Database",
-            options=list(available_dbs.keys()),
+            options=db_options,
+            on_change=reset_chat
+        )
+        
+        # Federated mode attaches every allowed database to one connection
+        if selected_db_name == FEDERATED_OPTION:
+            federated_dbs = available_dbs
+            db_path = None
+        else:
+            federated_dbs = None
+            db_path = available_dbs[selected_db_name]
+        
+        # Sampled execution for exploratory questions on large tables
+        approximate = st.toggle(
+            "⚡ Approximate mode (sampled)",
+            value=False,
+            disabled=federated_dbs is not None,
+            help="Large tables are queried on a sample; results are labelled with error margins.",
             on_change=reset_chat
         )
-        db_path = available_dbs[selected_db_name]
+        
+        # Daily token budget: past it the agent degrades to cheaper settings
+        budget = budget_status(username, user_role)
+        if budget["limit"]:
+            st.caption(f"🎟️ Tokens today: {budget['used']:,} / {budget['limit']:,}")
+        if budget["level"] != NORMAL:
+            st.warning(
+                f"Token budget {'exceeded' if budget['approximate'] else 'almost used'}: "
+                f"answers use {budget['model']}"
+                f"{' in approximate mode' if budget['approximate'] else ''} until usage drops."
+            )
+        if st.session_state.get("budget_level") not in (None, budget["level"]):
+            # Same conversation, agent rebuilt with the new model/mode
+            st.session_state.agent = None
+        st.session_state.budget_level = budget["level"]
         
         st.divider()
         
+        # Precomputed charts, rendered in the background when data changes
+        dashboards = list_dashboards(list(federated_dbs or [selected_db_name]))
+        if dashboards:
+            with st.expander("📈 Dashboards"):
+                for chart in dashboards:
+                    st.image(chart["path"], caption=chart["title"])
+                    st.caption(
+                        f"{chart['database']} · updated "
+                        f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(chart['rendered_at']))}"
+                    )
+        
+        # Cache effectiveness across all workers (admins only)
+        cache = get_cache() if user_role == "admin" else None
+        if cache is not None:
+            with st.expander("🗄️ Shared cache"):
+                for namespace, stats in sorted(cache.stats().items()):
+                    st.caption(
+                        f"**{namespace}**: {stats['hit_rate']:.0%} hits "
+                        f"({stats['hits']}/{stats['hits'] + stats['misses']}), "
+                        f"{stats['entries']} entries, {stats['bytes'] / 1024:.0f} KB, "
+                        f"{stats['evictions']} evicted"
+                    )
+        
+        # Token, cost and latency rollups of the last 24 hours (admins only)
+        metrics = get_metrics_store() if user_role == "admin" else None
+        if metrics is not None:
+            with st.expander("📊 Usage (24h)"):
+                since = time.time() - DAY_SECONDS
+                for group_by in ("username", "database"):
+                    rollup = metrics.rollup(group_by, since)
+                    if rollup:
+                        st.dataframe(rollup, hide_index=True)
+                st.caption("Latency (requests per wall-time bucket)")
+                histogram = metrics.latency_histogram(since)
+                st.bar_chart(
+                    [{"latency": bucket, "requests": count} for bucket, count in histogram.items()],
+                    x="latency", y="requests", sort=False
+                )
+                # Fast/strong model routing of this chat's agent
+                router = getattr(st.session_state.get("agent"), "router", None)
+                if router is not None:
+                    st.caption("Model routes (this chat)")
+                    st.dataframe(
+                        [dict(route=route, **stats) for route, stats in router.stats().items()],
+                        hide_index=True
+                    )
+                # Memoized/stopped tool calls and forced answers (see agent/loop_guard.py)
+                guard = getattr(st.session_state.get("agent"), "guard", None)
+                if guard is not None:
+                    st.caption("Loop guard (this chat)")
+                    st.dataframe([guard.stats], hide_index=True)
+        
         # Tips section
         st.markdown("### 💡 Tips")
         st.caption("• Ask for specific tables or schemas")
@@ -291,19 +494,33 @@ elif st.session_state["authentication_status"]:
     st.title(f"📊 {selected_db_name} Analyst")
     
     # Initialize session state
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
     if "agent" not in st.session_state:
         st.session_state.agent = None
+    if not st.session_state.get("thread_id"):
+        st.session_state.thread_id = f"{username}-{uuid.uuid4().hex}"
+    if st.session_state.get("messages") is None:
+        # Older turns are spilled to chat_history/<thread id>.jsonl
+        st.session_state.messages = BoundedChatHistory(st.session_state.thread_id)
+        st.session_state.history_pages = 0
     
     # Build agent (lazy loading)
     if st.session_state.agent is None:
         cleanup_old_files()
+        cleanup_exports()
+        # Idle sessions still page back through their logs
+        cleanup_old_files(CHAT_HISTORY_DIR, "*.jsonl", CHAT_HISTORY_MAX_AGE_HOURS, keep=live_log_paths())
         
-        if validate_database(db_path):
+        db_paths = list(federated_dbs.values()) if federated_dbs else [db_path]
+        if all(validate_database(path) for path in db_paths):
             with st.spinner("🔌 Connecting to database..."):
-                st.session_state.agent = build_agent_safely(db_path)
-                
+                st.session_state.agent = build_agent_safely(
+                    db_path, federated_dbs,
+                    approximate or (budget["approximate"] and federated_dbs is None),
+                    user_role, model=budget["model"], memory_tokens=budget["memory_tokens"]
+                )
+                logger.info(f"Agent initialized for {username} on {selected_db_name} ({budget['model']})")
+            
+            if not len(st.session_state.messages):
                 # Welcome message
                 st.session_state.messages.append({
                     "role": "assistant",
@@ -313,26 +530,24 @@ elif st.session_state["authentication_status"]:
                         f"How can I help you analyze your data today?"
                     )
                 })
-                logger.info(f"Agent initialized for {username} on {selected_db_name}")
     
-    # Display chat history
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            if "content" in msg:
-                st.markdown(msg["content"])
-            if "image" in msg:
-                if os.path.exists(msg["image"]):
-                    st.image(msg["image"])
-                    
-                    # Add download button for historical images
-                    with open(msg["image"], "rb") as file:
-                        st.download_button(
-                            label="📥 Download",
-                            data=file,
-                            file_name=os.path.basename(msg["image"]),
-                            mime="image/png",
-                            key=f"hist_{os.path.basename(msg['image'])}"
-                        )
+    # Display chat history: earlier pages are read back from disk on request
+    history = st.session_state.messages
+    hidden = history.spilled - st.session_state.history_pages * PAGE_SIZE
+    if hidden > 0 and st.button(f"⬆️ Show earlier messages ({hidden} more)"):
+        st.session_state.history_pages += 1
+        st.rerun()
+    for msg in history.load_older(st.session_state.history_pages * PAGE_SIZE):
+        render_message(msg, key_prefix="older")
+    for msg in history:
+        render_message(msg)
+    
+    with st.sidebar:
+        stats = history.stats()
+        st.caption(
+            f"🧠 Session memory: {stats['memory_bytes'] / 1024:.0f} KB "
+            f"({stats['in_memory']} messages in memory, {stats['spilled']} on disk)"
+        )
     
     # Handle user input
     if prompt := st.chat_input("Ask a question about your data..."):
@@ -352,6 +567,7 @@ elif st.session_state["authentication_status"]:
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
             
+            st.session_state.export_progress = st.empty()
             with st.spinner("🤔 Analyzing data..."):
                 try:
                     # Invoke agent
@@ -359,7 +575,11 @@ elif st.session_state["authentication_status"]:
                         st.session_state.agent,
                         prompt,
                         user_role,
-                        db_path
+                        db_path or ", ".join(federated_dbs.values()),
+                        st.session_state.thread_id,
+                        username=username,
+                        database=selected_db_name,
+                        budget=budget
                     )
                     
                     # Process response
@@ -374,10 +594,21 @@ elif st.session_state["authentication_status"]:
                     
                     # Handle image display
                     handle_image_display(final_answer)
+                    handle_export_download(final_answer)
                     
                     logger.info(f"Response generated for: {username}")
+                    report = memory_report()
+                    logger.info(
+                        f"Chat memory: {report['sessions']} sessions, "
+                        f"{report['total_memory_bytes'] / 1024:.0f} KB total, "
+                        f"{report['max_memory_bytes'] / 1024:.0f} KB largest"
+                    )
                 
                 except Exception as e:
                     error_msg = f"❌ An error occurred: {str(e)}"
                     st.error(error_msg)
-                    logger.error(f"Query error for {username}: {e}", exc_info=True)
\ No newline at end of file
+                    logger.error(f"Query error for {username}: {e}", exc_info=True)
+                
+                finally:
+                    st.session_state.export_progress.empty()
+                    st.session_state.export_progress = None
@@ -0,0 +1,145 @@
+# data/chat_history.py
+import json
+import logging
+import os
+import sys
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_DIR = "chat_history"
+# Messages kept in memory (and rendered) per session
+DEFAULT_WINDOW = 20
+# Older messages loaded back per "show earlier" click
+PAGE_SIZE = 10
+
+# Live histories of this process, for the memory report
+_HISTORIES = weakref.WeakValueDictionary()
+_HISTORIES_LOCK = threading.Lock()
+
+
+def _message_bytes(message):
+    """Approximate memory held by one chat message dict."""
+    return sys.getsizeof(message) + sum(
+        sys.getsizeof(key) + sys.getsizeof(value) for key, value in message.items()
+    )
+
+
+class BoundedChatHistory:
+    """
+    Chat messages of one session with a bounded in-memory window.
+
+    Messages beyond the newest `window` are appended to a per-session JSONL
+    log on disk and dropped from memory; only their byte offsets are kept,
+    so older pages can be read back on demand without loading the whole log.
+    """
+
+    def __init__(self, session_id, window=DEFAULT_WINDOW, directory=CHAT_HISTORY_DIR):
+        self.session_id = session_id
+        self.window = window
+        self.path = os.path.join(directory, f"{session_id}.jsonl")
+        self.messages = []
+        self.memory_bytes = 0
+        # Byte offset of every spilled message in the log, oldest first
+        self._offsets = []
+        os.makedirs(directory, exist_ok=True)
+        with _HISTORIES_LOCK:
+            _HISTORIES[session_id] = self
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self._offsets) + len(self.messages)
+
+    @property
+    def spilled(self):
+        """Number of messages that live only on disk."""
+        return len(self._offsets)
+
+    def append(self, message):
+        """Add a message; the oldest ones are spilled once the window is full."""
+        self.messages.append(message)
+        self.memory_bytes += _message_bytes(message)
+        if len(self.messages) > self.window:
+            self._spill(self.messages[:-self.window])
+            self.messages = self.messages[-self.window:]
+
+    def _spill(self, messages):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for message in messages:
+                self._offsets.append(f.tell())
+                f.write(json.dumps(message, separators=(",", ":"), ensure_ascii=False) + "\n")
+                self.memory_bytes -= _message_bytes(message)
+
+    def load_older(self, count):
+        """
+        Read back the newest `count` spilled messages (oldest first).
+
+        Args:
+            count: Number of messages right before the in-memory window
+        """
+        count = min(count, len(self._offsets))
+        if not count:
+            return []
+        older = []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                f.seek(self._offsets[-count])
+                for _ in range(count):
+                    older.append(json.loads(f.readline()))
+        except FileNotFoundError:
+            # The log was removed (e.g. by the age-based cleanup): nothing older is left
+            logger.warning(f"Chat history log {self.path} is gone; older messages are no longer available")
+            self._offsets = []
+            return []
+        return older
+
+    def clear(self):
+        """Forget every message and delete the on-disk log."""
+        self.messages = []
+        self.memory_bytes = 0
+        self._offsets = []
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """Memory/disk footprint of this session."""
+        try:
+            disk_bytes = os.path.getsize(self.path)
+        except OSError:
+            disk_bytes = 0
+        return {
+            "in_memory": len(self.messages),
+            "spilled": self.spilled,
+            "memory_bytes": self.memory_bytes + sys.getsizeof(self._offsets),
+            "disk_bytes": disk_bytes,
+        }
+
+
+def live_log_paths():
+    """On-disk logs of the chat histories alive in this process (not to be cleaned up)."""
+    with _HISTORIES_LOCK:
+        return {os.path.abspath(history.path) for history in list(_HISTORIES.values())}
+
+
+def memory_report():
+    """
+    Per-session memory use of every live chat history in this process.
+
+    Returns:
+        Dict with "sessions", "total_memory_bytes", "max_memory_bytes" and
+        "per_session" (session id -> stats)
+    """
+    with _HISTORIES_LOCK:
+        per_session = {session_id: history.stats() for session_id, history in list(_HISTORIES.items())}
+    sizes = [stats["memory_bytes"] for stats in per_session.values()]
+    return {
+        "sessions": len(per_session),
+        "total_memory_bytes": sum(sizes),
+        "max_memory_bytes": max(sizes, default=0),
+        "per_session": per_session,
+    }
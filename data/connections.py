@@ -0,0 +1,234 @@
+# data/connections.py
+import os
+import queue
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+# SQLite refuses to ATTACH more than 10 databases unless compiled otherwise
+MAX_ATTACHED_DATABASES = 10
+DEFAULT_POOL_SIZE = 4
+POOL_TIMEOUT_SECONDS = 30
+# Pools kept open at once; the least recently used one is closed beyond this
+MAX_POOLS = 32
+
+
+def readonly_uri(db_path):
+    """Return a SQLite URI that opens `db_path` in read-only mode."""
+    return f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+
+
+def file_fingerprint(db_path):
+    """
+    Cheap change detector for a database file: [inode, mtime_ns, size].
+
+    The inode tells a file replaced by another one (e.g. a copy keeping the
+    old mtime and size) from the original. SQLite in WAL mode may hold recent
+    commits in the -wal file, so it is included when present.
+    """
+    fingerprint = []
+    for path in (db_path, f"{db_path}-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint += [stat.st_mtime_ns, stat.st_size]
+            if path == db_path:
+                fingerprint.insert(0, stat.st_ino)
+    return fingerprint
+
+
+def schema_alias(db_name):
+    """
+    Turn a registry name (e.g. "Northwind") into a schema name usable in SQL.
+
+    Examples: "Northwind" -> "northwind", "Sales 2024" -> "sales_2024"
+    """
+    alias = re.sub(r"\W+", "_", db_name.strip().lower()).strip("_")
+    if not alias or alias[0].isdigit():
+        alias = f"db_{alias}"
+    # "main" and "temp" are reserved schema names in SQLite
+    if alias in ("main", "temp"):
+        alias = f"{alias}_db"
+    return alias
+
+
+def connect_readonly(db_path, check_same_thread=True):
+    """Open a read-only connection to a single SQLite database."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database not found: {db_path}")
+    return sqlite3.connect(
+        readonly_uri(db_path), uri=True, check_same_thread=check_same_thread
+    )
+
+
+def connect_federated(databases, check_same_thread=True):
+    """
+    Open one read-only connection with every database ATTACHed under its own schema.
+
+    Args:
+        databases: Mapping of registry name -> database path
+        check_same_thread: Passed through to sqlite3.connect
+
+    Returns:
+        sqlite3.Connection where tables are addressed as <alias>.<table>,
+        e.g. northwind.Customer or chinook.Invoice
+    """
+    if not databases:
+        raise ValueError("At least one database is required for federated mode")
+    if len(databases) > MAX_ATTACHED_DATABASES:
+        raise ValueError(
+            f"Cannot attach {len(databases)} databases (SQLite limit is {MAX_ATTACHED_DATABASES})"
+        )
+
+    conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=check_same_thread)
+    try:
+        for name, path in databases.items():
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Database not found: {path}")
+            conn.execute(f"ATTACH DATABASE ? AS {schema_alias(name)}", (readonly_uri(path),))
+        # The in-memory main schema is writable, so lock the whole connection down
+        conn.execute("PRAGMA query_only = ON")
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def attached_schemas(conn):
+    """Return the attached schema names of a connection (excluding main/temp)."""
+    rows = conn.execute("PRAGMA database_list").fetchall()
+    # Format: (seq, name, file)
+    return [row[1] for row in rows if row[1] not in ("main", "temp")]
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only connections that can be shared between threads.
+
+    Each checkout gets a connection no other thread is using, so independent
+    queries can run concurrently (SQLite allows many readers at once).
+    """
+
+    def __init__(self, factory, max_size=DEFAULT_POOL_SIZE):
+        self.factory = factory
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool exhausted: wait for another thread to give a connection back
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a database connection")
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a `with` block."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if self.closed:
+                # The pool was evicted while this connection was checked out
+                conn.close()
+                with self._lock:
+                    self._created -= 1
+            else:
+                self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection; checked-out ones close when returned."""
+        self.closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_POOLS = OrderedDict()
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(db_path=None, databases=None, max_size=DEFAULT_POOL_SIZE):
+    """
+    Return the shared read-only pool for a database (or a federated set).
+
+    Args:
+        db_path: Path to a single SQLite database
+        databases: Mapping of registry name -> path for federated mode
+        max_size: Maximum number of open connections in a new pool
+
+    Returns:
+        ConnectionPool, created on first use and reused afterwards; at most
+        MAX_POOLS pools are kept, the least recently used is closed
+    """
+    if databases:
+        key = ("federated",) + tuple(sorted(databases.items()))
+        factory = lambda: connect_federated(dict(databases), check_same_thread=False)
+    elif db_path:
+        key = ("single", os.path.abspath(db_path))
+        factory = lambda: connect_readonly(db_path, check_same_thread=False)
+    else:
+        raise ValueError("db_path or databases is required")
+
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(factory, max_size=max_size)
+            while len(_POOLS) > MAX_POOLS:
+                _, evicted = _POOLS.popitem(last=False)
+                evicted.close()
+        _POOLS.move_to_end(key)
+        return pool
+
+
+def close_pools(db_path):
+    """
+    Close and forget every pool reading a database, alone or federated.
+
+    Used when the file changed, was replaced or removed: connections opened
+    on a replaced file keep reading the old one.
+
+    Returns:
+        Number of pools closed
+    """
+    path = os.path.abspath(db_path)
+    with _POOLS_LOCK:
+        keys = [
+            key for key in _POOLS
+            if key == ("single", path)
+            or (key[0] == "federated" and any(os.path.abspath(other) == path for _, other in key[1:]))
+        ]
+        for key in keys:
+            _POOLS.pop(key).close()
+    return len(keys)
@@ -0,0 +1,254 @@
+# data/dashboards.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+
+from data.connections import file_fingerprint, get_pool
+from data.db_registry import CONFIG_PATH, DATABASES, load_config
+from data.sql_rewriter import prepare_query
+
+logger = logging.getLogger(__name__)
+
+# Charts are kept under the images folder (served like generated charts) but
+# in their own subfolder, so the hourly image cleanup leaves them alone
+DASHBOARD_DIR = "generated_images/dashboards"
+MANIFEST_FILE = "manifest.json"
+DEFAULT_REFRESH_SECONDS = 60
+# Ignored when matching a question against chart titles and keywords
+MATCH_STOPWORDS = {"a", "an", "the", "by", "of", "per", "for", "in", "on", "to", "and", "with"}
+
+_MANIFEST_LOCK = threading.Lock()
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def _slug(name):
+    return re.sub(r"[^\w-]+", "_", str(name)).strip("_").lower()
+
+
+def dashboard_path(db_name, chart_name, directory=DASHBOARD_DIR):
+    """Fixed file of a chart, so links to it stay valid across refreshes."""
+    return f"{directory}/{_slug(db_name)}__{_slug(chart_name)}.png"
+
+
+def load_specs(config):
+    """
+    Chart specs from the `dashboards` section of config.yaml.
+
+    Returns:
+        List of dicts with "database", "name", "title", "query", "plot_type",
+        "x_column", "y_column", "keywords" and "path"
+    """
+    specs = []
+    for db_name, charts in (config.get("dashboards") or {}).items():
+        for name, chart in (charts or {}).items():
+            specs.append({
+                "database": db_name,
+                "name": name,
+                "title": chart.get("title", name),
+                "query": chart["query"],
+                "plot_type": chart.get("plot_type", "bar"),
+                "x_column": chart.get("x_column"),
+                "y_column": chart.get("y_column"),
+                "keywords": [keyword.lower() for keyword in chart.get("keywords", [])],
+                "path": dashboard_path(db_name, name),
+            })
+    return specs
+
+
+def _spec_hash(spec):
+    """Charts are re-rendered when their spec is edited, not only when data changes."""
+    fields = [spec[field] for field in ("query", "plot_type", "title", "x_column", "y_column")]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()[:16]
+
+
+def _manifest_path(directory=DASHBOARD_DIR):
+    return os.path.join(directory, MANIFEST_FILE)
+
+
+def read_manifest(directory=DASHBOARD_DIR):
+    """Chart path -> render record ({database, name, title, rendered_at, rows, ...})."""
+    try:
+        with open(_manifest_path(directory)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest, directory=DASHBOARD_DIR):
+    temp_path = f"{_manifest_path(directory)}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, _manifest_path(directory))
+
+
+def render_chart(spec, db_path):
+    """
+    Run a chart's query and draw it with VisualizationTool.
+
+    The PNG is written to a temporary file and moved into place, so readers
+    never see a half-written chart.
+
+    Returns:
+        Number of rows plotted
+    """
+    from tools.visualization_tool import VisualizationTool
+
+    with get_pool(db_path=db_path).connection() as conn:
+        df = pd.read_sql_query(prepare_query(conn, spec["query"]), conn)
+    if df.empty:
+        raise ValueError("query returned no rows")
+
+    temp_path = spec["path"].replace(".png", ".tmp.png")
+    result = VisualizationTool()._run(
+        df.to_csv(index=False), spec["plot_type"], spec["title"],
+        spec["x_column"], spec["y_column"], temp_path,
+    )
+    if not result.startswith("Success"):
+        raise RuntimeError(result)
+    os.replace(temp_path, spec["path"])
+    return len(df)
+
+
+def refresh_dashboards(config_path=CONFIG_PATH, force=False):
+    """
+    Re-render the charts whose database changed (file fingerprint) or whose
+    spec was edited since the last render.
+
+    Args:
+        config_path: Path of config.yaml
+        force: Re-render every chart
+
+    Returns:
+        Paths of the charts that were rendered
+    """
+    specs = load_specs(load_config(config_path))
+    os.makedirs(DASHBOARD_DIR, exist_ok=True)
+    with _MANIFEST_LOCK:
+        manifest = read_manifest()
+        rendered = []
+        for spec in specs:
+            db_path = DATABASES.get(spec["database"])
+            if db_path is None:
+                continue
+            fingerprint = file_fingerprint(db_path)
+            spec_hash = _spec_hash(spec)
+            record = manifest.get(spec["path"], {})
+            # Unchanged since the last attempt (failed charts wait for a data or spec change too)
+            if (not force and record.get("fingerprint") == fingerprint and record.get("spec") == spec_hash
+                    and (record.get("error") or os.path.exists(spec["path"]))):
+                continue
+
+            start = time.perf_counter()
+            try:
+                rows = render_chart(spec, db_path)
+            except Exception as e:
+                # A stale chart is better than none: keep the previous file
+                logger.warning(f"Dashboard chart {spec['database']}/{spec['name']} failed: {e}")
+                manifest[spec["path"]] = dict(record, error=str(e), fingerprint=fingerprint, spec=spec_hash)
+                continue
+            manifest[spec["path"]] = {
+                "database": spec["database"],
+                "name": spec["name"],
+                "title": spec["title"],
+                "keywords": spec["keywords"],
+                "fingerprint": fingerprint,
+                "spec": spec_hash,
+                "rows": rows,
+                "rendered_at": time.time(),
+                "render_seconds": round(time.perf_counter() - start, 3),
+                "error": None,
+            }
+            rendered.append(spec["path"])
+
+        # Charts removed from config.yaml are no longer served
+        current = {spec["path"] for spec in specs}
+        for path in [path for path in manifest if path not in current]:
+            del manifest[path]
+            if os.path.exists(path):
+                os.remove(path)
+        _write_manifest(manifest)
+
+    if rendered:
+        logger.info(f"Rendered {len(rendered)} dashboard charts")
+    return rendered
+
+
+def list_dashboards(db_names):
+    """
+    Rendered charts of the given databases, ready to be served.
+
+    Returns:
+        List of manifest records (with "path") sorted by database and title
+    """
+    charts = [
+        dict(record, path=path)
+        for path, record in read_manifest().items()
+        if record.get("database") in db_names and record.get("rendered_at") and os.path.exists(path)
+    ]
+    return sorted(charts, key=lambda chart: (chart["database"], chart["title"]))
+
+
+def _content_words(text):
+    """Words of a phrase that carry meaning, singular: "Top customers by sales" -> {top, customer, sale}."""
+    return {
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in re.findall(r"\w+", text.lower())
+        if word not in MATCH_STOPWORDS
+    }
+
+
+def find_dashboards(question, db_names):
+    """
+    Charts of the given databases that match a question, best match first.
+
+    A chart matches when all content words of its title or of one of its
+    keywords appear in the question; one shared word ("sales") is not
+    enough. Charts matching on more words come first.
+    """
+    words = _content_words(question)
+    matches = []
+    for chart in list_dashboards(db_names):
+        phrases = [_content_words(phrase) for phrase in chart.get("keywords", []) + [chart["title"]]]
+        score = max((len(phrase) for phrase in phrases if phrase and phrase <= words), default=0)
+        if score:
+            matches.append((score, chart))
+    return [chart for _, chart in sorted(matches, key=lambda match: -match[0])]
+
+
+class DashboardScheduler(threading.Thread):
+    """Keeps the dashboard charts current by calling refresh_dashboards() periodically."""
+
+    def __init__(self, config_path=CONFIG_PATH, interval=None):
+        super().__init__(name="dashboard-scheduler", daemon=True)
+        self.config_path = config_path
+        self.interval = interval or load_config(config_path).get("dashboard_refresh_seconds", DEFAULT_REFRESH_SECONDS)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                refresh_dashboards(self.config_path)
+            except Exception as e:
+                logger.error(f"Dashboard refresh failed: {e}")
+            if self._stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_dashboard_scheduler(config_path=CONFIG_PATH):
+    """Start the background scheduler once per process (later calls are no-ops)."""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None or not _SCHEDULER.is_alive():
+            _SCHEDULER = DashboardScheduler(config_path)
+            _SCHEDULER.start()
+        return _SCHEDULER
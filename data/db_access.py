@@ -1,7 +1,9 @@
 # data/db_access.py
 import sqlite3
 import pandas as pd
-from data.db_registry import DATABASES, USER_DB_ACCESS
+from data.db_registry import DATABASES, USER_DB_ACCESS, FEDERATED_ROLES
+from data.connections import get_pool
+from data.sql_rewriter import prepare_query
 
 
 def list_tables(user, db_name):
@@ -113,29 +115,61 @@ def execute_query(user, db_name, query):
         
     Returns:
         pandas DataFrame with query results
+        
+    Raises:
+        PermissionError: role cannot access the database
+        QueryValidationError: query is not a single read-only SELECT or fails to compile
     """
     if db_name not in USER_DB_ACCESS.get(user, []):
         raise PermissionError("Access denied")
     
-    # Only allow SELECT queries for security
-    if not query.strip().upper().startswith('SELECT'):
-        raise ValueError("Only SELECT queries are allowed")
-    
-    # Auto-escape common reserved keywords in the query
-    RESERVED_KEYWORDS = ['Order', 'User', 'Group']
-    for keyword in RESERVED_KEYWORDS:
-        # Replace various patterns where reserved words appear
-        query = query.replace(f' FROM {keyword} ', f' FROM [{keyword}] ')
-        query = query.replace(f' FROM {keyword};', f' FROM [{keyword}];')
-        query = query.replace(f' FROM {keyword}\n', f' FROM [{keyword}]\n')
-        query = query.replace(f' JOIN {keyword} ', f' JOIN [{keyword}] ')
-        query = query.replace(f' JOIN {keyword}\n', f' JOIN [{keyword}]\n')
-    
-    conn = sqlite3.connect(DATABASES[db_name])
-    
-    try:
+    with get_pool(db_path=DATABASES[db_name]).connection() as conn:
+        # Read-only check, keyword quoting and local validation
+        # (raises QueryValidationError, a ValueError)
+        query = prepare_query(conn, query)
         df = pd.read_sql_query(query, conn)
-    finally:
-        conn.close()
     
-    return df
\ No newline at end of file
+    return df
+
+
+def federated_databases(user):
+    """
+    Return every database the role may query together in federated mode.
+
+    Args:
+        user: User role (admin, analyst, guest)
+
+    Returns:
+        Dict of database name -> path, in registry order
+    """
+    if user not in FEDERATED_ROLES:
+        raise PermissionError("Federated access denied")
+
+    allowed = USER_DB_ACCESS.get(user, [])
+    databases = {name: path for name, path in DATABASES.items() if name in allowed}
+    if not databases:
+        raise PermissionError("Access denied")
+    return databases
+
+
+def execute_federated_query(user, query):
+    """
+    Execute a SELECT query across all databases the role can access.
+
+    Tables are namespaced by database, e.g. northwind.Customer or chinook.Invoice,
+    so cross-database joins run inside SQLite in a single pass.
+
+    Args:
+        user: User role
+        query: SQL query to execute
+
+    Returns:
+        pandas DataFrame with query results
+    """
+    databases = federated_databases(user)
+
+    with get_pool(databases=databases).connection() as conn:
+        query = prepare_query(conn, query)
+        df = pd.read_sql_query(query, conn)
+
+    return df
@@ -1,13 +1,253 @@
 # data/db_registry.py
+import logging
+import os
+import threading
+import time
 
-DATABASES = {
-    "Northwind": "input_files/database/northwind_small.sqlite",
-    "Chinook":  "input_files/database/chinook.db",
-    "Sakila":   "input_files/database/sakila.db"
+from omegaconf import OmegaConf
+
+from data.connections import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.getenv("AGENT_CONFIG", "config.yaml")
+DATABASE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+# Files the tools keep next to a database (see data/sampling.py), not databases
+SIDECAR_SUFFIXES = (".samples.sqlite",)
+DEFAULT_RELOAD_SECONDS = 10
+# In user_db_access, grants every database of the registry
+ALL_DATABASES = "*"
+
+# Used when config.yaml is missing or has no registry sections; settings of
+# other modules (export_limits, token_budgets, ...) have their defaults there
+DEFAULT_CONFIG = {
+    "database_path": "input_files/database",
+    "databases": {
+        "Northwind": "northwind_small.sqlite",
+        "Chinook": "chinook.db",
+        "Sakila": "sakila.db",
+    },
+    "user_db_access": {
+        "admin": [ALL_DATABASES],
+        "analyst": ["Northwind", "Chinook"],
+        "guest": [],
+    },
+    # Roles allowed to query all of their databases at once through ATTACH
+    "federated_roles": ["admin", "analyst"],
+    "registry_reload_seconds": DEFAULT_RELOAD_SECONDS,
 }
 
-USER_DB_ACCESS = {
-    "admin": ["Northwind", "Chinook", "Sakila"],
-    "analyst": ["Northwind", "Chinook"],
-    "guest": []
-}
\ No newline at end of file
+# Filled from config.yaml below and updated in place by reload_registry(),
+# so `from data.db_registry import DATABASES` always sees the current registry
+DATABASES = {}
+USER_DB_ACCESS = {}
+FEDERATED_ROLES = []
+
+# Path -> file fingerprint when last published, to spot changed databases
+_FINGERPRINTS = {}
+_RELOAD_LOCK = threading.Lock()
+_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+
+def load_config(config_path=CONFIG_PATH):
+    """config.yaml merged over DEFAULT_CONFIG, as a plain dict."""
+    config = OmegaConf.create(DEFAULT_CONFIG)
+    if os.path.exists(config_path):
+        config = OmegaConf.merge(config, OmegaConf.load(config_path))
+    return OmegaConf.to_container(config, resolve=True)
+
+
+def _is_database_file(filename):
+    filename = filename.lower()
+    return filename.endswith(DATABASE_EXTENSIONS) and not filename.endswith(SIDECAR_SUFFIXES)
+
+
+def discover_databases(config, config_path=CONFIG_PATH):
+    """
+    Registry name -> path of every database in `database_path`.
+
+    Files listed under `databases` keep their configured name; any other
+    .db/.sqlite file is named after the file ("sales_2024.db" -> "Sales_2024").
+    Relative paths are resolved against the config file's folder.
+    """
+    base = os.path.dirname(os.path.abspath(config_path))
+    folder = os.path.join(base, config["database_path"])
+    names = {os.path.normcase(os.path.join(folder, path)): name for name, path in config["databases"].items()}
+
+    databases = {}
+    for name, path in config["databases"].items():
+        full_path = os.path.join(folder, path)
+        if os.path.exists(full_path):
+            databases[name] = full_path
+    if os.path.isdir(folder):
+        for filename in sorted(os.listdir(folder)):
+            full_path = os.path.join(folder, filename)
+            if _is_database_file(filename) and os.path.normcase(full_path) not in names:
+                name = os.path.splitext(filename)[0]
+                databases.setdefault(name[:1].upper() + name[1:], full_path)
+    return databases
+
+
+def resolve_access(config, databases):
+    """Role -> database names it may use, limited to databases that exist."""
+    access = {}
+    for role, names in config["user_db_access"].items():
+        allowed = list(databases) if ALL_DATABASES in names else [name for name in names if name in databases]
+        access[role.lower()] = allowed
+    return access
+
+
+def _apply(target, new):
+    """Update a registry dict in place (no moment where it is empty)."""
+    for key in [key for key in target if key not in new]:
+        del target[key]
+    target.update(new)
+
+
+def warm_database(db_path):
+    """
+    Prepare a database before users see it: open its connection pool,
+    compute the statistics catalog and value index and cache the schema text.
+    """
+    from data.connections import get_pool
+    from data.stats_catalog import load_catalog
+    from data.value_index import get_value_index
+    from tools.schema_tool import SchemaTool
+
+    start = time.perf_counter()
+    with get_pool(db_path=db_path).connection() as conn:
+        conn.execute("SELECT 1").fetchone()
+    load_catalog(db_path)
+    get_value_index(db_path)
+    SchemaTool()._describe(db_path)
+    logger.info(f"Warmed {db_path} in {time.perf_counter() - start:.2f}s")
+
+
+def release_database(db_path):
+    """
+    Forget what is cached in memory for a database: close its connection
+    pools (federated ones included) and drop its statistics catalog and
+    value index. Used before a changed or replaced file is warmed again and
+    when a database leaves the registry; sidecar files of a file that no
+    longer exists are deleted.
+    """
+    from data.connections import close_pools
+    from data.sampling import sample_path
+    from data.stats_catalog import forget_catalog, sidecar_path as stats_path
+    from data.value_index import forget_value_index, sidecar_path as values_path
+
+    close_pools(db_path)
+    forget_catalog(db_path)
+    forget_value_index(db_path)
+    if not os.path.exists(db_path):
+        for path in (stats_path(db_path), values_path(db_path), sample_path(db_path)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {e}")
+
+
+def reload_registry(config_path=CONFIG_PATH, warm=None):
+    """
+    Re-read config.yaml and the database folder and update the registry.
+
+    Args:
+        config_path: Path of config.yaml
+        warm: Optional callable run on every new or changed database before
+            it is published; databases it fails on are left out
+
+    Returns:
+        Names of databases that were added, changed or removed
+    """
+    with _RELOAD_LOCK:
+        config = load_config(config_path)
+        discovered = discover_databases(config, config_path)
+
+        databases = {}
+        changed = []
+        for name, path in discovered.items():
+            fingerprint = file_fingerprint(path)
+            is_new = DATABASES.get(name) != path or _FINGERPRINTS.get(path) != fingerprint
+            if is_new and path in _FINGERPRINTS:
+                # Pools opened on a replaced file keep reading the old one
+                release_database(path)
+            if is_new and warm is not None:
+                try:
+                    warm(path)
+                except Exception as e:
+                    logger.warning(f"Warm-up failed for {name}: {e}")
+                    # New databases are only published once they are usable
+                    if name not in DATABASES:
+                        continue
+            if is_new:
+                changed.append(name)
+            _FINGERPRINTS[path] = fingerprint
+            databases[name] = path
+        changed += [name for name in DATABASES if name not in databases]
+        for path in set(DATABASES.values()) - set(databases.values()):
+            release_database(path)
+            _FINGERPRINTS.pop(path, None)
+
+        _apply(DATABASES, databases)
+        _apply(USER_DB_ACCESS, resolve_access(config, databases))
+        FEDERATED_ROLES[:] = [role.lower() for role in config["federated_roles"]]
+        if changed:
+            logger.info(f"Database registry updated: {', '.join(changed)}")
+        return changed
+
+
+class RegistryWatcher(threading.Thread):
+    """Polls config.yaml and the database folder and reloads the registry on change."""
+
+    def __init__(self, config_path=CONFIG_PATH, interval=None, warm=warm_database):
+        super().__init__(name="registry-watcher", daemon=True)
+        self.config_path = config_path
+        self.interval = interval or load_config(config_path)["registry_reload_seconds"]
+        self.warm = warm
+        self._stop_event = threading.Event()
+
+    def _state(self):
+        """Cheap snapshot of everything a reload depends on."""
+        config = load_config(self.config_path)
+        folder = os.path.join(os.path.dirname(os.path.abspath(self.config_path)), config["database_path"])
+        files = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        return (
+            file_fingerprint(self.config_path),
+            [(name, file_fingerprint(os.path.join(folder, name))) for name in files if _is_database_file(name)],
+        )
+
+    def run(self):
+        # Databases loaded at import were published cold; warm them first
+        for path in list(DATABASES.values()):
+            try:
+                self.warm(path)
+            except Exception as e:
+                logger.warning(f"Warm-up failed for {path}: {e}")
+        state = self._state()
+        while not self._stop_event.wait(self.interval):
+            try:
+                current = self._state()
+                if current != state:
+                    reload_registry(self.config_path, warm=self.warm)
+                    state = current
+            except Exception as e:
+                logger.error(f"Registry reload failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_registry_watcher(config_path=CONFIG_PATH):
+    """Start the background watcher once per process (later calls are no-ops)."""
+    global _WATCHER
+    with _WATCHER_LOCK:
+        if _WATCHER is None or not _WATCHER.is_alive():
+            _WATCHER = RegistryWatcher(config_path)
+            _WATCHER.start()
+        return _WATCHER
+
+
+reload_registry()
@@ -0,0 +1,213 @@
+# data/export.py
+import csv
+import gzip
+import io
+import logging
+import os
+import re
+import time
+import uuid
+
+from data.db_registry import load_config
+
+logger = logging.getLogger(__name__)
+
+# Exports sit next to the generated charts and are cleaned up with them
+EXPORT_DIR = "generated_images"
+EXPORT_FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+EXPORT_FILE_PATTERN = r"export_[\w-]+\.(?:csv\.gz|parquet)"
+EXPORT_PATH_PATTERN = re.compile(rf"{EXPORT_DIR}/{EXPORT_FILE_PATTERN}")
+# Rows fetched from SQLite (and written) per chunk
+FETCH_ROWS = 5000
+# Used for roles missing from export_limits in config.yaml; max_rows/max_mb of 0 disables exports
+DEFAULT_EXPORT_LIMITS = {
+    "admin": {"max_rows": 5000000, "max_mb": 500},
+    "analyst": {"max_rows": 1000000, "max_mb": 100},
+    "default": {"max_rows": 0, "max_mb": 0},
+}
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+
+def export_limits(role):
+    """
+    Export limits of a role from config.yaml (export_limits, over
+    DEFAULT_EXPORT_LIMITS), falling back to the "default" entry.
+
+    Returns:
+        Dict with "max_rows" and "max_mb" (0 disables exports)
+    """
+    limits = dict(DEFAULT_EXPORT_LIMITS, **load_config().get("export_limits", {}))
+    return limits.get((role or "").lower(), limits["default"])
+
+
+def export_path(fmt, directory=EXPORT_DIR):
+    """New unique file name in the export directory (with '/' like chart paths)."""
+    return f"{directory}/export_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}{EXPORT_FORMATS[fmt]}"
+
+
+class _CsvGzWriter:
+    """Streams rows into a gzip-compressed CSV file."""
+
+    def __init__(self, path, columns):
+        self._raw = open(path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._text.flush()
+
+    def bytes_written(self):
+        return self._raw.tell()
+
+    def close(self):
+        self._text.close()
+        self._raw.close()
+
+
+def _arrow_type(values):
+    """Column type from the first non-null value of a chunk (SQLite types are per value)."""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return pa.bool_()
+        if isinstance(value, int):
+            return pa.int64()
+        if isinstance(value, float):
+            return pa.float64()
+        if isinstance(value, bytes):
+            return pa.binary()
+        return pa.string()
+    return pa.string()
+
+
+class _ParquetWriter:
+    """Streams rows into a Parquet file, one row group per chunk."""
+
+    def __init__(self, path, columns):
+        if pa is None:
+            raise ImportError("Parquet export requires pyarrow (pip install pyarrow); use format='csv'")
+        self._path = path
+        self._columns = columns
+        self._schema = None
+        self._writer = None
+
+    def _array(self, values, field_type):
+        try:
+            return pa.array(values, type=field_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed SQLite types in one column: integers that turn into
+            # floats are widened, anything else is written as text
+            if pa.types.is_integer(field_type):
+                try:
+                    return pa.array([None if v is None else float(v) for v in values], type=pa.float64())
+                except (TypeError, ValueError):
+                    pass
+            return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        if self._schema is None:
+            self._schema = pa.schema(
+                [pa.field(name, _arrow_type(values)) for name, values in zip(self._columns, columns)]
+            )
+            self._writer = pq.ParquetWriter(self._path, self._schema, compression="snappy")
+        arrays = []
+        for field, values in zip(self._schema, columns):
+            array = self._array(list(values), field.type)
+            if array.type != field.type:
+                raise ValueError(
+                    f"Column '{field.name}' changes type mid-result ({field.type} -> {array.type}); "
+                    "CAST it in the query or export as CSV"
+                )
+            arrays.append(array)
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def bytes_written(self):
+        return os.path.getsize(self._path) if os.path.exists(self._path) else 0
+
+    def close(self):
+        if self._writer is None:
+            # Empty result: still produce a valid file with the column names
+            pq.write_table(pa.table({name: pa.array([], pa.string()) for name in self._columns}), self._path)
+        else:
+            self._writer.close()
+
+
+def export_query(conn, query, path, fmt="csv", max_rows=None, max_bytes=None, progress=None):
+    """
+    Stream a query result into a compressed CSV or Parquet file.
+
+    Rows are fetched and written FETCH_ROWS at a time, so memory use does
+    not depend on the size of the result. Writing stops at max_rows rows or
+    once the file reaches max_bytes; the result is then marked truncated.
+
+    Args:
+        conn: sqlite3 connection (the query should already be validated)
+        query: SELECT query
+        path: Output file
+        fmt: "csv" (gzip-compressed) or "parquet"
+        max_rows: Optional row limit
+        max_bytes: Optional file size limit
+        progress: Optional callable(rows_written, bytes_written) called after every chunk
+
+    Returns:
+        Dict with "path", "format", "rows", "bytes", "truncated" and "seconds"
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}")
+
+    start = time.perf_counter()
+    cursor = conn.execute(query)
+    columns = [description[0] for description in cursor.description]
+    writer = (_CsvGzWriter if fmt == "csv" else _ParquetWriter)(path, columns)
+    rows_written = 0
+    truncated = False
+    try:
+        while True:
+            batch = cursor.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            if max_rows is not None and rows_written + len(batch) > max_rows:
+                batch = batch[:max_rows - rows_written]
+                truncated = True
+            if batch:
+                writer.write(batch)
+                rows_written += len(batch)
+            if progress:
+                progress(rows_written, writer.bytes_written())
+            if truncated:
+                break
+            if max_bytes is not None and writer.bytes_written() >= max_bytes:
+                truncated = cursor.fetchone() is not None
+                break
+        writer.close()
+    except Exception:
+        writer.close()
+        os.remove(path)
+        raise
+    finally:
+        cursor.close()
+
+    result = {
+        "path": path,
+        "format": fmt,
+        "rows": rows_written,
+        "bytes": os.path.getsize(path),
+        "truncated": truncated,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    logger.info(
+        f"Exported {rows_written} rows to {path} ({result['bytes']} bytes, {result['seconds']}s"
+        f"{', truncated' if truncated else ''})"
+    )
+    return result
@@ -0,0 +1,340 @@
+# data/metrics.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from data.db_registry import load_config
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = os.getenv("METRICS_PATH", "metrics.sqlite")
+BUSY_TIMEOUT_MS = 5000
+# Upper bounds (seconds) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS = (2, 5, 10, 20, 30, 60, 120)
+DAY_SECONDS = 24 * 3600
+
+# Budget levels, from cheapest to most expensive to serve
+NORMAL = "normal"
+ECONOMY = "economy"
+MINIMAL = "minimal"
+# Conversation memory handed to the model once a user is over budget
+MINIMAL_MEMORY_TOKENS = 2000
+
+# USD per million tokens; model_prices in config.yaml adds or overrides models
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o": {"prompt": 2.5, "completion": 10.0},
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.6},
+}
+# Overridden key by key by token_budgets in config.yaml (0 daily tokens = unlimited)
+DEFAULT_TOKEN_BUDGETS = {
+    "model": "gpt-4o",
+    "economy_model": "gpt-4o-mini",
+    "economy_at": 0.8,
+    "daily_tokens": {"admin": 0, "default": 0},
+}
+
+FIELDS = (
+    "ts", "username", "role", "database", "model", "prompt_tokens", "completion_tokens",
+    "total_tokens", "cost_usd", "steps", "tool_calls", "wall_seconds", "status", "budget_level",
+)
+
+_STORES = {}
+_STORES_GUARD = threading.Lock()
+
+
+def _empty_usage():
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "steps": 0, "tool_calls": 0,
+            "by_model": {}, "model": None}
+
+
+def _add_model_call(usage, message):
+    """Count one model response (an AI message) into a usage dict."""
+    usage["steps"] += 1
+    usage["tool_calls"] += len(getattr(message, "tool_calls", None) or [])
+    tokens = getattr(message, "usage_metadata", None) or {}
+    usage["prompt_tokens"] += tokens.get("input_tokens", 0)
+    usage["completion_tokens"] += tokens.get("output_tokens", 0)
+    model = (getattr(message, "response_metadata", None) or {}).get("model_name")
+    if model:
+        model_tokens = usage["by_model"].setdefault(model, [0, 0])
+        model_tokens[0] += tokens.get("input_tokens", 0)
+        model_tokens[1] += tokens.get("output_tokens", 0)
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    usage["model"] = "+".join(sorted(usage["by_model"])) or None
+
+
+def turn_usage(result):
+    """
+    Token usage of the last turn of an agent result.
+
+    Only messages after the last user message are counted: with a
+    checkpointer the result holds the whole conversation.
+
+    Returns:
+        Dict with "prompt_tokens", "completion_tokens", "total_tokens",
+        "steps" (model calls), "tool_calls", "by_model" (model ->
+        [prompt, completion] tokens, steps may use different models) and
+        "model" (the models used joined with "+", None if unknown)
+    """
+    messages = result.get("messages", []) if isinstance(result, dict) else []
+    start = 0
+    for i, message in enumerate(messages):
+        if getattr(message, "type", None) == "human":
+            start = i + 1
+
+    usage = _empty_usage()
+    for message in messages[start:]:
+        if getattr(message, "type", None) == "ai":
+            _add_model_call(usage, message)
+    return usage
+
+
+class UsageCallback(BaseCallbackHandler):
+    """
+    Counts the tokens of each model call as it finishes.
+
+    Passed in the agent's config callbacks, it still has the usage of the
+    calls made before a request failed (timeout, recursion limit, model
+    error), when there is no result for turn_usage() to read.
+    """
+
+    def __init__(self):
+        self._usage = _empty_usage()
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    with self._lock:
+                        _add_model_call(self._usage, message)
+
+    def usage(self):
+        """Usage so far, shaped like turn_usage()."""
+        with self._lock:
+            by_model = {model: list(tokens) for model, tokens in self._usage["by_model"].items()}
+            return dict(self._usage, by_model=by_model)
+
+
+def _model_prices():
+    return dict(DEFAULT_MODEL_PRICES, **load_config().get("model_prices", {}))
+
+
+def turn_cost(usage, prices=None):
+    """Cost in USD of a turn_usage() result, priced per model."""
+    prices = _model_prices() if prices is None else prices
+    return sum(
+        request_cost(model, prompt, completion, prices) for model, (prompt, completion) in usage["by_model"].items()
+    )
+
+
+def request_cost(model, prompt_tokens, completion_tokens, prices=None):
+    """
+    Cost in USD from the per-million-token prices in config.yaml (model_prices).
+
+    Dated model names ("gpt-4o-2024-08-06") use the price of the longest
+    configured prefix; unknown models cost 0.
+    """
+    prices = _model_prices() if prices is None else prices
+    names = [name for name in prices if model and model.startswith(name)]
+    if not names:
+        return 0.0
+    price = prices[max(names, key=len)]
+    return (prompt_tokens * price["prompt"] + completion_tokens * price["completion"]) / 1_000_000
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class MetricsStore:
+    """
+    One row per agent request (tokens, cost, steps, wall time) in a local
+    SQLite WAL file, shared by every app/worker process on the host.
+    """
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            "ts REAL, username TEXT, role TEXT, database TEXT, model TEXT, "
+            "prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER, cost_usd REAL, "
+            "steps INTEGER, tool_calls INTEGER, wall_seconds REAL, status TEXT, budget_level TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS requests_user_ts ON requests (username, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts)")
+
+    def _connection(self):
+        """One connection per thread; sqlite3 connections are not shared."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, **fields):
+        """Store one request; missing fields are NULL. Failures are only logged."""
+        fields.setdefault("ts", time.time())
+        try:
+            self._connection().execute(
+                f"INSERT INTO requests ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                [fields.get(field) for field in FIELDS],
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record request metrics: {e}")
+
+    def tokens_used(self, username, since):
+        """Total tokens of a user's requests since the `since` timestamp."""
+        row = self._connection().execute(
+            "SELECT COALESCE(SUM(total_tokens), 0) FROM requests WHERE username = ? AND ts >= ?",
+            (username, since),
+        ).fetchone()
+        return row[0]
+
+    def rollup(self, group_by="username", since=0):
+        """
+        Per-user (or per-database / per-model) totals and latency percentiles.
+
+        Args:
+            group_by: "username", "database", "model" or "role"
+            since: Only count requests from this timestamp on
+
+        Returns:
+            List of dicts, most expensive first
+        """
+        if group_by not in ("username", "database", "model", "role"):
+            raise ValueError(f"Cannot group request metrics by '{group_by}'")
+        groups = {}
+        for key, tokens, cost, seconds, status in self._connection().execute(
+            f"SELECT {group_by}, total_tokens, cost_usd, wall_seconds, status FROM requests WHERE ts >= ?",
+            (since,),
+        ):
+            group = groups.setdefault(key, {"tokens": 0, "cost_usd": 0.0, "errors": 0, "latencies": []})
+            group["tokens"] += tokens or 0
+            group["cost_usd"] += cost or 0.0
+            group["errors"] += status != "ok"
+            group["latencies"].append(seconds or 0.0)
+
+        rows = []
+        for key, group in groups.items():
+            latencies = sorted(group["latencies"])
+            rows.append({
+                group_by: key,
+                "requests": len(latencies),
+                "errors": group["errors"],
+                "tokens": group["tokens"],
+                "cost_usd": round(group["cost_usd"], 4),
+                "p50_seconds": round(_percentile(latencies, 0.5), 2),
+                "p95_seconds": round(_percentile(latencies, 0.95), 2),
+                "max_seconds": round(latencies[-1], 2),
+            })
+        return sorted(rows, key=lambda row: -row["cost_usd"])
+
+    def latency_histogram(self, since=0, username=None):
+        """
+        Request counts per wall-time bucket.
+
+        Returns:
+            Dict of bucket label ("<2s", ..., ">=120s") -> count, in bucket order
+        """
+        labels = [f"<{bound}s" for bound in LATENCY_BUCKETS] + [f">={LATENCY_BUCKETS[-1]}s"]
+        histogram = dict.fromkeys(labels, 0)
+        query = "SELECT wall_seconds FROM requests WHERE ts >= ?"
+        params = [since]
+        if username:
+            query += " AND username = ?"
+            params.append(username)
+        for (seconds,) in self._connection().execute(query, params):
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if (seconds or 0) < bound), len(LATENCY_BUCKETS))
+            histogram[labels[index]] += 1
+        return histogram
+
+
+def get_metrics_store(path=None):
+    """
+    Process-wide MetricsStore for `path` (default: METRICS_PATH), or None
+    when the metrics file cannot be opened.
+    """
+    path = os.path.abspath(path or METRICS_PATH)
+    with _STORES_GUARD:
+        if path not in _STORES:
+            try:
+                _STORES[path] = MetricsStore(path)
+            except sqlite3.Error as e:
+                logger.warning(f"Metrics store unavailable at {path}: {e}")
+                return None
+        return _STORES[path]
+
+
+def budget_status(username, role, store=None):
+    """
+    Where a user stands against the daily token budget of their role
+    (token_budgets in config.yaml), and how their agent should run.
+
+    Below `economy_at` of the budget the configured model is used; past it
+    the cheaper economy model; past the whole budget the economy model in
+    approximate mode with a shorter conversation memory. Requests are never
+    refused.
+
+    Returns:
+        Dict with "level", "used", "limit" (0 = unlimited), "model",
+        "approximate" and "memory_tokens" (None = default)
+    """
+    budgets = dict(DEFAULT_TOKEN_BUDGETS, **load_config().get("token_budgets", {}))
+    daily = budgets["daily_tokens"]
+    limit = daily.get((role or "").lower(), daily.get("default", 0))
+    store = store or get_metrics_store()
+    used = store.tokens_used(username, time.time() - DAY_SECONDS) if store is not None and limit else 0
+
+    status = {
+        "level": NORMAL, "used": used, "limit": limit, "model": budgets["model"],
+        "approximate": False, "memory_tokens": None,
+    }
+    if limit and used >= limit:
+        status.update(level=MINIMAL, model=budgets["economy_model"],
+                      approximate=True, memory_tokens=MINIMAL_MEMORY_TOKENS)
+    elif limit and used >= limit * budgets["economy_at"]:
+        status.update(level=ECONOMY, model=budgets["economy_model"])
+    return status
+
+
+def record_request_metrics(result, status, wall_seconds, username, user_role, database, budget,
+                           partial_usage=None):
+    """
+    Store tokens, cost, agent steps and wall time of one request in the metrics store.
+
+    Usage is read from the result; when there is none (the agent raised)
+    `partial_usage`, counted by a UsageCallback while the agent ran, is used.
+    """
+    usage = turn_usage(result)
+    if not usage["steps"] and partial_usage:
+        usage = partial_usage
+    model = usage["model"] or (budget or {}).get("model")
+    cost = turn_cost(usage)
+    store = get_metrics_store()
+    if store is not None:
+        store.record(
+            username=username, role=user_role, database=database, model=model,
+            prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"],
+            total_tokens=usage["total_tokens"], cost_usd=cost, steps=usage["steps"],
+            tool_calls=usage["tool_calls"], wall_seconds=wall_seconds, status=status,
+            budget_level=(budget or {}).get("level"),
+        )
+    logger.info(
+        f"Request metrics for {username}: {usage['total_tokens']} tokens "
+        f"({usage['prompt_tokens']} prompt / {usage['completion_tokens']} completion), "
+        f"{model}, {usage['steps']} steps, {wall_seconds:.2f}s, ${cost:.4f}, {status}"
+    )
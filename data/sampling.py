@@ -0,0 +1,351 @@
+# data/sampling.py
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+from data.connections import file_fingerprint, readonly_uri
+from data.sql_rewriter import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Tables with at least this many rows get a sample
+LARGE_TABLE_ROWS = 100000
+# Target sample size per table; the sampling rate is derived from it
+TARGET_SAMPLE_ROWS = 20000
+MIN_SAMPLE_RATE = 0.001
+Z_95 = 1.96
+
+# Rows are kept when a multiplicative hash of their rowid falls under a
+# threshold: deterministic, so rows appended later can be sampled incrementally
+HASH_MULTIPLIER = 2654435761
+HASH_MODULUS = 2 ** 32
+# Aggregates whose value grows with the number of rows read; TOTAL is SUM returning 0.0 on no rows
+SCALED_AGGREGATES = ("COUNT", "SUM", "TOTAL")
+SCALED_CALL_PATTERN = re.compile(rf"\b(?:{'|'.join(SCALED_AGGREGATES)})\s*\(", re.IGNORECASE)
+
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def sample_path(db_path):
+    """Samples are stored next to the database as <db file>.samples.sqlite."""
+    return f"{db_path}.samples.sqlite"
+
+
+def _sample_predicate(threshold):
+    return f"((rowid * {HASH_MULTIPLIER}) % {HASH_MODULUS}) < {threshold}"
+
+
+def _open_sample_store(db_path):
+    """Writable sample store with the source database attached read-only as `src`."""
+    conn = sqlite3.connect(sample_path(db_path))
+    conn.execute("ATTACH DATABASE ? AS src", (readonly_uri(db_path),))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS _sample_meta ("
+        "name TEXT PRIMARY KEY, sql TEXT, rate REAL, threshold INTEGER, "
+        "source_rows INTEGER, last_rowid INTEGER, sample_rows INTEGER)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS _sample_source (fingerprint TEXT)")
+    return conn
+
+
+def _refresh_table(conn, table, sql, meta):
+    """Create, extend or rebuild the sample of one table. Returns True if it changed."""
+    try:
+        source_rows, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM src.[{table}]").fetchone()
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID tables cannot be sampled by rowid
+        return False
+
+    if source_rows < LARGE_TABLE_ROWS:
+        if meta:
+            conn.execute(f"DROP TABLE IF EXISTS main.[{table}]")
+            conn.execute("DELETE FROM _sample_meta WHERE name = ?", (table,))
+            return True
+        return False
+
+    if meta and meta["sql"] == sql and meta["last_rowid"] == max_rowid and meta["source_rows"] == source_rows:
+        return False
+
+    appended = source_rows - meta["source_rows"] if meta else 0
+    grew_only = (
+        meta and meta["sql"] == sql and max_rowid is not None and meta["last_rowid"] is not None
+        and max_rowid > meta["last_rowid"] and appended == max_rowid - meta["last_rowid"]
+    )
+    if grew_only:
+        # Rows were only appended: sample the new rowid range with the same hash
+        threshold, rate = meta["threshold"], meta["rate"]
+        conn.execute(
+            f"INSERT INTO main.[{table}] SELECT * FROM src.[{table}] "
+            f"WHERE rowid > ? AND {_sample_predicate(threshold)}",
+            (meta["last_rowid"],),
+        )
+    else:
+        rate = max(min(TARGET_SAMPLE_ROWS / source_rows, 1.0), MIN_SAMPLE_RATE)
+        threshold = int(rate * HASH_MODULUS)
+        conn.execute(f"DROP TABLE IF EXISTS main.[{table}]")
+        conn.execute(
+            f"CREATE TABLE main.[{table}] AS SELECT * FROM src.[{table}] WHERE {_sample_predicate(threshold)}"
+        )
+
+    sample_rows = conn.execute(f"SELECT COUNT(*) FROM main.[{table}]").fetchone()[0]
+    conn.execute(
+        "INSERT OR REPLACE INTO _sample_meta VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (table, sql, rate, threshold, source_rows, max_rowid, sample_rows),
+    )
+    logger.info(
+        f"Sample {'extended' if grew_only else 'built'} for {table}: "
+        f"{sample_rows} of {source_rows} rows ({rate:.2%})"
+    )
+    return True
+
+
+def refresh_samples(db_path):
+    """
+    Bring the samples of every large table up to date with the database.
+
+    Nothing is scanned while the file fingerprint is unchanged; appended rows
+    are sampled incrementally, any other change rebuilds that table's sample.
+
+    Returns:
+        Dict of table name -> sample metadata (rate, source_rows, sample_rows, ...)
+    """
+    with _LOCKS_GUARD:
+        lock = _LOCKS.setdefault(os.path.abspath(db_path), threading.Lock())
+
+    with lock:
+        conn = _open_sample_store(db_path)
+        try:
+            fingerprint = repr(file_fingerprint(db_path))
+            stored = conn.execute("SELECT fingerprint FROM _sample_source").fetchone()
+            columns = ["name", "sql", "rate", "threshold", "source_rows", "last_rowid", "sample_rows"]
+            metas = {
+                row[0]: dict(zip(columns, row))
+                for row in conn.execute(f"SELECT {', '.join(columns)} FROM _sample_meta").fetchall()
+            }
+            if stored and stored[0] == fingerprint:
+                return metas
+
+            tables = conn.execute(
+                "SELECT name, sql FROM src.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+            for table, sql in tables:
+                _refresh_table(conn, table, sql, metas.get(table))
+
+            conn.execute("DELETE FROM _sample_source")
+            conn.execute("INSERT INTO _sample_source VALUES (?)", (fingerprint,))
+            conn.commit()
+            return {
+                row[0]: dict(zip(columns, row))
+                for row in conn.execute(f"SELECT {', '.join(columns)} FROM _sample_meta").fetchall()
+            }
+        finally:
+            conn.close()
+
+
+def _parse(sql):
+    """
+    Find what the approximate rewrite needs in a query's token stream.
+
+    Returns:
+        (tokens, table refs as (token index, name, depth, nullable), top-level
+        select items as (text, kind) with kind in COUNT/SUM/other, index of the
+        top-level FROM) or None when the query shape is not supported (compound
+        SELECT, DISTINCT, HAVING on sampled aggregates, RIGHT/FULL joins, or
+        COUNT/SUM/TOTAL inside a larger expression such as ROUND(SUM(x), 2)).
+        `depth` is the parenthesis depth of the reference (0 = the outer
+        FROM) and `nullable` marks the right side of a LEFT JOIN.
+    """
+    tokens = tokenize(sql)
+    depth = 0
+    after_from = False
+    select_start = from_index = None
+    items, current = [], []
+    table_refs = []
+    join_words = set()
+    previous = None
+
+    for i, (kind, text) in enumerate(tokens):
+        upper = text.upper() if kind in ("word", "op") else None
+        if kind in ("ws", "comment"):
+            if select_start is not None and from_index is None:
+                current.append(text)
+            continue
+
+        if upper == "(":
+            depth += 1
+        elif upper == ")":
+            depth -= 1
+
+        if depth == 0 and upper in ("UNION", "EXCEPT", "INTERSECT", "HAVING", "RIGHT", "FULL"):
+            return None
+        if depth == 0 and upper == "SELECT" and select_start is None:
+            select_start = i
+        elif depth == 0 and upper == "DISTINCT" and previous == "SELECT":
+            return None
+        elif depth == 0 and upper == "FROM" and from_index is None and select_start is not None:
+            from_index = i
+            items.append("".join(current).strip())
+        elif select_start is not None and from_index is None:
+            if depth == 0 and upper == ",":
+                items.append("".join(current).strip())
+                current = []
+            else:
+                current.append(text)
+
+        # Table references: a name right after FROM/JOIN, or after a comma in a FROM list
+        if upper in ("LEFT", "INNER", "CROSS", "NATURAL", "OUTER"):
+            join_words.add(upper)
+        elif upper in ("FROM", "JOIN"):
+            after_from = True
+            if upper == "FROM":
+                join_words = set()
+        elif upper in ("WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "ON", "USING", "SELECT", ")"):
+            after_from = False
+        elif after_from and kind in ("word", "quoted") and previous in ("FROM", "JOIN", ","):
+            next_op = next((t for k, t in tokens[i + 1:] if k not in ("ws", "comment")), None)
+            if next_op != ".":
+                nullable = previous == "JOIN" and "LEFT" in join_words
+                table_refs.append((i, text.strip('[]"`'), depth, nullable))
+            join_words = set()
+        previous = upper if upper is not None else kind
+
+    if select_start is None or from_index is None:
+        return None
+
+    select_items = []
+    for item in items:
+        head = item.split("(", 1)[0].strip().upper()
+        kind = "other"
+        if head in SCALED_AGGREGATES and "(" in item:
+            argument = _aggregate_argument(item)
+            # Only a bare COUNT(...)/SUM(...)/TOTAL(...) [AS alias] scales linearly
+            if argument is None or argument.strip().upper().startswith("DISTINCT"):
+                return None
+            kind = "COUNT" if head == "COUNT" else "SUM"
+        elif SCALED_CALL_PATTERN.search(item):
+            # ROUND(SUM(x), 2), CAST(COUNT(*) AS REAL), SUM(x) / COUNT(*), ...:
+            # the inner aggregate would come back unscaled
+            return None
+        select_items.append((item, kind))
+
+    # With `*` in the select list, output columns don't line up with the items
+    if any(kind != "other" for _, kind in select_items) and any(
+        item == "*" or item.endswith(".*") for item, _ in select_items
+    ):
+        return None
+    return tokens, table_refs, select_items, from_index
+
+
+def _aggregate_argument(item):
+    """
+    'SUM(Total) AS revenue' -> 'Total' (text between the outer parentheses).
+
+    Returns None unless the item is a single aggregate call with an optional alias.
+    """
+    start = item.index("(") + 1
+    depth = 1
+    for j in range(start, len(item)):
+        if item[j] == "(":
+            depth += 1
+        elif item[j] == ")":
+            depth -= 1
+            if depth == 0:
+                rest = [word for word in item[j + 1:].split() if word.upper() != "AS"]
+                return item[start:j] if len(rest) <= 1 else None
+    return None
+
+
+def run_approximate(db_path, query):
+    """
+    Run a query against the sample of its one large table and scale the result.
+
+    COUNT/SUM/TOTAL columns are scaled by 1/rate (Horvitz-Thompson) and get a 95%
+    confidence half-width column "<name>_ci95"; AVG, MIN, MAX and row-level
+    results come straight from the sample.
+
+    Args:
+        db_path: Source database path
+        query: Validated SELECT query (see sql_rewriter.prepare_query)
+
+    Returns:
+        (DataFrame, label describing the approximation), or None when the
+        query should run exactly: it does not read exactly one sampled
+        table, reads it more than once, inside a subquery or CTE, or on the
+        nullable side of a LEFT JOIN (scaling the outer aggregates would
+        then be wrong)
+    """
+    samples = refresh_samples(db_path)
+    if not samples:
+        return None
+
+    parsed = _parse(query)
+    if parsed is None:
+        return None
+    tokens, table_refs, select_items, from_index = parsed
+
+    by_name = {name.lower(): name for name in samples}
+    refs = [ref for ref in table_refs if ref[1].lower() in by_name]
+    sampled = {by_name[name.lower()] for _, name, _, _ in refs}
+    if len(sampled) != 1:
+        # Joining two independent samples would need a product of rates
+        return None
+    if len(refs) > 1 or any(depth > 0 or nullable for _, _, depth, nullable in refs):
+        # Only rows of the outer FROM scale with 1/rate: a sampled subquery, CTE,
+        # IN (...) list or outer-joined side changes the result non-linearly
+        return None
+    table = sampled.pop()
+    meta = samples[table]
+    rate = meta["rate"]
+
+    # Point the large table at its sample and add the helper aggregates for the CIs
+    helpers = []
+    for position, (item, kind) in enumerate(select_items):
+        if kind == "COUNT":
+            helpers.append(f"COUNT({_aggregate_argument(item)}) AS __sq_{position}")
+        elif kind == "SUM":
+            argument = _aggregate_argument(item)
+            helpers.append(f"SUM(({argument}) * ({argument})) AS __sq_{position}")
+    rewritten = list(tokens)
+    for index, name, _, _ in refs:
+        if name.lower() == table.lower():
+            rewritten[index] = ("quoted", f"sample.[{table}]")
+    if helpers:
+        rewritten[from_index] = ("word", ", " + ", ".join(helpers) + " FROM")
+    sample_sql = "".join(text for _, text in rewritten)
+
+    conn = sqlite3.connect(readonly_uri(db_path), uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS sample", (readonly_uri(sample_path(db_path)),))
+        df = pd.read_sql_query(sample_sql, conn)
+    finally:
+        conn.close()
+
+    # Scale COUNT/SUM and add 95% CI half-widths: Var = (1 - p) / p^2 * sum(y^2)
+    scaled = []
+    for position, (item, kind) in enumerate(select_items):
+        if kind not in ("COUNT", "SUM"):
+            continue
+        column = df.columns[position]
+        helper = f"__sq_{position}"
+        df[f"{column}_ci95"] = (Z_95 * (df[helper].astype(float) * (1 - rate)).pow(0.5) / rate).round(2)
+        df[column] = (df[column] / rate).round(2)
+        scaled.append(column)
+    df = df[[col for col in df.columns if not str(col).startswith("__sq_")]]
+
+    label = (
+        f"APPROXIMATE RESULT: {table} sampled at {rate:.2%} "
+        f"({meta['sample_rows']:,} of {meta['source_rows']:,} rows)."
+    )
+    if scaled:
+        label += (
+            f" COUNT/SUM/TOTAL columns ({', '.join(map(str, scaled))}) are scaled by {1 / rate:,.1f}x;"
+            " <column>_ci95 is the 95% confidence half-width."
+        )
+    label += " AVG/MIN/MAX and individual rows come from the sample only."
+    label += " Re-run with exact=true for exact figures."
+    return df, label
@@ -0,0 +1,300 @@
+# data/shared_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from data.connections import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# One file shared by every app/worker process on the host
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.sqlite")
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE", "on").lower() not in ("off", "0", "false")
+DEFAULT_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Eviction frees space down to this fraction of max_bytes
+EVICT_TO_FRACTION = 0.9
+BUSY_TIMEOUT_MS = 5000
+# Reads record recency and hit/miss counters in memory; they are written at
+# most this often (and with every set), so reads never take the write lock
+FLUSH_SECONDS = 5
+
+STAT_FIELDS = ("hits", "misses", "writes", "evictions")
+
+_CACHES = {}
+_CACHES_GUARD = threading.Lock()
+
+
+def make_key(*parts):
+    """Stable key for any JSON-serialisable parts (same in every process)."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def database_key(db_path):
+    """Key part identifying a database file and its current contents."""
+    return [os.path.abspath(db_path), file_fingerprint(db_path)]
+
+
+class SharedCache:
+    """
+    Key/value cache in a SQLite WAL file, shared by all processes on a host.
+
+    Entries live in namespaces ("schema", "result", "render", ...). Writes
+    are single transactions, so readers in other processes never see partial
+    values; the least recently used entries are evicted once the file holds
+    more than max_bytes of values. Hit/miss/write/eviction counters are kept
+    per namespace in the same file, so they cover every worker.
+
+    Reads are plain WAL reads and run concurrently across processes. Their
+    access times and hit/miss counts are buffered and written in one batch
+    every FLUSH_SECONDS or with the next set(); a failed batch is retried
+    with the next one.
+
+    Cache errors (locked or unwritable file) are logged and treated as
+    misses: the cache never makes a request fail.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        # (namespace, key) -> last access time; (namespace, field) -> count
+        self._pending_access = {}
+        self._pending_counts = {}
+        self._flushed_at = time.monotonic()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT, key TEXT, value BLOB, is_json INTEGER, size INTEGER, "
+            "created_at REAL, accessed_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespace_stats ("
+            "namespace TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0, "
+            "writes INTEGER DEFAULT 0, evictions INTEGER DEFAULT 0)"
+        )
+
+    def _connection(self):
+        """One connection per thread; sqlite3 connections are not shared."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _count(conn, namespace, field, amount=1):
+        conn.execute(
+            f"INSERT INTO namespace_stats (namespace, {field}) VALUES (?, ?) "
+            f"ON CONFLICT(namespace) DO UPDATE SET {field} = {field} + excluded.{field}",
+            (namespace, amount),
+        )
+
+    def _note(self, namespace, field, key=None):
+        """Buffer a hit/miss (and the access time of a hit) for the next flush."""
+        with self._pending_lock:
+            counter = (namespace, field)
+            self._pending_counts[counter] = self._pending_counts.get(counter, 0) + 1
+            if key is not None:
+                self._pending_access[(namespace, key)] = time.time()
+            due = time.monotonic() - self._flushed_at >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def _take_pending(self):
+        with self._pending_lock:
+            access, counts = self._pending_access, self._pending_counts
+            self._pending_access, self._pending_counts = {}, {}
+            self._flushed_at = time.monotonic()
+        return access, counts
+
+    def _restore_pending(self, access, counts):
+        """Put back a batch that could not be written, for the next flush."""
+        with self._pending_lock:
+            for entry, accessed_at in access.items():
+                self._pending_access[entry] = max(accessed_at, self._pending_access.get(entry, 0))
+            for counter, amount in counts.items():
+                self._pending_counts[counter] = self._pending_counts.get(counter, 0) + amount
+
+    def _write_pending(self, conn, access, counts):
+        """Apply a buffered batch inside the caller's write transaction."""
+        conn.executemany(
+            "UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE namespace = ? AND key = ?",
+            [(accessed_at, namespace, key) for (namespace, key), accessed_at in access.items()],
+        )
+        for (namespace, field), amount in counts.items():
+            self._count(conn, namespace, field, amount)
+
+    def flush(self):
+        """Write buffered access times and counters (best effort)."""
+        access, counts = self._take_pending()
+        if not access and not counts:
+            return
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(conn, access, counts)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache stats flush failed, retrying later: {e}")
+            self._restore_pending(access, counts)
+
+    def get(self, namespace, key, default=None):
+        """Return the cached value, or `default` on a miss (a read-only WAL read)."""
+        try:
+            row = self._connection().execute(
+                "SELECT value, is_json FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed ({namespace}): {e}")
+            return default
+        if not row:
+            self._note(namespace, "misses")
+            return default
+        self._note(namespace, "hits", key)
+        value, is_json = row
+        return json.loads(value) if is_json else bytes(value)
+
+    def set(self, namespace, key, value):
+        """
+        Store a value (bytes as-is, anything else as JSON) and evict the least
+        recently used entries if the cache grew past max_bytes.
+        """
+        is_json = not isinstance(value, (bytes, bytearray))
+        payload = json.dumps(value, default=str) if is_json else bytes(value)
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        access, counts = self._take_pending()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Buffered reads go first so eviction sees current access times
+                self._write_pending(conn, access, counts)
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (namespace, key, payload, int(is_json), size, now, now),
+                )
+                self._count(conn, namespace, "writes")
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed ({namespace}): {e}")
+            self._restore_pending(access, counts)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_free = total - int(self.max_bytes * EVICT_TO_FRACTION)
+        victims = []
+        for namespace, key, size in conn.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed_at"
+        ):
+            victims.append((namespace, key))
+            to_free -= size
+            if to_free <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+        evicted = {}
+        for namespace, _ in victims:
+            evicted[namespace] = evicted.get(namespace, 0) + 1
+        for namespace, count in evicted.items():
+            self._count(conn, namespace, "evictions", count)
+        logger.info(f"Shared cache evicted {len(victims)} entries")
+
+    def get_or_compute(self, namespace, key, compute, cacheable=None):
+        """
+        Return the cached value or compute, store and return it.
+
+        Args:
+            namespace: Cache namespace
+            key: Key from make_key()
+            compute: Zero-argument callable producing the value
+            cacheable: Optional predicate; values it rejects (e.g. error
+                messages) are returned but not stored
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+        value = compute()
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.set(namespace, key, value)
+        return value
+
+    def clear(self, namespace=None):
+        try:
+            conn = self._connection()
+            if namespace:
+                conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+            else:
+                conn.execute("DELETE FROM entries")
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache clear failed: {e}")
+
+    def stats(self):
+        """
+        Per-namespace counters across all processes.
+
+        Returns:
+            Dict of namespace -> {hits, misses, writes, evictions, entries, bytes, hit_rate};
+            other processes' reads show up once they flush
+        """
+        self.flush()
+        conn = self._connection()
+        stats = {}
+        for row in conn.execute(f"SELECT namespace, {', '.join(STAT_FIELDS)} FROM namespace_stats"):
+            stats[row[0]] = dict(zip(STAT_FIELDS, row[1:]), entries=0, bytes=0)
+        for namespace, entries, size in conn.execute(
+            "SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace"
+        ):
+            stats.setdefault(namespace, dict.fromkeys(STAT_FIELDS, 0)).update(entries=entries, bytes=size)
+        for values in stats.values():
+            lookups = values["hits"] + values["misses"]
+            values["hit_rate"] = round(values["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+def get_cache(path=None):
+    """
+    Process-wide SharedCache for `path` (default: SHARED_CACHE_PATH), or
+    None when the cache file cannot be opened.
+    """
+    path = os.path.abspath(path or SHARED_CACHE_PATH)
+    with _CACHES_GUARD:
+        if path not in _CACHES:
+            try:
+                _CACHES[path] = SharedCache(path)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared cache unavailable at {path}: {e}")
+                return None
+        return _CACHES[path]
+
+
+def cached(namespace, key_parts, compute, cacheable=None):
+    """
+    Shortcut used by the tools: look up make_key(*key_parts) in `namespace`
+    of the shared cache, computing and storing the value on a miss.
+    """
+    cache = get_cache() if SHARED_CACHE_ENABLED else None
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(namespace, make_key(*key_parts), compute, cacheable)
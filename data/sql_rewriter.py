@@ -0,0 +1,261 @@
+# data/sql_rewriter.py
+import difflib
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# SQLite keywords that cannot be used as bare table/column names
+# (found by trying `SELECT x FROM <keyword>` for every SQLite keyword)
+RESERVED_KEYWORDS = {
+    "ADD", "ALL", "ALTER", "AND", "AS", "AUTOINCREMENT", "BETWEEN", "CASE", "CHECK",
+    "COLLATE", "COMMIT", "CONSTRAINT", "CREATE", "DEFAULT", "DEFERRABLE", "DELETE",
+    "DISTINCT", "DROP", "ELSE", "ESCAPE", "EXCEPT", "EXISTS", "FOREIGN", "FROM", "GROUP",
+    "HAVING", "IN", "INDEX", "INSERT", "INTERSECT", "INTO", "IS", "ISNULL", "JOIN", "LIMIT",
+    "NOT", "NOTHING", "NOTNULL", "NULL", "ON", "OR", "ORDER", "PRIMARY", "REFERENCES",
+    "RETURNING", "SELECT", "SET", "TABLE", "THEN", "TO", "TRANSACTION", "UNION", "UNIQUE",
+    "UPDATE", "USING", "VALUES", "WHEN", "WHERE",
+}
+
+# Tokens after which a word names a table
+TABLE_CONTEXT = {"FROM", "JOIN"}
+# Tokens that may follow a column reference
+COLUMN_FOLLOWERS = {
+    ",", ")", ";", "=", "<", ">", "<=", ">=", "!=", "<>", "+", "-", "*", "/", "%", "||",
+    "AS", "FROM", "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "ASC", "DESC", "IS", "IN",
+    "LIKE", "GLOB", "BETWEEN", "NOT", "AND", "OR", "THEN", "ELSE", "END", "WHEN", "COLLATE",
+    "UNION", "EXCEPT", "INTERSECT", None,
+}
+
+# Authorizer actions a read-only query may need while being prepared
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<ws>\s+)
+    |(?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<string>'(?:[^']|'')*'?)
+    |(?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|0[xX][0-9a-fA-F]+)
+    |(?P<param>[?:@$]\w*)
+    |(?P<word>[^\W\d]\w*)
+    |(?P<op><>|<=|>=|!=|==|\|\||<<|>>|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+REWRITE_STATS = {
+    "queries": 0,
+    "rewritten": 0,
+    # Queries that would have failed as written but ran after rewriting:
+    # each one is an LLM retry round-trip avoided
+    "retries_avoided": 0,
+    "rejected_locally": 0,
+}
+_STATS_LOCK = threading.Lock()
+
+
+class QueryValidationError(ValueError):
+    """A query was rejected before execution; the message is meant for the model."""
+
+
+def tokenize(sql):
+    """Split SQL into (kind, text) tokens; joining the texts gives back the input."""
+    return [(match.lastgroup, match.group()) for match in TOKEN_PATTERN.finditer(sql)]
+
+
+def _significant(tokens):
+    """Indexes of tokens that are not whitespace or comments."""
+    return [i for i, (kind, _) in enumerate(tokens) if kind not in ("ws", "comment")]
+
+
+def _upper(token):
+    kind, text = token
+    return text.upper() if kind in ("word", "op") else None
+
+
+def schema_identifiers(conn):
+    """
+    Table and column names of every schema visible on a connection.
+
+    Returns:
+        (tables, columns) as dicts of lowercase name -> stored name
+    """
+    tables, columns = {}, {}
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list").fetchall() if row[1] != "temp"]
+    for schema in schemas:
+        names = conn.execute(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type IN ('table', 'view')"
+        ).fetchall()
+        for (table,) in names:
+            tables[table.lower()] = table
+            for col in conn.execute(f"PRAGMA {schema}.table_info([{table}])").fetchall():
+                columns[col[1].lower()] = col[1]
+    return tables, columns
+
+
+def quote_identifiers(sql, tables, columns):
+    """
+    Bracket-quote table and column names that collide with SQL keywords.
+
+    Only words that name a real table/column and sit in an identifier
+    position are quoted, so `ORDER BY` stays a keyword while `FROM order o`,
+    `JOIN Order`, `Order.Id` and `[Order]` inside subqueries are all handled.
+    """
+    tokens = tokenize(sql)
+    positions = _significant(tokens)
+
+    def neighbour(index, step):
+        j = index + step
+        return _upper(tokens[positions[j]]) if 0 <= j < len(positions) else None
+
+    # Whether we are inside a FROM/JOIN list, tracked per parenthesis depth
+    # so subqueries don't confuse the outer query
+    in_from = [False]
+    for n, i in enumerate(positions):
+        kind, text = tokens[i]
+        upper = _upper(tokens[i])
+        if upper == "(":
+            in_from.append(False)
+        elif upper == ")" and len(in_from) > 1:
+            in_from.pop()
+        elif upper in TABLE_CONTEXT:
+            in_from[-1] = True
+        elif upper in ("WHERE", "HAVING", "LIMIT", "ON", "USING", "SELECT", "UNION") or (
+            upper in ("GROUP", "ORDER") and neighbour(n, 1) == "BY"
+        ):
+            in_from[-1] = False
+        in_from_clause = in_from[-1]
+
+        if kind != "word" or upper not in RESERVED_KEYWORDS:
+            continue
+        before, after = neighbour(n, -1), neighbour(n, 1)
+        name = text.lower()
+
+        is_table = name in tables and (
+            before in TABLE_CONTEXT or (before == "," and in_from_clause)
+            or after == "." or (before == "." and in_from_clause)
+        )
+        is_qualified_column = name in columns and before == "."
+        is_column = (
+            name in columns and after in COLUMN_FOLLOWERS and after != "BY"
+            and before in ("SELECT", ",", "(", "BY", "WHERE", "AND", "OR", "ON", "=", "<", ">", "DISTINCT")
+            and not in_from_clause
+        )
+        if is_table or is_qualified_column or is_column:
+            stored = tables.get(name) if is_table else columns.get(name)
+            tokens[i] = ("quoted", f"[{stored}]")
+
+    return "".join(text for _, text in tokens)
+
+
+def _check_single_select(sql):
+    """Reject anything but one SELECT / WITH ... SELECT statement, from the token stream."""
+    tokens = tokenize(sql)
+    words = [_upper(tokens[i]) for i in _significant(tokens)]
+    while words and words[-1] == ";":
+        words.pop()
+    if not words:
+        raise QueryValidationError("Error: Empty query")
+    if ";" in words:
+        raise QueryValidationError("Error: Only a single SELECT statement is allowed per query")
+    if words[0] not in ("SELECT", "WITH", "VALUES"):
+        raise QueryValidationError("Error: Only SELECT queries are allowed for security reasons")
+
+
+def _authorize_read_only(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in READ_ONLY_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _prepare(conn, sql):
+    """
+    Compile the statement without reading any rows. The authorizer sees every
+    operation in the parsed statement, so writes, ATTACH, PRAGMA etc. are
+    rejected however they are spelled.
+    """
+    conn.set_authorizer(_authorize_read_only)
+    try:
+        conn.execute(f"EXPLAIN {sql}").fetchall()
+    finally:
+        conn.set_authorizer(None)
+
+
+def _explain_error(error, tables, columns):
+    """Turn a SQLite prepare error into a precise message with suggestions."""
+    message = str(error)
+    if "not authorized" in message:
+        return "Error: Only read-only SELECT queries are allowed for security reasons"
+
+    hint = ""
+    match = re.search(r"no such (table|column): (?:\w+\.)?([\w\[\]]+)", message)
+    if match:
+        kind, name = match.group(1), match.group(2).strip("[]")
+        candidates = list((tables if kind == "table" else columns).values())
+        close = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+        if close:
+            hint = f"\nDid you mean: {', '.join(close)}?"
+    elif "syntax error" in message:
+        hint = (
+            "\nTIP: Table or column names that are SQL keywords (e.g. Order, Group) "
+            "must be quoted with square brackets: [Order]"
+        )
+    return f"SQL Error (query was not executed): {message}{hint}"
+
+
+def _record(key):
+    with _STATS_LOCK:
+        REWRITE_STATS[key] += 1
+
+
+def prepare_query(conn, query):
+    """
+    Rewrite and validate a model-written query before running it.
+
+    - enforces a single read-only SELECT (token check + SQLite authorizer)
+    - quotes keyword-named tables/columns against the actual schema
+    - compiles the statement locally so errors are reported precisely,
+      with "did you mean" suggestions, before any rows are read
+
+    Args:
+        conn: sqlite3 connection the query will run on
+        query: SQL written by the model
+
+    Returns:
+        The query to execute
+
+    Raises:
+        QueryValidationError: with a message suitable for the model
+    """
+    _record("queries")
+    sql = query.strip()
+    try:
+        _check_single_select(sql)
+    except QueryValidationError:
+        _record("rejected_locally")
+        raise
+
+    tables, columns = schema_identifiers(conn)
+    rewritten = quote_identifiers(sql, tables, columns)
+
+    try:
+        _prepare(conn, rewritten)
+    except sqlite3.Error as e:
+        _record("rejected_locally")
+        raise QueryValidationError(_explain_error(e, tables, columns)) from e
+
+    if rewritten != sql:
+        _record("rewritten")
+        try:
+            _prepare(conn, sql)
+        except sqlite3.Error:
+            _record("retries_avoided")
+            logger.info(f"Query fixed locally (retry avoided): {sql!r} -> {rewritten!r}")
+
+    return rewritten
@@ -0,0 +1,236 @@
+# data/stats_catalog.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from data.connections import file_fingerprint, get_pool
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION = 2
+# Text columns with at most this many distinct values get their top values listed
+TOP_VALUES_MAX_DISTINCT = 50
+TOP_VALUES = 5
+MAX_VALUE_CHARS = 30
+
+_CATALOGS = {}
+_CATALOG_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def sidecar_path(db_path):
+    """Statistics are stored next to the database as <db file>.stats.json."""
+    return f"{db_path}.stats.json"
+
+
+def _short(value):
+    if isinstance(value, str) and len(value) > MAX_VALUE_CHARS:
+        return value[:MAX_VALUE_CHARS - 1] + "…"
+    return value
+
+
+def page_checksums(db_path, cursor):
+    """
+    Checksum of every table's pages (b-tree and overflow), read from the file.
+
+    Any write to a table - INSERT, DELETE or an UPDATE in place - changes
+    its pages, so an unchanged checksum means unchanged data. The cost is
+    reading the file once, without decoding rows.
+
+    Returns:
+        Dict of table -> checksum, or None when the pages cannot be read
+        reliably: SQLite built without the dbstat table, or commits still
+        in the -wal file
+    """
+    wal_path = f"{db_path}-wal"
+    if os.path.exists(wal_path) and os.path.getsize(wal_path):
+        return None
+    try:
+        page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+        pages = cursor.execute("SELECT name, pageno FROM dbstat ORDER BY name, pageno").fetchall()
+    except sqlite3.Error:
+        return None
+
+    checksums = {}
+    with open(db_path, "rb") as f:
+        for name, pageno in pages:
+            if name not in checksums:
+                checksums[name] = hashlib.blake2b(digest_size=8)
+            f.seek((pageno - 1) * page_size)
+            checksums[name].update(f.read(page_size))
+    return {name: digest.hexdigest() for name, digest in checksums.items()}
+
+
+def _table_stats(cursor, table):
+    """Row count, and null fraction, min/max, distinct count and top values for every column."""
+    cursor.execute(f"PRAGMA table_info([{table}])")
+    # Format: (id, name, type, notnull, default, pk)
+    columns = [(col[1], col[2], bool(col[5])) for col in cursor.fetchall()]
+
+    # One scan computes the aggregates of every column
+    aggregates = ", ".join(
+        f"COUNT([{name}]), MIN([{name}]), MAX([{name}]), COUNT(DISTINCT [{name}])"
+        for name, _, _ in columns
+    )
+    cursor.execute(f"SELECT COUNT(*), {aggregates} FROM [{table}]")
+    row_count, *row = cursor.fetchone()
+
+    stats = []
+    for i, (name, col_type, is_pk) in enumerate(columns):
+        non_null, low, high, distinct = row[4 * i:4 * i + 4]
+        column = {
+            "name": name,
+            "type": col_type,
+            "pk": is_pk,
+            "null_fraction": round(1 - non_null / row_count, 3) if row_count else 0.0,
+            "min": _short(low),
+            "max": _short(high),
+            "distinct": distinct,
+        }
+        is_text = isinstance(low, str) or "CHAR" in col_type.upper() or "TEXT" in col_type.upper()
+        # Unique columns (ids, names) have no meaningful "most common" values
+        if is_text and 0 < distinct <= TOP_VALUES_MAX_DISTINCT and distinct < non_null:
+            cursor.execute(
+                f"SELECT [{name}], COUNT(*) FROM [{table}] WHERE [{name}] IS NOT NULL "
+                f"GROUP BY [{name}] ORDER BY COUNT(*) DESC LIMIT {TOP_VALUES}"
+            )
+            column["top_values"] = [[_short(value), count] for value, count in cursor.fetchall()]
+        stats.append(column)
+    return row_count, stats
+
+
+def _foreign_keys(cursor, table):
+    cursor.execute(f"PRAGMA foreign_key_list([{table}])")
+    # Format: (id, seq, table, from, to, on_update, on_delete, match)
+    return [{"column": fk[3], "ref_table": fk[2], "ref_column": fk[4]} for fk in cursor.fetchall()]
+
+
+def _read_sidecar(db_path):
+    try:
+        with open(sidecar_path(db_path), encoding="utf-8") as f:
+            catalog = json.load(f)
+        if catalog.get("version") == CATALOG_VERSION:
+            return catalog
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _write_sidecar(db_path, catalog):
+    """Write atomically so readers never see a half-written file."""
+    path = sidecar_path(db_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(catalog, f, default=str)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # Read-only database folders still get an in-memory catalog
+        logger.warning(f"Could not write statistics sidecar {path}: {e}")
+
+
+def build_catalog(db_path, previous=None):
+    """
+    Compute the statistics catalog of a database.
+
+    Tables whose fingerprint (schema plus page checksum, see
+    page_checksums) matches `previous` are reused as-is, so only changed
+    tables are rescanned. Without page checksums every table is rescanned
+    (one aggregate scan per table) and its fingerprint is None.
+    """
+    previous_tables = (previous or {}).get("tables", {})
+    tables = {}
+    rebuilt = []
+
+    with get_pool(db_path=db_path).connection() as conn:
+        cursor = conn.cursor()
+        checksums = page_checksums(db_path, cursor)
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for table, sql in cursor.fetchall():
+            fingerprint = [sql, checksums[table]] if checksums and table in checksums else None
+            old = previous_tables.get(table)
+            if fingerprint and old and old.get("fingerprint") == fingerprint:
+                tables[table] = old
+                continue
+
+            row_count, columns = _table_stats(cursor, table)
+            tables[table] = {
+                "fingerprint": fingerprint,
+                "rows": row_count,
+                "columns": columns,
+                "foreign_keys": _foreign_keys(cursor, table),
+            }
+            rebuilt.append(table)
+
+    if rebuilt:
+        logger.info(f"Statistics refreshed for {db_path}: {', '.join(rebuilt)}")
+    return {
+        "version": CATALOG_VERSION,
+        "fingerprint": file_fingerprint(db_path),
+        "tables": tables,
+    }
+
+
+def load_catalog(db_path):
+    """
+    Return the statistics catalog of a database, refreshing it if the file changed.
+
+    Lookups are served from memory, then from the sidecar file; a changed
+    database only rescans the tables that changed.
+    """
+    key = os.path.abspath(db_path)
+    with _LOCKS_GUARD:
+        lock = _CATALOG_LOCKS.setdefault(key, threading.Lock())
+
+    with lock:
+        fingerprint = file_fingerprint(db_path)
+        catalog = _CATALOGS.get(key) or _read_sidecar(db_path)
+        if catalog and catalog.get("fingerprint") == fingerprint:
+            _CATALOGS[key] = catalog
+            return catalog
+
+        catalog = build_catalog(db_path, previous=catalog)
+        _write_sidecar(db_path, catalog)
+        _CATALOGS[key] = catalog
+        return catalog
+
+
+def forget_catalog(db_path):
+    """Drop the in-memory catalog of a database (the sidecar is checked on next use)."""
+    with _LOCKS_GUARD:
+        _CATALOGS.pop(os.path.abspath(db_path), None)
+
+
+def _format_value(value):
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def describe_column(column):
+    """Compact one-line description, e.g. 'Country (TEXT, 21 distinct, top: USA, Germany)'."""
+    parts = [column["type"] or "ANY"]
+    if column["pk"]:
+        parts.append("pk")
+    if column["null_fraction"]:
+        parts.append(f"{column['null_fraction']:.0%} null")
+    parts.append(f"{column['distinct']} distinct")
+    if column.get("top_values"):
+        parts.append("top: " + ", ".join(str(value) for value, _ in column["top_values"]))
+    elif column["min"] is not None and not column["pk"]:
+        parts.append(f"{_format_value(column['min'])}..{_format_value(column['max'])}")
+    return f"{column['name']} ({', '.join(parts)})"
+
+
+def format_table(table, entry, prefix=""):
+    """Compact schema + statistics block for one table of the catalog."""
+    lines = [f"Table: {prefix}{table} ({entry['rows']} rows)"]
+    lines.append("  Columns: " + ", ".join(describe_column(col) for col in entry["columns"]))
+    if entry["foreign_keys"]:
+        links = ", ".join(
+            f"{fk['column']} -> {prefix}{fk['ref_table']}.{fk['ref_column'] or 'rowid'}"
+            for fk in entry["foreign_keys"]
+        )
+        lines.append(f"  Foreign keys: {links}")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+# data/timeseries.py
+import re
+from datetime import date
+
+# Aim for about this many points on a trend line
+DEFAULT_TARGET_POINTS = 60
+# Values checked when deciding whether a column holds dates
+DETECT_SAMPLE_ROWS = 200
+DETECT_MIN_FRACTION = 0.9
+DATE_NAME_PATTERN = re.compile(r"date|time|day|_at$|^at_|timestamp", re.IGNORECASE)
+
+# Granularity -> (approximate days per bucket, SQLite bucket expression for {col})
+# Buckets sort correctly as text: 2013-04-01 (day, or Monday of the week), 2013-04, 2013-Q2, 2013
+GRANULARITIES = {
+    "day": (1, "date({col})"),
+    "week": (7, "date({col}, 'weekday 0', '-6 days')"),
+    "month": (30.44, "strftime('%Y-%m', {col})"),
+    "quarter": (91.31, "strftime('%Y', {col}) || '-Q' || ((CAST(strftime('%m', {col}) AS INTEGER) + 2) / 3)"),
+    "year": (365.25, "strftime('%Y', {col})"),
+}
+AUTO = "auto"
+
+
+def _split_source(source):
+    """'northwind.[Order]' -> ('northwind', 'Order'); plain tables have no schema."""
+    match = re.fullmatch(r"\s*(?:\[?(\w+)\]?\.)?\[?(\w+)\]?\s*", source)
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def detect_date_columns(conn, source):
+    """
+    Columns of a table that hold dates: declared DATE/TIME types or date-like
+    names whose sampled values SQLite's date() can parse.
+
+    Args:
+        conn: sqlite3 connection
+        source: Table name, optionally schema-qualified ("northwind.[Order]")
+
+    Returns:
+        Column names, best candidates (declared date types) first
+    """
+    schema, table = _split_source(source)
+    if table is None:
+        return []
+    prefix = f"[{schema}]." if schema else ""
+    columns = conn.execute(f"PRAGMA {prefix}table_info([{table}])").fetchall()
+
+    found = []
+    for _, name, col_type, *_ in columns:
+        declared = any(word in (col_type or "").upper() for word in ("DATE", "TIME"))
+        if not declared and not DATE_NAME_PATTERN.search(name):
+            continue
+        total, parsed = conn.execute(
+            f"SELECT COUNT(*), COUNT(date(v)) FROM "
+            f"(SELECT [{name}] AS v FROM {prefix}[{table}] WHERE [{name}] IS NOT NULL LIMIT {DETECT_SAMPLE_ROWS})"
+        ).fetchone()
+        if total and parsed / total >= DETECT_MIN_FRACTION:
+            found.append((not declared, name))
+    return [name for _, name in sorted(found)]
+
+
+def choose_granularity(start, end, target_points=DEFAULT_TARGET_POINTS):
+    """
+    Finest granularity that keeps the series at or under target_points.
+
+    Args:
+        start, end: ISO dates ("2012-07-04") of the data range
+
+    Returns:
+        "day", "week", "month", "quarter" or "year"
+    """
+    days = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+    for name, (bucket_days, _) in GRANULARITIES.items():
+        if days / bucket_days <= target_points:
+            return name
+    return "year"
+
+
+def _condition(date_column, where):
+    return f"date({date_column}) IS NOT NULL" + (f" AND ({where})" if where else "")
+
+
+def range_query(source, date_column, where=None):
+    """SQL returning (first date, last date, rows) of the rows a series will cover."""
+    return (
+        f"SELECT MIN(date({date_column})), MAX(date({date_column})), COUNT(*) "
+        f"FROM {source} WHERE {_condition(date_column, where)}"
+    )
+
+
+def series_query(source, date_column, value="COUNT(*)", granularity="month", where=None, value_label="value"):
+    """
+    Grouped aggregate SQL returning one row per period, in time order.
+
+    Args:
+        source: Table or FROM clause (joins allowed)
+        date_column: Column or expression holding the date
+        value: Aggregate expression, e.g. "SUM(Total)"
+        granularity: Key of GRANULARITIES
+        where: Optional filter
+        value_label: Name of the value column
+
+    Returns:
+        SQL with columns "period" and value_label
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'. Use one of: {', '.join(GRANULARITIES)} or auto")
+    bucket = GRANULARITIES[granularity][1].format(col=date_column)
+    return (
+        f"SELECT {bucket} AS period, {value} AS [{value_label}] FROM {source} "
+        f"WHERE {_condition(date_column, where)} GROUP BY period ORDER BY period"
+    )
@@ -0,0 +1,230 @@
+# data/value_index.py
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from data.connections import file_fingerprint, get_pool
+from data.stats_catalog import load_catalog
+from data.timeseries import DATE_NAME_PATTERN
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# Text columns with at most this many distinct values are indexed
+INDEX_MAX_DISTINCT = 2000
+# Longer values are free text (descriptions, notes), not names or categories
+MAX_VALUE_CHARS = 80
+# Matches scoring below this are not reported
+MIN_SCORE = 0.45
+DEFAULT_LIMIT = 5
+# Columns whose smallest and largest values look like this hold dates, not categories
+ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+_INDEXES = {}
+_INDEX_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def sidecar_path(db_path):
+    """Indexed values are stored next to the database as <db file>.values.json."""
+    return f"{db_path}.values.json"
+
+
+def normalize(text):
+    """Lowercase letters and digits only: "AC/DC" -> "acdc", "São Paulo" -> "saopaulo"."""
+    text = unicodedata.normalize("NFKD", str(text)).casefold()
+    return "".join(char for char in text if char.isalnum())
+
+
+def trigrams(key):
+    """Trigrams of a normalized key, padded so short keys and word edges count."""
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _indexed_columns(entry):
+    """Names of the low-cardinality text columns of a catalog table entry."""
+    return [
+        column["name"] for column in entry["columns"]
+        if not column["pk"]
+        and 0 < column["distinct"] <= INDEX_MAX_DISTINCT
+        and (isinstance(column["min"], str) or any(word in (column["type"] or "").upper() for word in ("CHAR", "TEXT")))
+        and not DATE_NAME_PATTERN.search(column["name"])
+        and not all(ISO_DATE_PATTERN.match(str(column[bound])) for bound in ("min", "max"))
+    ]
+
+
+def build_values(db_path, catalog, previous=None):
+    """
+    Collect the distinct values (with row counts) of the indexed columns.
+
+    Tables whose statistics fingerprint (a checksum of the table's pages,
+    so UPDATEs count as changes) matches `previous` are reused as-is, so
+    only changed tables are rescanned. Tables without a fingerprint are
+    always rescanned.
+    """
+    previous_tables = (previous or {}).get("tables", {})
+    tables = {}
+    rebuilt = []
+
+    with get_pool(db_path=db_path).connection() as conn:
+        for table, entry in catalog["tables"].items():
+            old = previous_tables.get(table)
+            if entry["fingerprint"] and old and old.get("fingerprint") == entry["fingerprint"]:
+                tables[table] = old
+                continue
+
+            columns = {}
+            for name in _indexed_columns(entry):
+                rows = conn.execute(
+                    f"SELECT [{name}], COUNT(*) FROM [{table}] WHERE [{name}] IS NOT NULL "
+                    f"GROUP BY [{name}] ORDER BY COUNT(*) DESC LIMIT {INDEX_MAX_DISTINCT}"
+                ).fetchall()
+                columns[name] = [
+                    [value, count] for value, count in rows
+                    if isinstance(value, str) and len(value) <= MAX_VALUE_CHARS and normalize(value)
+                ]
+            tables[table] = {"fingerprint": entry["fingerprint"], "columns": columns}
+            rebuilt.append(table)
+
+    if rebuilt:
+        logger.info(f"Value index refreshed for {db_path}: {', '.join(rebuilt)}")
+    return {"version": INDEX_VERSION, "fingerprint": catalog["fingerprint"], "tables": tables}
+
+
+class ValueIndex:
+    """
+    Trigram index over the stored values of a database's low-cardinality
+    text columns, for mapping a user's wording to the exact stored value.
+    """
+
+    def __init__(self, values):
+        """
+        Args:
+            values: Result of build_values() (as stored in the sidecar)
+        """
+        self.fingerprint = values["fingerprint"]
+        self.entries = []
+        self.keys = []
+        self.sizes = []
+        self.postings = {}
+        for table, entry in values["tables"].items():
+            for column, column_values in entry["columns"].items():
+                for value, count in column_values:
+                    key = normalize(value)
+                    grams = trigrams(key)
+                    for gram in grams:
+                        self.postings.setdefault(gram, []).append(len(self.entries))
+                    self.entries.append((table, column, value, count))
+                    self.keys.append(key)
+                    self.sizes.append(len(grams))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, term, table=None, column=None, limit=DEFAULT_LIMIT):
+        """
+        Stored values closest to a user's term.
+
+        Exact matches (ignoring case, accents and punctuation) score 1.0;
+        otherwise values are scored by trigram overlap, and values that
+        contain the term (or are contained in it) score at least 0.6.
+
+        Args:
+            term: The user's wording, e.g. "germany" or "ac dc"
+            table: Only match values of this table
+            column: Only match values of this column
+
+        Returns:
+            List of dicts with "table", "column", "value", "rows" and
+            "score", best first (ties: more frequent value first)
+        """
+        key = normalize(term)
+        if not key:
+            return []
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        matches = []
+        for i, n in shared.items():
+            entry_table, entry_column, value, count = self.entries[i]
+            if table and entry_table.lower() != table.lower():
+                continue
+            if column and entry_column.lower() != column.lower():
+                continue
+            other = self.keys[i]
+            if other == key:
+                score = 1.0
+            else:
+                score = 2 * n / (len(grams) + self.sizes[i])
+                shorter, longer = sorted((key, other), key=len)
+                if len(shorter) >= 3 and shorter in longer:
+                    score = max(score, 0.6 + 0.4 * len(shorter) / len(longer))
+            if score >= MIN_SCORE:
+                matches.append({"table": entry_table, "column": entry_column, "value": value,
+                                "rows": count, "score": round(score, 3)})
+        matches.sort(key=lambda match: (-match["score"], -match["rows"]))
+        return matches[:limit]
+
+
+def _read_sidecar(db_path):
+    try:
+        with open(sidecar_path(db_path), encoding="utf-8") as f:
+            values = json.load(f)
+        if values.get("version") == INDEX_VERSION:
+            return values
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _write_sidecar(db_path, values):
+    """Write atomically so readers never see a half-written file."""
+    path = sidecar_path(db_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(values, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # Read-only database folders still get an in-memory index
+        logger.warning(f"Could not write value index sidecar {path}: {e}")
+
+
+def get_value_index(db_path):
+    """
+    Return the value index of a database, refreshing it if the file changed.
+
+    Served from memory, then from the sidecar file; a changed database only
+    rescans the tables whose statistics fingerprint changed.
+    """
+    key = os.path.abspath(db_path)
+    with _LOCKS_GUARD:
+        lock = _INDEX_LOCKS.setdefault(key, threading.Lock())
+
+    with lock:
+        fingerprint = file_fingerprint(db_path)
+        index = _INDEXES.get(key)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+
+        values = _read_sidecar(db_path)
+        if not values or values.get("fingerprint") != fingerprint:
+            catalog = load_catalog(db_path)
+            values = build_values(db_path, catalog, previous=values)
+            _write_sidecar(db_path, values)
+        index = ValueIndex(values)
+        _INDEXES[key] = index
+        return index
+
+
+def forget_value_index(db_path):
+    """Drop the in-memory index of a database (the sidecar is checked on next use)."""
+    with _LOCKS_GUARD:
+        _INDEXES.pop(os.path.abspath(db_path), None)
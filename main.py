@@ -1,14 +1,25 @@
 # main.py
+import argparse
+import asyncio
+import json
 import os
+import re
 import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 from agent.orchestrator import build_agent
+from agent.memory import create_checkpointer
 from data.db_registry import DATABASES, USER_DB_ACCESS
+from data.export import EXPORT_PATH_PATTERN
 
 # --- Configuration ---
 
 DEFAULT_MODEL = "gpt-4o"
+IMAGES_DIR = "generated_images"
+DEFAULT_BATCH_CONCURRENCY = 4
 
 def _extract_output(response: Any) -> str:
     """
@@ -27,6 +38,33 @@ def _extract_output(response: Any) -> str:
     # 3. Handle Direct String Output
     return str(response)
 
+def _build_prompt(user_role: str, db_path: str, task: str) -> str:
+    """Builds the prompt sent to the agent for a single task."""
+    return (
+        f"User role: {user_role}\n"
+        f"Database Path: {db_path}\n"
+        f"Task: {task}\n"
+        "Please analyze the data and provide a concise answer. "
+        f"If you create a plot, save it in the '{IMAGES_DIR}/' directory "
+        "with a unique filename and mention the full path in your response."
+    )
+
+def _invoke_agent(agent: Any, prompt: str, thread_id: Optional[str] = None) -> Any:
+    """Invokes the agent, handling LangGraph and legacy LangChain interfaces."""
+    if hasattr(agent, 'invoke'):
+        # Try LangGraph format first, fall back to simple input
+        try:
+            if thread_id:
+                # Continue the conversation stored under this thread
+                return agent.invoke(
+                    {"messages": [("user", prompt)]},
+                    config={"configurable": {"thread_id": thread_id}}
+                )
+            return agent.invoke({"messages": [("user", prompt)]})
+        except (TypeError, ValueError):
+            return agent.invoke({"input": prompt})
+    return agent(prompt)
+
 def setup_environment() -> str:
     """Loads environment variables and validates API key."""
     load_dotenv()
@@ -42,8 +80,8 @@ def select_database() -> str:
     print(f"\nAvailable databases: {', '.join(DATABASES.keys())}")
     
     while True:
-        db_name = input("Select Database: ").strip().lower()
-        if db_name in DATABASES:
+        db_name = _resolve_database(input("Select Database: "))
+        if db_name is not None:
             db_path = os.path.abspath(DATABASES[db_name])
             if os.path.exists(db_path):
                 return db_path
@@ -68,8 +106,12 @@ def main():
             api_key=api_key, 
             temperature=0, 
             model=os.getenv("OPENAI_MODEL", DEFAULT_MODEL),
-            db_path=db_path
+            db_path=db_path,
+            checkpointer=create_checkpointer(),
+            user_role=user_role
         )
+        # Follow-up questions in this session build on the earlier ones
+        thread_id = f"cli-{uuid.uuid4().hex}"
         print("✓ Agent ready. (Type 'exit' or 'q' to quit)\n")
     except Exception as e:
         print(f"✗ Critical Error: Failed to build agent.\n{e}")
@@ -86,25 +128,11 @@ def main():
                 continue
 
             # Construct Prompt
-            prompt = (
-                f"User role: {user_role}\n"
-                f"Database Path: {db_path}\n"
-                f"Task: {task}\n"
-                "Please analyze the data and provide a concise answer."
-            )
+            prompt = _build_prompt(user_role, db_path, task)
 
             # Execute
             print("Thinking...")
-            
-            # Detect invocation method (invoke vs __call__)
-            if hasattr(agent, 'invoke'):
-                # Try LangGraph format first, fall back to simple input
-                try:
-                    raw_response = agent.invoke({"messages": [("user", prompt)]})
-                except (TypeError, ValueError):
-                    raw_response = agent.invoke({"input": prompt})
-            else:
-                raw_response = agent(prompt)
+            raw_response = _invoke_agent(agent, prompt, thread_id)
 
             # Output
             final_answer = _extract_output(raw_response)
@@ -117,5 +145,181 @@ def main():
         except Exception as e:
             print(f"Error during execution: {e}")
 
+# --- Batch Mode ---
+
+def _load_tasks(tasks_path: str) -> list:
+    """Reads batch tasks (role, database, question) from a JSONL file."""
+    tasks = []
+    with open(tasks_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            missing = [key for key in ("role", "database", "question") if not task.get(key)]
+            if missing:
+                raise ValueError(f"{tasks_path}:{line_no}: missing {', '.join(missing)}")
+            # Tasks without an explicit id are identified by their line number
+            task.setdefault("id", str(line_no))
+            tasks.append(task)
+    return tasks
+
+def _load_checkpoint(output_path: str) -> set:
+    """Returns the ids of tasks that already succeeded in a previous run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a partial last line
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result.get("id")))
+    return done
+
+def _ends_mid_line(output_path: str) -> bool:
+    """True if a killed run left a partial last line without its newline."""
+    if not os.path.exists(output_path) or not os.path.getsize(output_path):
+        return False
+    with open(output_path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+def _resolve_database(db_name: str) -> Optional[str]:
+    """Matches a database name against the registry, ignoring case."""
+    for name in DATABASES:
+        if name.lower() == db_name.strip().lower():
+            return name
+    return None
+
+def _percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def _run_batch(tasks: list, output_path: str, api_key: str, model: str, concurrency: int) -> dict:
+    """Runs tasks with bounded concurrency, appending one JSON result per task."""
+    done = _load_checkpoint(output_path)
+    pending = [task for task in tasks if str(task["id"]) not in done]
+    stats = {"total": len(tasks), "skipped": len(tasks) - len(pending), "ok": 0, "failed": 0, "latencies": []}
+
+    # One agent per (database, role), shared by every task that targets it
+    agents: Dict[tuple, Any] = {}
+    agent_locks: Dict[tuple, asyncio.Lock] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    loop = asyncio.get_running_loop()
+
+    async def get_agent(db_path: str, role: str) -> Any:
+        key = (db_path, role)
+        lock = agent_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key not in agents:
+                agents[key] = await loop.run_in_executor(
+                    executor,
+                    lambda: build_agent(api_key=api_key, temperature=0, model=model, db_path=db_path,
+                                        user_role=role),
+                )
+        return agents[key]
+
+    async def run_task(task: dict, out) -> None:
+        async with semaphore:
+            result = {"id": task["id"], "role": task["role"], "database": task["database"],
+                      "question": task["question"]}
+            start = time.perf_counter()
+            try:
+                db_name = _resolve_database(task["database"])
+                if db_name is None:
+                    raise ValueError(f"Unknown database: {task['database']}")
+                # Registry roles are lowercase, as in main()
+                role = task["role"].strip().lower()
+                if db_name not in USER_DB_ACCESS.get(role, []):
+                    raise PermissionError(f"Role '{task['role']}' cannot access {db_name}")
+
+                db_path = os.path.abspath(DATABASES[db_name])
+                agent = await get_agent(db_path, role)
+                prompt = _build_prompt(role, db_path, task["question"])
+                raw_response = await loop.run_in_executor(executor, _invoke_agent, agent, prompt)
+
+                answer = _extract_output(raw_response)
+                result.update({
+                    "status": "ok",
+                    "answer": answer,
+                    "charts": sorted(set(re.findall(rf"{IMAGES_DIR}/[\w-]+\.png", answer))),
+                    "exports": sorted(set(EXPORT_PATH_PATTERN.findall(answer))),
+                })
+                stats["ok"] += 1
+            except Exception as e:
+                result.update({"status": "error", "error": str(e)})
+                stats["failed"] += 1
+
+            elapsed = time.perf_counter() - start
+            result["seconds"] = round(elapsed, 3)
+            stats["latencies"].append(elapsed)
+
+            # Each finished task is flushed immediately so a rerun can resume
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[{stats['ok'] + stats['failed']}/{len(pending)}] {task['id']}: {result['status']} ({elapsed:.1f}s)")
+
+    start = time.perf_counter()
+    try:
+        with open(output_path, "a", encoding="utf-8") as out:
+            if _ends_mid_line(output_path):
+                # Keep the first new result off the partial line
+                out.write("\n")
+            await asyncio.gather(*(run_task(task, out) for task in pending))
+    finally:
+        executor.shutdown(wait=False)
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+def _print_batch_stats(stats: dict) -> None:
+    """Prints throughput and latency statistics for a batch run."""
+    processed = stats["ok"] + stats["failed"]
+    elapsed = stats["elapsed"]
+    latencies = stats["latencies"]
+    print("=" * 60)
+    print(f"Tasks: {stats['total']} total, {processed} processed, {stats['skipped']} skipped (already done)")
+    print(f"Results: {stats['ok']} ok, {stats['failed']} failed")
+    print(f"Elapsed: {elapsed:.1f}s  Throughput: {processed / elapsed * 60 if elapsed else 0:.1f} tasks/min")
+    if latencies:
+        print(
+            f"Latency: p50 {_percentile(latencies, 50):.1f}s, "
+            f"p95 {_percentile(latencies, 95):.1f}s, max {max(latencies):.1f}s"
+        )
+    print("=" * 60)
+
+def batch(tasks_path: str, output_path: str, concurrency: int) -> None:
+    """Runs every task in a JSONL file and writes results as JSONL."""
+    api_key = setup_environment()
+    tasks = _load_tasks(tasks_path)
+    model = os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+
+    print(f"=== Batch run: {len(tasks)} tasks, concurrency {concurrency} ===")
+    stats = asyncio.run(_run_batch(tasks, output_path, api_key, model, concurrency))
+    _print_batch_stats(stats)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Autonomous Data Analysis & Visualization Agent")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="Run questions from a JSONL file")
+    batch_parser.add_argument("tasks", help="JSONL file with one {role, database, question} per line")
+    batch_parser.add_argument("-o", "--output", default="batch_results.jsonl",
+                              help="JSONL results file, also used as the resume checkpoint")
+    batch_parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                              help="Maximum number of tasks running at once")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.command == "batch":
+        batch(args.tasks, args.output, max(1, args.concurrency))
+    else:
+        main()
\ No newline at end of file
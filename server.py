@@ -0,0 +1,517 @@
+# server.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import httpx
+from aiohttp import web
+from dotenv import load_dotenv
+
+from agent.memory import DEFAULT_MEMORY_TOKENS, create_checkpointer
+from agent.orchestrator import build_agent
+from data.dashboards import list_dashboards, read_manifest, start_dashboard_scheduler
+from data.export import EXPORT_FILE_PATTERN
+from data.db_registry import DATABASES, USER_DB_ACCESS, start_registry_watcher
+from data.metrics import NORMAL, UsageCallback, budget_status, record_request_metrics
+from main import DEFAULT_MODEL, IMAGES_DIR, _build_prompt, _extract_output, _resolve_database
+
+# --- Configuration ---
+
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+# Jobs waiting for a worker; beyond this, submissions get 429 + Retry-After
+MAX_QUEUED_JOBS = 32
+# Unfinished jobs per API key
+MAX_ACTIVE_JOBS_PER_USER = 4
+RETRY_AFTER_SECONDS = 5
+# Finished jobs (and their answers) are kept this long for polling
+JOB_TTL_SECONDS = 3600
+SSE_HEARTBEAT_SECONDS = 15
+MAX_EVENT_TEXT = 2000
+# Connections to the model backend, reused across requests (HTTP keep-alive)
+MODEL_MAX_CONNECTIONS = 20
+MODEL_KEEPALIVE_SECONDS = 60
+MODEL_TIMEOUT_SECONDS = 120
+
+CHART_PATTERN = re.compile(rf"{IMAGES_DIR}/([\w-]+\.png)")
+EXPORT_PATTERN = re.compile(rf"{IMAGES_DIR}/({EXPORT_FILE_PATTERN})")
+EXPORT_CONTENT_TYPES = {".gz": "application/gzip", ".parquet": "application/vnd.apache.parquet"}
+
+logger = logging.getLogger(__name__)
+
+
+def load_api_keys() -> Dict[str, Dict[str, str]]:
+    """
+    Parse AGENT_API_KEYS ("key:username:role,key2:username2:role2") into
+    key -> {"username", "role"}. Roles are the ones of USER_DB_ACCESS.
+    """
+    keys = {}
+    for entry in filter(None, (item.strip() for item in os.getenv("AGENT_API_KEYS", "").split(","))):
+        try:
+            key, username, role = entry.split(":")
+        except ValueError:
+            logger.warning("Ignoring malformed AGENT_API_KEYS entry")
+            continue
+        keys[key] = {"username": username, "role": role.lower()}
+    return keys
+
+
+class Job:
+    """One submitted question: status, answer and the events streamed so far."""
+
+    def __init__(self, user: Dict[str, str], db_name: str, question: str,
+                 conversation_id: Optional[str], approximate: bool):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.db_name = db_name
+        self.question = question
+        self.approximate = approximate
+        # Jobs of the same conversation share the agent's memory thread
+        self.thread_id = f"api-{user['username']}-{conversation_id or self.id}"
+        self.status = "queued"
+        self.answer = None
+        self.charts = []
+        self.exports = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        """Record an event and wake up stream subscribers (event loop thread only)."""
+        self.events.append((event, data))
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "database": self.db_name,
+            "question": self.question,
+            "answer": self.answer,
+            "charts": [f"/v1/charts/{name}" for name in self.charts],
+            "exports": [f"/v1/exports/{name}" for name in self.exports],
+            "error": self.error,
+            "queued_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "run_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class AgentService:
+    """
+    Queue and worker pool in front of build_agent.
+
+    Submissions go into a bounded asyncio queue; `workers` tasks take jobs
+    off it and run the blocking agent in a thread pool of the same size.
+    One agent is built per (database, approximate, role, model, memory) and
+    shared, and every agent talks to the model through one keep-alive HTTP
+    client. As in the Streamlit app, users over their token budget get the
+    economy model (and approximate mode), and every job is recorded in the
+    request metrics.
+    """
+
+    def __init__(self, api_key: str, model: str, workers: int = DEFAULT_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS):
+        self.api_key = api_key
+        self.model = model
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self.jobs: Dict[str, Job] = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-agent")
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=MODEL_MAX_CONNECTIONS,
+                max_keepalive_connections=MODEL_MAX_CONNECTIONS,
+                keepalive_expiry=MODEL_KEEPALIVE_SECONDS,
+            ),
+            timeout=MODEL_TIMEOUT_SECONDS,
+        )
+        self.checkpointer = create_checkpointer()
+        self._agents: Dict[tuple, Any] = {}
+        self._agent_lock = asyncio.Lock()
+        self._worker_tasks = []
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "busy_workers": 0}
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+        self.http_client.close()
+
+    def route_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Fast/strong routing counters summed over the agents (see agent/routing.py)."""
+        totals: Dict[str, Dict[str, Any]] = {}
+        for agent in list(self._agents.values()):
+            router = getattr(agent, "router", None)
+            for route, stats in (router.stats() if router else {}).items():
+                total = totals.setdefault(route, {"calls": 0, "failures": 0, "escalations": 0})
+                for field in total:
+                    total[field] += stats[field]
+        for total in totals.values():
+            total["success_rate"] = round(1 - total["failures"] / total["calls"], 3) if total["calls"] else None
+        return totals
+
+    def guard_stats(self) -> Dict[str, float]:
+        """Memoized/stopped tool calls and forced answers summed over the agents (see agent/loop_guard.py)."""
+        totals: Dict[str, float] = {}
+        for agent in list(self._agents.values()):
+            guard = getattr(agent, "guard", None)
+            for field, value in (guard.stats if guard else {}).items():
+                totals[field] = totals.get(field, 0) + value
+        return totals
+
+    def active_jobs(self, username: str) -> int:
+        return sum(1 for job in self.jobs.values() if job.user["username"] == username and not job.finished)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self, job: Job) -> None:
+        """Queue a job; raises asyncio.QueueFull when the service is saturated."""
+        self._prune()
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.stats["submitted"] += 1
+        job.publish("status", {"status": "queued", "position": self.queue.qsize()})
+
+    async def _get_agent(self, db_path: str, approximate: bool, role: str, model: str,
+                         memory_tokens: Optional[int] = None) -> Any:
+        key = (db_path, approximate, role, model, memory_tokens)
+        async with self._agent_lock:
+            if key not in self._agents:
+                self._agents[key] = await self.loop.run_in_executor(
+                    self.executor,
+                    lambda: build_agent(
+                        api_key=self.api_key, temperature=0, model=model, db_path=db_path,
+                        approximate=approximate, checkpointer=self.checkpointer,
+                        http_client=self.http_client, user_role=role,
+                        memory_tokens=memory_tokens or DEFAULT_MEMORY_TOKENS,
+                    ),
+                )
+        return self._agents[key]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            self.stats["busy_workers"] += 1
+            try:
+                await self._run_job(job)
+            finally:
+                self.stats["busy_workers"] -= 1
+                self.queue.task_done()
+
+    async def _run_job(self, job: Job) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        job.publish("status", {"status": "running"})
+        username, role = job.user["username"], job.user["role"]
+        budget = None
+        # Counts model calls as they finish, so failed jobs are charged too
+        usage_callback = UsageCallback()
+        start = time.perf_counter()
+        try:
+            budget = await self.loop.run_in_executor(self.executor, budget_status, username, role)
+            model = self.model if budget["level"] == NORMAL else budget["model"]
+            db_path = os.path.abspath(DATABASES[job.db_name])
+            agent = await self._get_agent(
+                db_path, job.approximate or budget["approximate"], role, model, budget["memory_tokens"]
+            )
+            prompt = _build_prompt(role, db_path, job.question)
+            answer = await self.loop.run_in_executor(
+                self.executor, self._stream_agent, agent, prompt, job, usage_callback
+            )
+            job.answer = answer
+            job.charts = sorted(set(CHART_PATTERN.findall(answer)))
+            job.exports = sorted(set(EXPORT_PATTERN.findall(answer)))
+            status = "done"
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            status = "failed"
+        # Recorded before the job shows as finished, so the user's next job sees its tokens
+        await self.loop.run_in_executor(
+            self.executor,
+            lambda: record_request_metrics(
+                None, "ok" if status == "done" else "error", time.perf_counter() - start,
+                username, role, job.db_name, budget, partial_usage=usage_callback.usage(),
+            ),
+        )
+        job.status = status
+        self.stats[status] += 1
+        job.finished_at = time.time()
+        job.publish("result", job.to_dict())
+
+    def _stream_agent(self, agent: Any, prompt: str, job: Job, usage_callback: UsageCallback) -> str:
+        """Run the agent in a worker thread, forwarding each step to the job's stream."""
+        def emit(event: str, data: Dict[str, Any]) -> None:
+            self.loop.call_soon_threadsafe(job.publish, event, data)
+
+        if not hasattr(agent, "stream"):
+            return _extract_output(agent.invoke({"input": prompt}, config={"callbacks": [usage_callback]}))
+
+        config = {"recursion_limit": 50, "configurable": {"thread_id": job.thread_id}, "callbacks": [usage_callback]}
+        answer = ""
+        for update in agent.stream({"messages": [("user", prompt)]}, config, stream_mode="updates"):
+            for node, output in update.items():
+                for message in (output or {}).get("messages", []):
+                    tool_calls = getattr(message, "tool_calls", None)
+                    if tool_calls:
+                        for call in tool_calls:
+                            emit("tool_call", {"tool": call["name"], "args": call["args"]})
+                    elif node == "tools":
+                        emit("tool_result", {
+                            "tool": getattr(message, "name", None),
+                            "content": str(message.content)[:MAX_EVENT_TEXT],
+                        })
+                    else:
+                        answer = str(message.content)
+                        emit("answer", {"content": answer})
+        return answer
+
+
+# --- HTTP handlers ---
+
+def _json_error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    """Map the API key (Bearer token or X-API-Key) to a user and role."""
+    if request.path == "/v1/health":
+        return await handler(request)
+    header = request.headers.get("Authorization", "")
+    key = header[len("Bearer "):] if header.startswith("Bearer ") else request.headers.get("X-API-Key")
+    user = request.app["api_keys"].get(key or "")
+    if user is None:
+        return _json_error(401, "Missing or invalid API key")
+    request["user"] = user
+    return await handler(request)
+
+
+def _get_job(request: web.Request) -> Job:
+    job = request.app["service"].jobs.get(request.match_info["job_id"])
+    # Other users' jobs are indistinguishable from missing ones
+    if job is None or job.user["username"] != request["user"]["username"]:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown job"}), content_type="application/json")
+    return job
+
+
+async def submit_question(request: web.Request) -> web.Response:
+    """POST /v1/questions {"question", "database", "conversation_id"?, "approximate"?} -> 202."""
+    service: AgentService = request.app["service"]
+    user = request["user"]
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return _json_error(400, "Body must be JSON")
+    question = str(body.get("question", "")).strip()
+    if not question:
+        return _json_error(400, "'question' is required")
+
+    db_name = _resolve_database(str(body.get("database", "")))
+    if db_name is None:
+        return _json_error(404, f"Unknown database: {body.get('database')}")
+    # Same access rules as the Streamlit app
+    if db_name not in USER_DB_ACCESS.get(user["role"], []):
+        return _json_error(403, f"Role '{user['role']}' cannot access {db_name}")
+
+    if service.active_jobs(user["username"]) >= MAX_ACTIVE_JOBS_PER_USER:
+        service.stats["rejected"] += 1
+        return _json_error(429, "Too many unfinished jobs", {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    job = Job(user, db_name, question, body.get("conversation_id"), bool(body.get("approximate", False)))
+    try:
+        service.submit(job)
+    except asyncio.QueueFull:
+        service.stats["rejected"] += 1
+        return _json_error(429, "Server busy, retry later", {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    logger.info(f"Job {job.id} queued for {user['username']} on {db_name}")
+    return web.json_response(
+        {"job_id": job.id, "status": job.status,
+         "poll_url": f"/v1/jobs/{job.id}", "stream_url": f"/v1/jobs/{job.id}/stream"},
+        status=202,
+    )
+
+
+async def poll_job(request: web.Request) -> web.Response:
+    """GET /v1/jobs/{job_id}: current status, and the answer once done."""
+    return web.json_response(_get_job(request).to_dict())
+
+
+async def stream_job(request: web.Request) -> web.StreamResponse:
+    """GET /v1/jobs/{job_id}/stream: server-sent events until the job finishes."""
+    job = _get_job(request)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+
+    sent = 0
+    while True:
+        changed = job._changed
+        # Replay everything published so far, then wait for more
+        while sent < len(job.events):
+            event, data = job.events[sent]
+            await response.write(f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8"))
+            sent += 1
+        if job.finished:
+            break
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=SSE_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            await response.write(b": keep-alive\n\n")
+    await response.write_eof()
+    return response
+
+
+async def get_chart(request: web.Request) -> web.StreamResponse:
+    """GET /v1/charts/{name}: a chart produced by one of the caller's jobs."""
+    name = request.match_info["name"]
+    owned = any(
+        name in job.charts
+        for job in request.app["service"].jobs.values()
+        if job.user["username"] == request["user"]["username"]
+    )
+    path = os.path.join(IMAGES_DIR, name)
+    if not owned or not os.path.isfile(path):
+        return _json_error(404, "Unknown chart")
+    return web.FileResponse(path, headers={"Content-Type": "image/png"})
+
+
+async def get_export(request: web.Request) -> web.StreamResponse:
+    """GET /v1/exports/{name}: a data export produced by one of the caller's jobs."""
+    name = request.match_info["name"]
+    owned = any(
+        name in job.exports
+        for job in request.app["service"].jobs.values()
+        if job.user["username"] == request["user"]["username"]
+    )
+    path = os.path.join(IMAGES_DIR, name)
+    if not owned or not os.path.isfile(path):
+        return _json_error(404, "Unknown export")
+    content_type = EXPORT_CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+    return web.FileResponse(path, headers={
+        "Content-Type": content_type,
+        "Content-Disposition": f'attachment; filename="{name}"',
+    })
+
+
+async def get_dashboards(request: web.Request) -> web.Response:
+    """GET /v1/dashboards: precomputed charts of the databases the caller may use."""
+    allowed = USER_DB_ACCESS.get(request["user"]["role"], [])
+    return web.json_response({"dashboards": [
+        {
+            "database": chart["database"],
+            "name": chart["name"],
+            "title": chart["title"],
+            "rendered_at": chart["rendered_at"],
+            "url": f"/v1/dashboards/{os.path.basename(chart['path'])}",
+        }
+        for chart in list_dashboards(allowed)
+    ]})
+
+
+async def get_dashboard_chart(request: web.Request) -> web.StreamResponse:
+    """GET /v1/dashboards/{name}: one precomputed chart, if the caller may use its database."""
+    name = request.match_info["name"]
+    allowed = USER_DB_ACCESS.get(request["user"]["role"], [])
+    for path, record in read_manifest().items():
+        if os.path.basename(path) == name and record.get("database") in allowed and os.path.isfile(path):
+            return web.FileResponse(path, headers={"Content-Type": "image/png"})
+    return _json_error(404, "Unknown dashboard chart")
+
+
+async def health(request: web.Request) -> web.Response:
+    service: AgentService = request.app["service"]
+    return web.json_response({
+        "status": "ok",
+        "queued": service.queue.qsize(),
+        "queue_capacity": service.queue.maxsize,
+        "workers": service.workers,
+        **service.stats,
+        "model_routes": service.route_stats(),
+        "loop_guard": service.guard_stats(),
+    })
+
+
+def create_app(api_key: str, model: str, workers: int = DEFAULT_WORKERS,
+               max_queued: int = MAX_QUEUED_JOBS, api_keys: Optional[Dict[str, Dict[str, str]]] = None) -> web.Application:
+    """Build the aiohttp application; the worker pool starts with the app."""
+    app = web.Application(middlewares=[auth_middleware])
+    app["api_keys"] = load_api_keys() if api_keys is None else api_keys
+    app["service"] = AgentService(api_key, model, workers=workers, max_queued=max_queued)
+
+    async def on_startup(app: web.Application) -> None:
+        start_registry_watcher()
+        start_dashboard_scheduler()
+        await app["service"].start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        await app["service"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.post("/v1/questions", submit_question),
+        web.get("/v1/jobs/{job_id}", poll_job),
+        web.get("/v1/jobs/{job_id}/stream", stream_job),
+        web.get("/v1/charts/{name}", get_chart),
+        web.get("/v1/exports/{name}", get_export),
+        web.get("/v1/dashboards", get_dashboards),
+        web.get("/v1/dashboards/{name}", get_dashboard_chart),
+        web.get("/v1/health", health),
+    ])
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HTTP API for the Data Analysis Agent")
+    parser.add_argument("--host", default=os.getenv("AGENT_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AGENT_API_PORT", DEFAULT_PORT)))
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Questions processed at once")
+    parser.add_argument("-q", "--max-queued", type=int, default=MAX_QUEUED_JOBS,
+                        help="Questions waiting for a worker before new ones are rejected with 429")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if not openai_key:
+        raise SystemExit("OPENAI_API_KEY not found in environment variables.")
+    if not load_api_keys():
+        raise SystemExit("AGENT_API_KEYS is empty: set it to key:username:role[,...]")
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    web.run_app(
+        create_app(openai_key, os.getenv("OPENAI_MODEL", DEFAULT_MODEL), max(1, args.workers), max(1, args.max_queued)),
+        host=args.host,
+        port=args.port,
+    )
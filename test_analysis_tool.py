@@ -1,7 +1,10 @@
 # test.py
 import os
 import sys
+import sqlite3
+import tempfile
 import unittest
+from unittest.mock import patch
 from dotenv import load_dotenv
 
 
@@ -120,6 +123,970 @@ class TestDataAnalysisAgent(unittest.TestCase):
         except Exception as e:
             self.fail(f"FAIL: Agent crashed during execution. Error: {e}")
 
+    def test_05_federated_connection(self):
+        """Unit test for cross-database queries through ATTACH."""
+        from data.connections import connect_federated
+
+        print("[Check] Testing federated ATTACH connection...")
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            for name, table in [("Sales", "orders"), ("Music", "tracks")]:
+                paths[name] = os.path.join(tmp, f"{name}.db")
+                conn = sqlite3.connect(paths[name])
+                conn.execute(f"CREATE TABLE {table} (id INTEGER, label TEXT)")
+                conn.execute(f"INSERT INTO {table} VALUES (1, '{name}')")
+                conn.commit()
+                conn.close()
+
+            conn = connect_federated(paths)
+            row = conn.execute(
+                "SELECT o.label, t.label FROM sales.orders o JOIN music.tracks t ON o.id = t.id"
+            ).fetchone()
+            self.assertEqual(row, ("Sales", "Music"))
+
+            # Federated connections are read-only
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM sales.orders")
+            conn.close()
+        print("PASS: Federated queries join across databases.")
+
+    def test_06_result_encoder_budget(self):
+        """Unit test for the token-budgeted result encoder."""
+        import pandas as pd
+        from tools.result_encoder import encode_result
+
+        print("[Check] Testing token-budgeted result encoding...")
+        small = pd.DataFrame({"country": ["USA", "Germany"], "total": [10.5, 7.25]})
+        encoded = encode_result(small, token_budget=200)
+        self.assertEqual(encoded["format"], "markdown")
+        self.assertIn("| Germany | 7.25 |", encoded["text"])
+
+        wide = pd.DataFrame({
+            "id": range(5000),
+            "notes": ["lorem ipsum dolor sit amet " * 10] * 5000,
+            "constant": ["same"] * 5000,
+        })
+        encoded = encode_result(wide, token_budget=500)
+        self.assertEqual(encoded["format"], "summary")
+        self.assertLessEqual(encoded["tokens_used"], 500)
+        self.assertGreater(encoded["tokens_saved"], 0)
+        self.assertIn("constant: always 'same'", encoded["text"])
+
+        # Pipes and line breaks in values must not break the markdown table
+        piped = pd.DataFrame({"name": ["AC|DC", "two\nlines"], "n": [1, 2]})
+        text = encode_result(piped, token_budget=200)["text"]
+        self.assertIn("| AC\\|DC | 1 |", text)
+        self.assertIn("| two lines | 2 |", text)
+
+        # Very wide results bound their column list and summary too
+        very_wide = pd.DataFrame({f"metric_{i}": range(2000) for i in range(300)})
+        encoded = encode_result(very_wide, token_budget=500)
+        self.assertEqual(encoded["format"], "summary")
+        self.assertLessEqual(encoded["tokens_used"], 500)
+        self.assertIn("more columns not shown", encoded["text"])
+        from tools.analysis_tool import DataAnalysisTool
+        self.assertEqual(DataAnalysisTool(db_path="shop.db", token_budget=300).token_budget, 300)
+        print("PASS: Encoded results stay within the token budget.")
+
+    def test_07_streaming_sketches(self):
+        """Unit test for the constant-memory sketches used to profile results."""
+        import numpy as np
+        import pandas as pd
+        from tools.sketches import HyperLogLog, KLLSketch, StreamingProfiler, hash_values
+
+        print("[Check] Testing streaming sketches...")
+        values = pd.Series(np.arange(50000))
+        hll = HyperLogLog()
+        hll.update(hash_values(values))
+        self.assertAlmostEqual(hll.estimate(), 50000, delta=50000 * 0.05)
+
+        # Chunks of one integer column arrive as int64, or float64 when they contain NULLs
+        mixed = StreamingProfiler()
+        for start in range(0, 1000, 100):
+            mixed.update(pd.DataFrame({"n": np.arange(start, start + 100)}))
+            mixed.update(pd.DataFrame({"n": list(range(start, start + 100)) + [None]}, dtype="float64"))
+        self.assertEqual(mixed.columns["n"]["nulls"], 10)
+        self.assertAlmostEqual(mixed.columns["n"]["hll"].estimate(), 1000, delta=1000 * 0.05)
+
+        kll = KLLSketch(seed=0)
+        for start in range(0, 50000, 5000):
+            kll.update(values.iloc[start:start + 5000].to_numpy())
+        median = kll.quantiles([0.5])[0]
+        self.assertAlmostEqual(median, 25000, delta=50000 * 0.02)
+
+        profiler = StreamingProfiler()
+        chunk = pd.DataFrame({"country": ["USA"] * 90 + ["UK"] * 10, "amount": range(100)})
+        for _ in range(3):
+            profiler.update(chunk)
+        self.assertEqual(profiler.rows, 300)
+        self.assertIn("top: USA (~270)", profiler.summary())
+        print("PASS: Sketches approximate distinct counts, quantiles and top values.")
+
+    def test_08_stats_catalog_refresh(self):
+        """Unit test for the column-statistics catalog and its sidecar refresh."""
+        from data.stats_catalog import load_catalog, sidecar_path
+
+        print("[Check] Testing statistics catalog...")
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "shop.db")
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE Customer (Id INTEGER PRIMARY KEY, Country TEXT)")
+            conn.execute("CREATE TABLE [Order] (Id INTEGER PRIMARY KEY, CustomerId INTEGER REFERENCES Customer(Id))")
+            conn.executemany("INSERT INTO Customer VALUES (?, ?)", [(1, "USA"), (2, "USA"), (3, None)])
+            conn.commit()
+
+            catalog = load_catalog(db_path)
+            customer = catalog["tables"]["Customer"]
+            self.assertEqual(customer["rows"], 3)
+            country = customer["columns"][1]
+            self.assertAlmostEqual(country["null_fraction"], 0.333, places=3)
+            self.assertEqual(country["top_values"], [["USA", 2]])
+            self.assertEqual(catalog["tables"]["Order"]["foreign_keys"][0]["ref_table"], "Customer")
+            self.assertTrue(os.path.exists(sidecar_path(db_path)))
+
+            # Only the changed table is rescanned after the file changes
+            conn.execute("INSERT INTO [Order] VALUES (1, 1)")
+            conn.commit()
+            conn.close()
+            os.utime(db_path, ns=(0, os.stat(db_path).st_mtime_ns + 10**9))
+            refreshed = load_catalog(db_path)
+            self.assertEqual(refreshed["tables"]["Order"]["rows"], 1)
+            self.assertIs(refreshed["tables"]["Customer"], catalog["tables"]["Customer"])
+
+            # An UPDATE keeps row count and max rowid but must still refresh the table
+            conn = sqlite3.connect(db_path)
+            conn.execute("UPDATE Customer SET Country = 'Canada' WHERE Country = 'USA'")
+            conn.commit()
+            conn.close()
+            os.utime(db_path, ns=(0, os.stat(db_path).st_mtime_ns + 10**9))
+            updated = load_catalog(db_path)
+            self.assertEqual(updated["tables"]["Customer"]["columns"][1]["top_values"], [["Canada", 2]])
+            self.assertIs(updated["tables"]["Order"], refreshed["tables"]["Order"])
+        print("PASS: Statistics catalog builds and refreshes incrementally.")
+
+    def test_09_sql_rewriter(self):
+        """Unit test for keyword quoting and local read-only validation."""
+        from data.sql_rewriter import QueryValidationError, prepare_query, quote_identifiers
+
+        print("[Check] Testing SQL rewriter...")
+        tables = {"order": "Order", "customer": "Customer"}
+        columns = {"id": "Id", "customerid": "CustomerId", "group": "Group"}
+        self.assertEqual(
+            quote_identifiers("select o.Id from\torder o join Customer c order by 1", tables, columns),
+            "select o.Id from\t[Order] o join Customer c order by 1",
+        )
+        self.assertEqual(
+            quote_identifiers("SELECT Group, COUNT(*) FROM (SELECT * FROM Order) GROUP BY Group", tables, columns),
+            "SELECT [Group], COUNT(*) FROM (SELECT * FROM [Order]) GROUP BY [Group]",
+        )
+
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE [Order] (Id INTEGER, Freight REAL)")
+        self.assertEqual(prepare_query(conn, "SELECT Id FROM Order"), "SELECT Id FROM [Order]")
+        for bad in ["DELETE FROM [Order]", "SELECT 1; DROP TABLE [Order]",
+                    "WITH x AS (SELECT 1) DELETE FROM [Order]"]:
+            with self.assertRaises(QueryValidationError):
+                prepare_query(conn, bad)
+        with self.assertRaisesRegex(QueryValidationError, "Did you mean: Freight"):
+            prepare_query(conn, "SELECT Freigth FROM [Order]")
+        print("PASS: Queries are rewritten and validated locally.")
+
+    def test_10_approximate_sampling(self):
+        """Unit test for sampled aggregates and their incremental refresh."""
+        from data import sampling
+
+        print("[Check] Testing approximate sampling...")
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(sampling, "LARGE_TABLE_ROWS", 1000), \
+                patch.object(sampling, "TARGET_SAMPLE_ROWS", 500):
+            db_path = os.path.join(tmp, "sales.db")
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE Invoice (Id INTEGER PRIMARY KEY, Country TEXT, Total REAL)")
+            conn.executemany("INSERT INTO Invoice VALUES (?, ?, ?)",
+                             [(i, "USA" if i % 2 else "UK", 10.0) for i in range(1, 10001)])
+            conn.execute("CREATE TABLE Customer (CustomerId INTEGER PRIMARY KEY, Name TEXT)")
+            conn.executemany("INSERT INTO Customer VALUES (?, ?)", [(i, f"c{i}") for i in range(1, 51)])
+            conn.commit()
+
+            df, label = sampling.run_approximate(
+                db_path, "SELECT Country, COUNT(*) AS n, SUM(Total) AS revenue FROM Invoice GROUP BY Country"
+            )
+            self.assertIn("APPROXIMATE RESULT", label)
+            for _, row in df.iterrows():
+                self.assertLess(abs(row["revenue"] - 50000), 3 * row["revenue_ci95"])
+            self.assertIsNone(sampling.run_approximate(db_path, "SELECT COUNT(DISTINCT Country) FROM Invoice"))
+
+            # Scaling the outer COUNT/SUM is only valid when the sample is read in the outer FROM
+            for shape in [
+                "SELECT COUNT(*) AS n FROM (SELECT Country FROM Invoice GROUP BY Country)",
+                "SELECT COUNT(*) FROM Customer WHERE CustomerId IN (SELECT Id % 50 FROM Invoice)",
+                "WITH t AS (SELECT Country FROM Invoice) SELECT COUNT(*) FROM t",
+                "SELECT COUNT(*) FROM Customer c LEFT JOIN Invoice i ON i.Id = c.CustomerId",
+                "SELECT COUNT(*) FROM Customer c LEFT OUTER JOIN Invoice i ON i.Id = c.CustomerId",
+                "SELECT COUNT(*) FROM Invoice a JOIN Invoice b ON a.Id = b.Id",
+                "SELECT Name, (SELECT COUNT(*) FROM Invoice) AS n FROM Customer",
+                # Aggregates wrapped in another expression would come back unscaled
+                "SELECT Country, ROUND(SUM(Total), 2) AS revenue FROM Invoice GROUP BY Country",
+                "SELECT CAST(COUNT(*) AS REAL) AS n FROM Invoice",
+                "SELECT SUM(Total) / COUNT(*) AS mean FROM Invoice",
+            ]:
+                self.assertIsNone(sampling.run_approximate(db_path, shape), shape)
+            joined = sampling.run_approximate(
+                db_path, "SELECT COUNT(*) AS n FROM Invoice i LEFT JOIN Customer c ON c.CustomerId = i.Id"
+            )
+            self.assertIsNotNone(joined)
+            total = sampling.run_approximate(db_path, "SELECT TOTAL(Total) AS revenue FROM Invoice")[0]
+            self.assertLess(abs(total["revenue"][0] - 100000), 3 * total["revenue_ci95"][0])
+            self.assertLess(abs(joined[0]["n"][0] - 10000), 3 * joined[0]["n_ci95"][0])
+
+            # Appended rows extend the existing sample instead of rebuilding it
+            conn.executemany("INSERT INTO Invoice VALUES (?, ?, ?)",
+                             [(i, "UK", 10.0) for i in range(10001, 12001)])
+            conn.commit()
+            conn.close()
+            os.utime(db_path, ns=(0, os.stat(db_path).st_mtime_ns + 10**9))
+            meta = sampling.refresh_samples(db_path)["Invoice"]
+            self.assertEqual(meta["source_rows"], 12000)
+            self.assertAlmostEqual(meta["rate"], 0.05)
+        print("PASS: Sampled aggregates are scaled and refreshed incrementally.")
+
+    def test_11_conversation_memory_trimming(self):
+        """Unit test for token-bounded history with references to trimmed queries."""
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+        from agent.memory import bound_history
+
+        print("[Check] Testing conversation memory trimming...")
+        call = {"name": "analyze_data", "args": {"query": "SELECT Country, COUNT(*) FROM Customer GROUP BY 1"}, "id": "c1"}
+        messages = [
+            HumanMessage(content="Task: customers per country"),
+            AIMessage(content="", tool_calls=[call]),
+            ToolMessage(content="Query Results:\n| Country | n |\n| USA | 13 |", tool_call_id="c1"),
+            AIMessage(content="USA has the most customers. " * 100),
+            HumanMessage(content="Task: now only Europe"),
+        ]
+        self.assertEqual(bound_history(messages, max_tokens=10000), messages)
+
+        bounded = bound_history(messages, max_tokens=200)
+        self.assertIsInstance(bounded[0], SystemMessage)
+        self.assertIn("SELECT Country, COUNT(*) FROM Customer", bounded[0].content)
+        self.assertIn("customers per country", bounded[0].content)
+        self.assertIs(bounded[-1], messages[-1])
+        self.assertFalse(any(isinstance(m, ToolMessage) for m in bounded))
+        print("PASS: Old turns are trimmed and their queries kept as references.")
+
+    def test_12_bounded_chat_history(self):
+        """Unit test for the in-memory chat window and its disk spill."""
+        from data.chat_history import BoundedChatHistory, live_log_paths
+
+        print("[Check] Testing bounded chat history...")
+        with tempfile.TemporaryDirectory() as tmp:
+            history = BoundedChatHistory("session", window=3, directory=tmp)
+            for i in range(8):
+                history.append({"role": "user", "content": f"question {i}"})
+            self.assertEqual(len(history), 8)
+            self.assertEqual([m["content"] for m in history], ["question 5", "question 6", "question 7"])
+            self.assertEqual([m["content"] for m in history.load_older(2)], ["question 3", "question 4"])
+            self.assertEqual(history.stats()["spilled"], 5)
+            self.assertIn(os.path.abspath(history.path), live_log_paths())
+
+            # A log deleted under a live session means no older messages, not a crash
+            os.remove(history.path)
+            self.assertEqual(history.load_older(2), [])
+            self.assertEqual([m["content"] for m in history], ["question 5", "question 6", "question 7"])
+
+            history.clear()
+            self.assertFalse(os.path.exists(history.path))
+        print("PASS: Chat history stays bounded and pages back from disk.")
+
+    def test_13_shared_cache(self):
+        """Unit test for the cross-process cache: sharing, stats and LRU eviction."""
+        from data.shared_cache import SharedCache, make_key
+
+        print("[Check] Testing shared cache...")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite")
+            # Two instances on one file behave like two worker processes
+            worker_a = SharedCache(path, max_bytes=1000)
+            worker_b = SharedCache(path, max_bytes=1000)
+            key = make_key("/db.sqlite", [1, 2], "SELECT 1")
+            self.assertEqual(key, make_key("/db.sqlite", [1, 2], "SELECT 1"))
+            worker_a.set("result", key, "cached text")
+            self.assertEqual(worker_b.get("result", key), "cached text")
+            self.assertIsNone(worker_b.get("result", make_key("other")))
+
+            worker_a.set("render", "old", b"x" * 400)
+            worker_a.set("render", "new", b"y" * 400)
+            worker_a.get("render", "old")
+            worker_a.set("render", "newest", b"z" * 400)
+            self.assertIsNone(worker_a.get("render", "new"))
+            self.assertEqual(worker_a.get("render", "old"), b"x" * 400)
+
+            stats = worker_b.stats()
+            self.assertEqual(stats["result"]["hits"], 1)
+            self.assertEqual(stats["result"]["misses"], 1)
+            self.assertEqual(stats["render"]["evictions"], 1)
+
+            # Reads do not wait for another process holding the write lock
+            worker_a.set("schema", "tables", "Customer, Invoice")
+            writer = sqlite3.connect(path, isolation_level=None)
+            writer.execute("BEGIN IMMEDIATE")
+            try:
+                with patch("data.shared_cache.FLUSH_SECONDS", 3600):
+                    self.assertEqual(worker_b.get("schema", "tables"), "Customer, Invoice")
+            finally:
+                writer.execute("ROLLBACK")
+                writer.close()
+            self.assertEqual(worker_b.stats()["schema"]["hits"], 1)
+        print("PASS: Cache entries are shared, counted and evicted LRU-first.")
+
+    def test_14_registry_from_config(self):
+        """Unit test for database discovery and role access from config.yaml."""
+        from data import db_registry
+
+        print("[Check] Testing config-driven database registry...")
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "dbs"))
+            for filename in ["northwind_small.sqlite", "Sales_2024.db", "chinook.db.samples.sqlite"]:
+                sqlite3.connect(os.path.join(tmp, "dbs", filename)).close()
+            config_path = os.path.join(tmp, "config.yaml")
+            with open(config_path, "w") as f:
+                f.write(
+                    'database_path: "dbs"\n'
+                    'databases: {Northwind: "northwind_small.sqlite", Chinook: "chinook.db"}\n'
+                    'user_db_access: {admin: ["*"], analyst: [Northwind, Chinook]}\n'
+                )
+
+            config = db_registry.load_config(config_path)
+            databases = db_registry.discover_databases(config, config_path)
+            self.assertEqual(sorted(databases), ["Northwind", "Sales_2024"])
+            access = db_registry.resolve_access(config, databases)
+            self.assertEqual(sorted(access["admin"]), ["Northwind", "Sales_2024"])
+            self.assertEqual(access["analyst"], ["Northwind"])
+            self.assertEqual(access["guest"], [])
+        print("PASS: Databases are discovered and access follows config.yaml.")
+
+    def test_15_streaming_export(self):
+        """Unit test for chunked CSV export with a row limit."""
+        import csv
+        import gzip
+        from data import export
+
+        print("[Check] Testing streaming export...")
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE t (id INTEGER, name TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, f"row {i}") for i in range(250)])
+        with tempfile.TemporaryDirectory() as tmp, patch.object(export, "FETCH_ROWS", 100):
+            progress = []
+            path = os.path.join(tmp, "export.csv.gz")
+            result = export.export_query(
+                conn, "SELECT * FROM t", path, max_rows=150,
+                progress=lambda rows, size: progress.append(rows)
+            )
+            self.assertTrue(result["truncated"])
+            self.assertEqual(result["rows"], 150)
+            self.assertEqual(progress, [100, 150])
+            with gzip.open(path, "rt", newline="") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ["id", "name"])
+            self.assertEqual(rows[-1], ["149", "row 149"])
+
+            result = export.export_query(conn, "SELECT * FROM t", path)
+            self.assertFalse(result["truncated"])
+            self.assertEqual(result["rows"], 250)
+        print("PASS: Exports stream in chunks and stop at the row limit.")
+
+    def test_16_dashboard_refresh(self):
+        """Unit test for re-rendering dashboard charts only when their data changes."""
+        from data import dashboards
+
+        print("[Check] Testing dashboard refresh on data change...")
+        def fake_render(spec, db_path):
+            with open(spec["path"], "wb") as f:
+                f.write(b"png")
+            return 1
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                db_path = os.path.join(tmp, "sales.db")
+                sqlite3.connect(db_path).close()
+                with open("config.yaml", "w") as f:
+                    f.write(
+                        "dashboards: {Sales: {"
+                        "trend: {title: Monthly sales, query: SELECT 1, keywords: [sales over time]}, "
+                        "genres: {title: Revenue by genre, query: SELECT 2}, "
+                        "customers: {title: Top 10 customers by sales, query: SELECT 3, keywords: [top customers]}"
+                        "}}\n"
+                    )
+                with patch.dict(dashboards.DATABASES, {"Sales": db_path}, clear=True), \
+                        patch.object(dashboards, "render_chart", side_effect=fake_render) as render:
+                    self.assertEqual(len(dashboards.refresh_dashboards("config.yaml")), 3)
+                    self.assertEqual(dashboards.refresh_dashboards("config.yaml"), [])
+                    conn = sqlite3.connect(db_path)
+                    conn.execute("CREATE TABLE t (x INTEGER)")
+                    conn.commit()
+                    conn.close()
+                    self.assertEqual(len(dashboards.refresh_dashboards("config.yaml")), 3)
+                    self.assertEqual(render.call_count, 6)
+                    for question, name in [
+                        ("Plot sales over time", "trend"), ("Monthly sales please", "trend"),
+                        ("Show revenue by genres", "genres"), ("Who are our top customers?", "customers"),
+                    ]:
+                        paths = [match["path"] for match in dashboards.find_dashboards(question, ["Sales"])]
+                        self.assertEqual(paths, [dashboards.dashboard_path("Sales", name)], question)
+                    # One shared word is not a match
+                    for question in ["What were total sales by country?", "Show the top products",
+                                     "Plot revenue by country", "How many sales reps are in London?"]:
+                        self.assertEqual(dashboards.find_dashboards(question, ["Sales"]), [], question)
+            finally:
+                os.chdir(cwd)
+        print("PASS: Charts are re-rendered only after the database changes.")
+
+    def test_17_request_metrics_and_budget(self):
+        """Unit test for token accounting, rollups and budget degradation."""
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+        from langchain_core.tools import tool
+        from agent.orchestrator import _build_graph_agent
+        from data import metrics
+
+        print("[Check] Testing request metrics and token budgets...")
+        def ai(tokens_in, tokens_out, **kwargs):
+            return AIMessage(
+                content="", usage_metadata={"input_tokens": tokens_in, "output_tokens": tokens_out,
+                                            "total_tokens": tokens_in + tokens_out},
+                response_metadata={"model_name": "gpt-4o-2024-08-06"}, **kwargs
+            )
+
+        result = {"messages": [
+            HumanMessage("earlier question"), ai(500, 50),
+            HumanMessage("question"),
+            ai(1000, 100, tool_calls=[{"name": "analyze_data", "args": {}, "id": "1"}]),
+            ToolMessage("rows", tool_call_id="1"), ai(1500, 200),
+        ]}
+        usage = metrics.turn_usage(result)
+        self.assertEqual((usage["prompt_tokens"], usage["completion_tokens"]), (2500, 300))
+        self.assertEqual((usage["steps"], usage["tool_calls"]), (2, 1))
+        prices = {"gpt-4o": {"prompt": 2.5, "completion": 10.0}}
+        self.assertAlmostEqual(metrics.turn_cost(usage, prices), 0.00925)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = metrics.MetricsStore(os.path.join(tmp, "metrics.sqlite"))
+            for seconds in (1.0, 3.0, 45.0):
+                store.record(username="ana", database="Chinook", total_tokens=usage["total_tokens"],
+                             cost_usd=0.01, wall_seconds=seconds, status="ok")
+            rollup = store.rollup("username")
+            self.assertEqual((rollup[0]["requests"], rollup[0]["tokens"]), (3, 8400))
+            self.assertEqual(rollup[0]["p50_seconds"], 3.0)
+            self.assertEqual(store.latency_histogram()["<2s"], 1)
+
+            config = {"token_budgets": {"model": "gpt-4o", "economy_model": "gpt-4o-mini", "economy_at": 0.8,
+                                        "daily_tokens": {"analyst": 10000, "default": 0}}}
+            with patch.object(metrics, "load_config", return_value=config):
+                self.assertEqual(metrics.budget_status("ana", "analyst", store)["level"], metrics.ECONOMY)
+                store.record(username="ana", total_tokens=2000, wall_seconds=1.0, status="ok")
+                status = metrics.budget_status("ana", "analyst", store)
+                self.assertEqual((status["level"], status["model"]), (metrics.MINIMAL, "gpt-4o-mini"))
+                self.assertTrue(status["approximate"])
+                self.assertEqual(metrics.budget_status("ana", "admin", store)["level"], metrics.NORMAL)
+
+        # A request that fails halfway is still charged for the model calls it made
+        class LocalModel(GenericFakeChatModel):
+            def bind_tools(self, tools, **kwargs):
+                return self
+
+        def replies():
+            yield ai(1000, 100, tool_calls=[{"name": "analyze_data", "args": {"query": "SELECT 1"}, "id": "1"}])
+            raise TimeoutError("model timed out")
+
+        @tool
+        def analyze_data(query: str) -> str:
+            """Run a SQL query."""
+            return "1"
+
+        callback = metrics.UsageCallback()
+        agent = _build_graph_agent(LocalModel(messages=replies()), [analyze_data], "system", 1)
+        with self.assertRaises(TimeoutError):
+            agent.invoke({"messages": [("user", "Task: q")]}, config={"callbacks": [callback]})
+        partial = callback.usage()
+        self.assertEqual((partial["prompt_tokens"], partial["completion_tokens"]), (1000, 100))
+        self.assertEqual((partial["steps"], partial["tool_calls"]), (1, 1))
+        self.assertAlmostEqual(metrics.turn_cost(partial, prices), 0.0035)
+        print("PASS: Tokens, cost and latency are recorded and budgets degrade the agent.")
+
+    def test_18_model_routing(self):
+        """Offline test: simple steps use the fast model, tool errors escalate to the strong one."""
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage, HumanMessage
+        from langchain_core.tools import tool
+        from agent.orchestrator import _build_graph_agent
+        from agent.routing import FAST, STRONG
+
+        class LocalModel(GenericFakeChatModel):
+            def bind_tools(self, tools, **kwargs):
+                return self
+
+        @tool
+        def analyze_data(query: str) -> str:
+            """Run a SQL query."""
+            return "SQL Error (query was not executed): no such column: nope"
+
+        print("[Check] Testing fast/strong model routing offline...")
+        fast = LocalModel(messages=iter([
+            AIMessage(content="", tool_calls=[{"name": "analyze_data", "args": {"query": "SELECT nope"}, "id": "1"}]),
+        ]))
+        strong = LocalModel(messages=iter([AIMessage(content="There are 91 customers.")]))
+        agent = _build_graph_agent(strong, [analyze_data], "system", 1, fast_llm=fast)
+
+        result = agent.invoke({"messages": [("user", "Task: How many customers are there?")]})
+        routes = [m.response_metadata.get("route") for m in result["messages"] if m.type == "ai"]
+        self.assertEqual(routes, [FAST, STRONG])
+        self.assertEqual(result["messages"][-1].content, "There are 91 customers.")
+        stats = agent.router.stats()
+        self.assertEqual((stats[FAST]["calls"], stats[FAST]["failures"]), (1, 1))
+        self.assertEqual((stats[STRONG]["calls"], stats[STRONG]["success_rate"]), (1, 1.0))
+
+        route, reason = agent.router.choose([HumanMessage("Task: Compare sales by year")])
+        self.assertEqual(route, STRONG)
+        print(f"PASS: Routed {routes}; complex question -> {route} ({reason}).")
+
+    def test_19_time_series_resampling(self):
+        """Unit test for date detection, granularity choice and grouped series SQL."""
+        from data import timeseries
+
+        print("[Check] Testing time-series resampling...")
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE Sales (Id INTEGER, Region TEXT, OrderDate TEXT, Amount REAL)")
+        conn.executemany(
+            "INSERT INTO Sales VALUES (?, ?, ?, ?)",
+            [(i, "North", f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d} 10:00:00", 10.0) for i in range(600)]
+        )
+        self.assertEqual(timeseries.detect_date_columns(conn, "Sales"), ["OrderDate"])
+        self.assertEqual(timeseries.choose_granularity("2023-01-01", "2023-01-31"), "day")
+        self.assertEqual(timeseries.choose_granularity("2023-01-01", "2023-12-31"), "week")
+        self.assertEqual(timeseries.choose_granularity("2020-01-01", "2023-12-31"), "month")
+        self.assertEqual(timeseries.choose_granularity("2010-01-01", "2023-12-31"), "quarter")
+
+        rows = conn.execute(timeseries.series_query("Sales", "OrderDate", "SUM(Amount)", "quarter")).fetchall()
+        self.assertEqual([period for period, _ in rows], ["2023-Q1", "2023-Q2", "2023-Q3", "2023-Q4"])
+        self.assertEqual(sum(value for _, value in rows), 6000.0)
+        week = conn.execute(timeseries.series_query("Sales", "OrderDate", granularity="week")).fetchone()[0]
+        self.assertEqual(week, "2022-12-26")  # Monday of the week of 2023-01-01
+        print("PASS: Trends are grouped in SQL at a granularity fitting the date range.")
+
+    def test_20_loop_guard(self):
+        """Offline test: repeated calls are memoized, failing loops stopped, and the agent made to answer."""
+        import time
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage, HumanMessage
+        from langchain_core.tools import tool
+        from agent.orchestrator import _build_graph_agent
+        from agent.loop_guard import LOOP_ERROR, MEMO_NOTE, RunGuard
+
+        class LocalModel(GenericFakeChatModel):
+            def bind_tools(self, tools, **kwargs):
+                return self
+
+        runs = {"inspect_schema": 0, "analyze_data": 0}
+
+        @tool
+        def inspect_schema() -> str:
+            """Describe the tables."""
+            runs["inspect_schema"] += 1
+            return "Table: Customer (Id, Country)"
+
+        @tool
+        def analyze_data(query: str) -> str:
+            """Run a SQL query."""
+            runs["analyze_data"] += 1
+            if "nope" in query:
+                return "SQL Error (query was not executed): no such column: nope"
+            return "Note\nvip"
+
+        def step(name, n, **args):
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": str(n)}])
+
+        print("[Check] Testing tool-call memoization and loop detection offline...")
+        llm = LocalModel(messages=iter([
+            step("inspect_schema", 1),
+            step("inspect_schema", 2),
+            step("analyze_data", 3, query="SELECT nope FROM Customer"),
+            step("analyze_data", 4, query="SELECT  nope FROM Customer;"),
+            step("analyze_data", 5, query="SELECT nope FROM Customer"),
+            step("analyze_data", 6, query="SELECT nope FROM Customers"),
+            AIMessage(content="The column 'nope' does not exist."),
+        ]))
+        agent = _build_graph_agent(llm, [inspect_schema, analyze_data], "system", 1)
+        result = agent.invoke({"messages": [("user", "Task: How many nopes are there?")]})
+
+        tool_results = [m.content for m in result["messages"] if m.type == "tool"]
+        self.assertEqual(runs, {"inspect_schema": 1, "analyze_data": 2})
+        self.assertTrue(tool_results[1].startswith(MEMO_NOTE))
+        self.assertTrue(tool_results[4].startswith(LOOP_ERROR) and tool_results[5].startswith(LOOP_ERROR))
+        self.assertEqual(result["messages"][-1].content, "The column 'nope' does not exist.")
+        stats = agent.guard.stats
+        self.assertEqual((stats["memoized_calls"], stats["loops_stopped"], stats["forced_answers"]), (1, 2, 1))
+        self.assertEqual(stats["tool_calls_saved"], 3)
+
+        # Two failures, then a corrected (but textually close) query: it runs
+        runs["analyze_data"] = 0
+        llm = LocalModel(messages=iter([
+            step("analyze_data", 1, query="SELECT nope FROM Customer"),
+            step("analyze_data", 2, query="SELECT nope FROM Customer"),
+            step("analyze_data", 3, query="SELECT Note FROM Customer"),
+            AIMessage(content="One note: vip."),
+        ]))
+        agent = _build_graph_agent(llm, [inspect_schema, analyze_data], "system", 1)
+        result = agent.invoke({"messages": [("user", "Task: Which notes are there?")]})
+        tool_results = [m.content for m in result["messages"] if m.type == "tool"]
+        self.assertEqual(runs["analyze_data"], 3)
+        self.assertEqual(tool_results[2], "Note\nvip")
+        self.assertEqual(agent.guard.stats["loops_stopped"], 0)
+
+        guard = RunGuard(max_steps=2)
+        self.assertIsNone(guard.stop_reason([HumanMessage("Task: q"), AIMessage("")], time.time()))
+        self.assertIn("step budget", guard.stop_reason([HumanMessage("Task: q")] + [AIMessage("")] * 2, time.time()))
+        print(f"PASS: {stats['tool_calls_saved']} tool calls saved, final answer forced after repeated failures.")
+
+    def test_21_value_index(self):
+        """Unit test for mapping user terms to stored values and the incremental index refresh."""
+        from data.value_index import _read_sidecar, get_value_index
+
+        print("[Check] Testing categorical value index...")
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "music.db")
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE Artist (ArtistId INTEGER PRIMARY KEY, Name TEXT)")
+            conn.execute("CREATE TABLE Customer (Id INTEGER PRIMARY KEY, Country TEXT, Since TEXT)")
+            conn.executemany("INSERT INTO Artist (Name) VALUES (?)", [("AC/DC",), ("Aerosmith",), ("Led Zeppelin",)])
+            conn.executemany(
+                "INSERT INTO Customer (Country, Since) VALUES (?, ?)",
+                [("Germany", "2021-01-01"), ("Germany", "2022-01-01"), ("Brazil", "2021-01-01"), ("São Tomé", None),
+                 ("USA", "2023-01-01")]
+            )
+            conn.commit()
+
+            index = get_value_index(db_path)
+            best = index.lookup("ac dc")[0]
+            self.assertEqual(
+                (best["table"], best["column"], best["value"], best["score"]), ("Artist", "Name", "AC/DC", 1.0)
+            )
+            self.assertEqual(index.lookup("GERMANY")[0]["rows"], 2)
+            self.assertEqual(index.lookup("brasil")[0]["value"], "Brazil")
+            self.assertEqual(index.lookup("sao tome")[0]["value"], "São Tomé")
+            self.assertEqual(index.lookup("zeppelin", column="Name")[0]["value"], "Led Zeppelin")
+            self.assertEqual(index.lookup("germany", table="Artist"), [])
+            self.assertFalse(any(match["column"] == "Since" for match in index.lookup("2021-01-01")))
+
+            # Only the changed table is rescanned after the file changes
+            customers = _read_sidecar(db_path)["tables"]["Customer"]
+            conn.execute("INSERT INTO Artist (Name) VALUES ('Nightwish')")
+            conn.commit()
+            conn.close()
+            os.utime(db_path, ns=(0, os.stat(db_path).st_mtime_ns + 10**9))
+            self.assertEqual(get_value_index(db_path).lookup("night wish")[0]["value"], "Nightwish")
+            self.assertEqual(_read_sidecar(db_path)["tables"]["Customer"], customers)
+
+            # UPDATEs keep the row count but change the values: the table is rescanned too
+            artists = _read_sidecar(db_path)["tables"]["Artist"]
+            conn = sqlite3.connect(db_path)
+            conn.execute("UPDATE Customer SET Country='United States' WHERE Country='USA'")
+            conn.commit()
+            conn.close()
+            os.utime(db_path, ns=(0, os.stat(db_path).st_mtime_ns + 10**9))
+            index = get_value_index(db_path)
+            self.assertEqual(index.lookup("united states")[0]["value"], "United States")
+            self.assertFalse(any(match["value"] == "USA" for match in index.lookup("usa")))
+            self.assertEqual(_read_sidecar(db_path)["tables"]["Artist"], artists)
+        print("PASS: User terms map to exact stored values; the index refreshes per changed table.")
+
+    def test_22_concurrent_tool_executor(self):
+        """Offline test: mixed parallel/serial calls keep request order, record time saved, pools stay bounded."""
+        import time
+        from langchain_core.messages import AIMessage
+        from langchain_core.tools import tool
+        from agent.tool_executor import ConcurrentToolExecutor
+        from data import connections
+
+        @tool("analyze_data")
+        def analyze_data(query: str) -> str:
+            """Run a SQL query."""
+            time.sleep(0.2)
+            return f"result of {query}"
+
+        @tool("data_visualization")
+        def data_visualization(title: str) -> str:
+            """Plot a chart."""
+            return f"chart {title}"
+
+        print("[Check] Testing concurrent tool execution and pool bounds...")
+        calls = [
+            {"name": "analyze_data", "args": {"query": "q1"}, "id": "1"},
+            {"name": "data_visualization", "args": {"title": "t"}, "id": "2"},
+            {"name": "analyze_data", "args": {"query": "q2"}, "id": "3"},
+            {"name": "analyze_data", "args": {"query": "q3"}, "id": "4"},
+        ]
+        executor = ConcurrentToolExecutor([analyze_data, data_visualization], max_workers=3)
+        result = executor({"messages": [AIMessage(content="", tool_calls=calls)]})
+        self.assertEqual(
+            [m.content for m in result["messages"]], ["result of q1", "chart t", "result of q2", "result of q3"]
+        )
+        self.assertEqual([m.tool_call_id for m in result["messages"]], ["1", "2", "3", "4"])
+        stats = executor.stats
+        self.assertEqual((stats["steps"], stats["tool_calls"], stats["parallel_steps"]), (1, 4, 1))
+        self.assertGreater(stats["saved_seconds"], 0.2)
+        self.assertAlmostEqual(stats["serial_seconds"] - stats["wall_seconds"], stats["saved_seconds"], places=6)
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(connections, "MAX_POOLS", 2):
+            paths = []
+            for name in ("a", "b", "c"):
+                paths.append(os.path.join(tmp, f"{name}.db"))
+                sqlite3.connect(paths[-1]).close()
+            first = connections.get_pool(db_path=paths[0])
+            for path in paths[1:]:
+                connections.get_pool(db_path=path)
+            self.assertTrue(first.closed)
+            self.assertLessEqual(len(connections._POOLS), 2)
+        print(f"PASS: Results in request order, {stats['saved_seconds']:.2f}s saved, old pools closed.")
+
+    def test_23_batch_checkpoint_resume(self):
+        """Offline test: an interrupted batch resumes, skipping tasks that already succeeded."""
+        import asyncio
+        import json
+        import main
+        from langchain_core.messages import AIMessage
+
+        class LocalAgent:
+            def __init__(self, fail_on=None):
+                self.fail_on = fail_on
+                self.questions = []
+
+            def invoke(self, state, config=None):
+                question = state["messages"][0][1].split("Task: ")[1].splitlines()[0]
+                self.questions.append(question)
+                if self.fail_on and self.fail_on in question:
+                    raise RuntimeError("model timed out")
+                return {"messages": [AIMessage(content=f"Answer to {question}")]}
+
+        print("[Check] Testing batch checkpoint and resume...")
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.dict(main.DATABASES, {"Shop": os.path.join(tmp, "shop.db")}, clear=True), \
+                patch.dict(main.USER_DB_ACCESS, {"analyst": ["Shop"]}, clear=True):
+            tasks_path, output_path = os.path.join(tmp, "tasks.jsonl"), os.path.join(tmp, "results.jsonl")
+            with open(tasks_path, "w", encoding="utf-8") as f:
+                for role, question in [("analyst", "count customers"), ("Analyst", "top products"),
+                                       ("analyst", "slow trend"), (" ANALYST ", "total sales")]:
+                    f.write(json.dumps({"role": role, "database": "shop", "question": question}) + "\n")
+            tasks = main._load_tasks(tasks_path)
+            self.assertEqual([task["id"] for task in tasks], ["1", "2", "3", "4"])
+
+            # First run: one task fails, then the process is killed mid-write of the last line
+            first = LocalAgent(fail_on="slow")
+            with patch.object(main, "build_agent", return_value=first):
+                stats = asyncio.run(main._run_batch(tasks[:3], output_path, "key", "model", 2))
+            self.assertEqual((stats["ok"], stats["failed"], stats["skipped"]), (2, 1, 0))
+            with open(output_path, "a", encoding="utf-8") as f:
+                f.write('{"id": "4", "status": "o')
+            self.assertEqual(main._load_checkpoint(output_path), {"1", "2"})
+
+            # Resume: only the failed and the unfinished task run again
+            second = LocalAgent()
+            with patch.object(main, "build_agent", return_value=second):
+                stats = asyncio.run(main._run_batch(tasks, output_path, "key", "model", 2))
+            self.assertEqual(sorted(second.questions), ["slow trend", "total sales"])
+            self.assertEqual((stats["ok"], stats["failed"], stats["skipped"]), (2, 0, 2))
+            self.assertEqual(main._load_checkpoint(output_path), {"1", "2", "3", "4"})
+
+        self.assertEqual(main._percentile(list(range(1, 101)), 50), 50)
+        self.assertEqual(main._percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(main._percentile([3.0], 95), 3.0)
+        self.assertEqual(main._percentile([], 50), 0.0)
+        print("PASS: Batch resumes from its results file and reports latency percentiles.")
+
+    def test_24_http_service(self):
+        """Offline test of the HTTP API: jobs, event stream, file access and back-pressure."""
+        import asyncio
+        import json
+        import threading
+        import server
+        from aiohttp.test_utils import TestClient, TestServer
+        from langchain_core.messages import AIMessage, ToolMessage
+        from langchain_core.outputs import ChatGeneration, LLMResult
+        from data import metrics
+
+        release = threading.Event()
+
+        class LocalAgent:
+            def stream(self, state, config, stream_mode=None):
+                question = state["messages"][0][1].split("Task: ")[1].splitlines()[0]
+                if question == "wait":
+                    release.wait(10)
+                # What a model call reports to the callbacks in the config
+                reply = AIMessage(content="", usage_metadata={"input_tokens": 100, "output_tokens": 50,
+                                                              "total_tokens": 150})
+                for handler in config.get("callbacks", []):
+                    handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=reply)]]))
+                yield {"agent": {"messages": [AIMessage(content="", tool_calls=[
+                    {"name": "analyze_data", "args": {"query": "SELECT 1"}, "id": "call_1"}])]}}
+                yield {"tools": {"messages": [ToolMessage(content="1", name="analyze_data", tool_call_id="call_1")]}}
+                yield {"agent": {"messages": [AIMessage(
+                    content="See generated_images/sales.png and generated_images/export_sales.csv.gz")]}}
+
+        keys = {"alice-key": {"username": "alice", "role": "analyst"},
+                "bob-key": {"username": "bob", "role": "guest"}}
+        alice, bob = {"X-API-Key": "alice-key"}, {"Authorization": "Bearer bob-key"}
+
+        async def wait_until(client, job_id, headers, statuses):
+            for _ in range(200):
+                job = await (await client.get(f"/v1/jobs/{job_id}", headers=headers)).json()
+                if job["status"] in statuses:
+                    return job
+                await asyncio.sleep(0.02)
+            self.fail(f"Job {job_id} never reached {statuses}")
+
+        async def scenario():
+            app = server.create_app("key", "model", workers=1, max_queued=1, api_keys=keys)
+            async with TestClient(TestServer(app)) as client:
+                self.assertEqual((await client.get("/v1/jobs/x")).status, 401)
+                response = await client.post("/v1/questions", json={"question": "q", "database": "shop"}, headers=bob)
+                self.assertEqual(response.status, 403)
+
+                # Submit -> poll -> result
+                response = await client.post("/v1/questions", json={"question": "sales", "database": "shop"},
+                                             headers=alice)
+                self.assertEqual(response.status, 202)
+                job_id = (await response.json())["job_id"]
+                job = await wait_until(client, job_id, alice, ("done", "failed"))
+                self.assertEqual(job["status"], "done")
+                self.assertEqual(job["charts"], ["/v1/charts/sales.png"])
+                self.assertEqual(job["exports"], ["/v1/exports/export_sales.csv.gz"])
+                self.assertEqual((await client.get(f"/v1/jobs/{job_id}", headers=bob)).status, 404)
+
+                # The stream replays the job's events in order
+                body = await (await client.get(f"/v1/jobs/{job_id}/stream", headers=alice)).text()
+                events = [line[len("event: "):] for line in body.splitlines() if line.startswith("event: ")]
+                self.assertEqual(events, ["status", "status", "tool_call", "tool_result", "answer", "result"])
+
+                # Files are served to their owner only; dashboards to roles allowed on their database
+                for url in ("/v1/charts/sales.png", "/v1/exports/export_sales.csv.gz"):
+                    self.assertEqual((await client.get(url, headers=alice)).status, 200)
+                    self.assertEqual((await client.get(url, headers=bob)).status, 404)
+                listed = await (await client.get("/v1/dashboards", headers=alice)).json()
+                self.assertEqual([chart["database"] for chart in listed["dashboards"]], ["Shop"])
+                self.assertEqual((await client.get("/v1/dashboards/shop_trend.png", headers=alice)).status, 200)
+                self.assertEqual((await client.get("/v1/dashboards/hr_salaries.png", headers=alice)).status, 404)
+                self.assertEqual((await client.get("/v1/dashboards/shop_trend.png", headers=bob)).status, 404)
+
+                # One busy worker and one queued job: the next submission is rejected
+                running = (await (await client.post("/v1/questions", json={"question": "wait", "database": "shop"},
+                                                    headers=alice)).json())["job_id"]
+                await wait_until(client, running, alice, ("running",))
+                queued = await client.post("/v1/questions", json={"question": "next", "database": "shop"}, headers=alice)
+                self.assertEqual(queued.status, 202)
+                rejected = await client.post("/v1/questions", json={"question": "more", "database": "shop"}, headers=alice)
+                self.assertEqual(rejected.status, 429)
+                self.assertEqual(rejected.headers["Retry-After"], str(server.RETRY_AFTER_SECONDS))
+                release.set()
+                await wait_until(client, (await queued.json())["job_id"], alice, ("done",))
+                health = await (await client.get("/v1/health")).json()
+                self.assertEqual((health["done"], health["rejected"]), (3, 1))
+
+        print("[Check] Testing the HTTP service with a local agent...")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                os.makedirs("generated_images/dashboards")
+                for path in ("generated_images/sales.png", "generated_images/export_sales.csv.gz",
+                             "generated_images/dashboards/shop_trend.png", "generated_images/dashboards/hr_salaries.png"):
+                    with open(path, "wb") as f:
+                        f.write(b"data")
+                with open("generated_images/dashboards/manifest.json", "w") as f:
+                    json.dump({
+                        "generated_images/dashboards/shop_trend.png":
+                            {"database": "Shop", "name": "trend", "title": "Trend", "rendered_at": 1},
+                        "generated_images/dashboards/hr_salaries.png":
+                            {"database": "HR", "name": "salaries", "title": "Salaries", "rendered_at": 1},
+                    }, f)
+                # 100 tokens a day: after the first job alice is over budget
+                budgets = {"token_budgets": {"daily_tokens": {"analyst": 100}}}
+                with patch.dict(server.DATABASES, {"Shop": "shop.db", "HR": "hr.db"}, clear=True), \
+                        patch.dict(server.USER_DB_ACCESS, {"analyst": ["Shop"], "guest": []}, clear=True), \
+                        patch.object(server, "build_agent", return_value=LocalAgent()) as build, \
+                        patch.object(server, "create_checkpointer", return_value=None), \
+                        patch.object(server, "start_registry_watcher"), \
+                        patch.object(server, "start_dashboard_scheduler"), \
+                        patch.object(metrics, "METRICS_PATH", os.path.join(tmp, "metrics.sqlite")), \
+                        patch.object(metrics, "load_config", return_value=budgets):
+                    asyncio.run(scenario())
+
+                    # Jobs are recorded in the request metrics and count against the token budget
+                    rollup = metrics.get_metrics_store().rollup("username")
+                    self.assertEqual((rollup[0]["username"], rollup[0]["requests"], rollup[0]["tokens"]),
+                                     ("alice", 3, 450))
+                    first, last = build.call_args_list[0].kwargs, build.call_args_list[-1].kwargs
+                    self.assertEqual((first["model"], first["approximate"]), ("model", False))
+                    self.assertEqual((last["model"], last["approximate"]), ("gpt-4o-mini", True))
+                    self.assertEqual(last["memory_tokens"], metrics.MINIMAL_MEMORY_TOKENS)
+            finally:
+                release.set()
+                os.chdir(cwd)
+        print("PASS: Jobs are polled, streamed, metered and budgeted; files stay private; a full queue returns 429.")
+
+    def test_25_registry_reload_replaced_file(self):
+        """Unit test: a replaced or removed database is not read through old pools or indexes."""
+        from data import connections, db_registry
+        from data.value_index import get_value_index, sidecar_path
+
+        def make_db(path, country):
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE Customer (Id INTEGER PRIMARY KEY, Country TEXT)")
+            conn.executemany("INSERT INTO Customer (Country) VALUES (?)", [(country,)] * 20)
+            conn.commit()
+            conn.close()
+
+        def countries(path):
+            with connections.get_pool(db_path=path).connection() as conn:
+                return [row[0] for row in conn.execute("SELECT DISTINCT Country FROM Customer")]
+
+        print("[Check] Testing registry reload of a replaced database file...")
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.dict(db_registry.DATABASES, clear=True), \
+                patch.dict(db_registry.USER_DB_ACCESS, clear=True), \
+                patch.dict(db_registry._FINGERPRINTS, clear=True), \
+                patch.object(db_registry, "FEDERATED_ROLES", []):
+            os.makedirs(os.path.join(tmp, "dbs"))
+            config_path = os.path.join(tmp, "config.yaml")
+            with open(config_path, "w") as f:
+                f.write('database_path: "dbs"\ndatabases: {}\nuser_db_access: {admin: ["*"]}\n')
+            path = os.path.join(tmp, "dbs", "shop.db")
+            make_db(path, "Germany")
+            self.assertEqual(db_registry.reload_registry(config_path, warm=get_value_index), ["Shop"])
+            self.assertEqual(countries(path), ["Germany"])
+            self.assertEqual(get_value_index(path).lookup("germany")[0]["value"], "Germany")
+            federated = connections.get_pool(databases={"Shop": path})
+            pool = connections.get_pool(db_path=path)
+
+            # Replaced by a file with the same size and mtime: only the inode differs
+            stat = os.stat(path)
+            make_db(os.path.join(tmp, "new.db"), "Austria")
+            os.utime(os.path.join(tmp, "new.db"), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(os.path.join(tmp, "new.db"), path)
+            self.assertEqual(os.path.getsize(path), stat.st_size)
+            self.assertEqual(db_registry.reload_registry(config_path, warm=get_value_index), ["Shop"])
+            self.assertTrue(pool.closed and federated.closed)
+            self.assertEqual(countries(path), ["Austria"])
+            self.assertEqual(get_value_index(path).lookup("austria")[0]["value"], "Austria")
+            self.assertEqual(get_value_index(path).lookup("germany"), [])
+
+            # Removed: pools are closed and sidecars deleted
+            os.remove(path)
+            self.assertEqual(db_registry.reload_registry(config_path), ["Shop"])
+            self.assertNotIn(("single", os.path.abspath(path)), connections._POOLS)
+            self.assertFalse(os.path.exists(sidecar_path(path)))
+            self.assertEqual(db_registry.DATABASES, {})
+        print("PASS: Replaced and removed databases drop their pools and cached indexes.")
 
 if __name__ == "__main__":
     # Custom runner to make output cleaner
@@ -1,14 +1,31 @@
 # tools/analysis_tool.py
 from langchain.tools import BaseTool
-from typing import Type
+from typing import Dict, Optional, Type
 from pydantic import BaseModel, Field
-import sqlite3
 import pandas as pd
+import logging
+from data.connections import get_pool
+from data.sampling import run_approximate
+from data.shared_cache import cached, database_key
+from data.sql_rewriter import QueryValidationError, prepare_query
+from tools.result_encoder import DEFAULT_TOKEN_BUDGET, encode_result
+from tools.sketches import StreamingProfiler
+
+logger = logging.getLogger(__name__)
+
+# Results are read in chunks and profiled in one pass; only the leading
+# rows are kept in memory for display
+CHUNK_ROWS = 10000
+RETAINED_ROWS = 1000
 
 
 class AnalysisInput(BaseModel):
     """Input schema for DataAnalysisTool."""
     query: str = Field(description="SQL SELECT query to execute for data analysis")
+    exact: bool = Field(
+        default=False,
+        description="Force exact execution when approximate (sampled) mode is on"
+    )
 
 
 class DataAnalysisTool(BaseTool):
@@ -27,57 +44,122 @@ class DataAnalysisTool(BaseTool):
     """
     args_schema: Type[BaseModel] = AnalysisInput
     db_path: str = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+    # Upper bound on tokens of result text returned to the model per call
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+    # Opt-in: run exploratory queries on samples of large tables (single database only)
+    approximate: bool = False
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, databases: Optional[Dict[str, str]] = None,
+                 approximate: bool = False, token_budget: int = DEFAULT_TOKEN_BUDGET):
         super().__init__()
         self.db_path = db_path
-        if not self.db_path:
+        self.databases = databases
+        self.approximate = approximate
+        self.token_budget = token_budget
+        if not self.db_path and not self.databases:
             raise ValueError("db_path is required")
     
-    def _run(self, query: str) -> str:
+    def _pool(self):
+        """Shared read-only pool for the single database or the federated set."""
+        return get_pool(db_path=self.db_path, databases=self.databases)
+    
+    def _read_profiled(self, query: str):
+        """
+        Stream the query result in chunks through a StreamingProfiler.
+        
+        Returns:
+            (DataFrame of the first RETAINED_ROWS rows, profiler over all rows)
+        """
+        profiler = StreamingProfiler()
+        retained = []
+        n_retained = 0
+        with self._pool().connection() as conn:
+            # Quote keyword identifiers, enforce read-only and compile locally
+            query = prepare_query(conn, query)
+            for chunk in pd.read_sql_query(query, conn, chunksize=CHUNK_ROWS):
+                profiler.update(chunk)
+                if n_retained < RETAINED_ROWS:
+                    retained.append(chunk.head(RETAINED_ROWS - n_retained))
+                    n_retained += len(retained[-1])
+        df = pd.concat(retained, ignore_index=True) if retained else pd.DataFrame()
+        return df, profiler
+    
+    def _read_approximate(self, query: str):
+        """
+        Run the query on table samples when approximate mode applies.
+        
+        Returns:
+            (DataFrame, approximation label) or None to run the query exactly
+        """
+        if not self.approximate or self.databases:
+            return None
+        with self._pool().connection() as conn:
+            query = prepare_query(conn, query)
+        try:
+            return run_approximate(self.db_path, query)
+        except Exception as e:
+            logger.warning(f"Approximate execution failed, running exactly: {e}")
+            return None
+    
+    def _run(self, query: str, exact: bool = False) -> str:
+        """Execute query and analyze results (shared across workers via the result cache)."""
+        if self.databases:
+            databases = [database_key(path) for _, path in sorted(self.databases.items())]
+        else:
+            databases = [database_key(self.db_path)]
+        return cached(
+            "result",
+            [databases, query.strip(), exact, self.approximate, self.token_budget],
+            lambda: self._analyze(query, exact),
+            # Errors may be transient (locks, missing files); only results are shared
+            cacheable=lambda text: text.startswith(("Query Results", "Query returned no results")),
+        )
+    
+    def _analyze(self, query: str, exact: bool = False) -> str:
         """Execute query and analyze results."""
         try:
-            # Validate it's a SELECT query
-            if not query.strip().upper().startswith('SELECT'):
-                return "Error: Only SELECT queries are allowed for security reasons"
+            approximate = None if exact else self._read_approximate(query)
+            if approximate:
+                df, label = approximate
+                profiler = None
+            else:
+                # Execute query on a pooled connection (safe for concurrent tool calls)
+                df, profiler = self._read_profiled(query)
+                label = None
             
-            # Escape common reserved keywords in table names
-            # This helps when the LLM generates queries with reserved words
-            reserved_words = ['Order', 'User', 'Group', 'Table', 'Index', 'Key']
-            for word in reserved_words:
-                # Replace unescaped table names
-                query = query.replace(f' FROM {word} ', f' FROM [{word}] ')
-                query = query.replace(f' FROM {word};', f' FROM [{word}];')
-                query = query.replace(f' JOIN {word} ', f' JOIN [{word}] ')
-                query = query.replace(f' FROM {word}\n', f' FROM [{word}]\n')
-            
-            conn = sqlite3.connect(self.db_path)
-            
-            # Execute query
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            
-            if df.empty:
+            if (profiler.rows if profiler else len(df)) == 0:
                 return "Query returned no results"
             
-            # Generate analysis
-            analysis = f"Query Results:\n"
-            analysis += f"- Total rows: {len(df)}\n"
-            analysis += f"- Columns: {', '.join(df.columns)}\n\n"
-            
-            # Show first few rows
-            max_rows = min(10, len(df))
-            analysis += f"Sample data (first {max_rows} rows):\n"
-            analysis += df.head(max_rows).to_string(index=False, max_colwidth=50) + "\n\n"
-            
-            # Basic statistics for numeric columns
-            numeric_cols = df.select_dtypes(include=['number']).columns
-            if len(numeric_cols) > 0:
-                analysis += "Numeric column statistics:\n"
-                analysis += df[numeric_cols].describe().to_string() + "\n"
+            # Encode results compactly within the token budget. Results larger
+            # than what was retained are described by the streaming profile.
+            if profiler and profiler.rows > len(df):
+                encoded = encode_result(
+                    df,
+                    token_budget=self.token_budget,
+                    total_rows=profiler.rows,
+                    column_summary=profiler.summary(),
+                )
+            else:
+                encoded = encode_result(df, token_budget=self.token_budget)
+            logger.info(
+                f"analyze_data: {profiler.rows if profiler else len(df)} rows as {encoded['format']}, "
+                f"{encoded['tokens_used']} tokens used, {encoded['tokens_saved']} saved"
+            )
             
+            analysis = f"Query Results:\n"
+            if label:
+                analysis += label + "\n"
+            analysis += encoded["text"] + "\n\n"
+            analysis += (
+                f"[~{encoded['tokens_used']} tokens of {self.token_budget} budget, "
+                f"~{encoded['tokens_saved']} saved vs. full table and describe()]"
+            )
             return analysis
             
+        except QueryValidationError as e:
+            return str(e)
         except Exception as e:
             error_msg = str(e)
             if "syntax error" in error_msg.lower() and "order" in error_msg.lower():
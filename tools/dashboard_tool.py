@@ -0,0 +1,57 @@
+# tools/dashboard_tool.py
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Type
+from data.dashboards import find_dashboards, list_dashboards
+from data.db_registry import DATABASES
+
+logger = logging.getLogger(__name__)
+
+
+def registry_names(db_path=None, databases=None) -> List[str]:
+    """Registry names of the database (or federated set) an agent works on."""
+    if databases:
+        return list(databases)
+    target = os.path.abspath(db_path) if db_path else None
+    return [name for name, path in DATABASES.items() if os.path.abspath(path) == target]
+
+
+class DashboardInput(BaseModel):
+    question: str = Field(description="The user's question, used to find a matching precomputed chart")
+
+class DashboardTool(BaseTool):
+    name: str = "find_dashboard_chart"
+    description: str = """
+    Look up precomputed dashboard charts (standard charts such as sales trends,
+    top customers or revenue by genre, kept up to date in the background).
+    Use this BEFORE building a chart yourself: if a returned chart answers the
+    question, reply with its path instead of querying and plotting again.
+    """
+    args_schema: Type[BaseModel] = DashboardInput
+    db_path: Optional[str] = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+
+    def _run(self, question: str) -> str:
+        names = registry_names(self.db_path, self.databases)
+        try:
+            matches = find_dashboards(question, names)
+            available = list_dashboards(names)
+        except Exception as e:
+            logger.error(f"Dashboard lookup failed: {e}")
+            return f"Error looking up dashboards: {str(e)}"
+
+        if not matches:
+            titles = ", ".join(f"'{chart['title']}'" for chart in available) or "none"
+            return f"No precomputed chart matches this question (available: {titles}). Build the chart yourself."
+        lines = ["Precomputed charts matching the question (best first):"]
+        for chart in matches:
+            age_minutes = (time.time() - chart["rendered_at"]) / 60
+            lines.append(
+                f"- {chart['title']} ({chart['database']}): {chart['path']} "
+                f"(rendered {age_minutes:.0f} min ago from current data)"
+            )
+        return "\n".join(lines)
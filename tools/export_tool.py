@@ -0,0 +1,74 @@
+# tools/export_tool.py
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+import logging
+import os
+from typing import Callable, Dict, Optional, Type
+from data.connections import get_pool
+from data.export import EXPORT_DIR, EXPORT_FORMATS, export_limits, export_path, export_query
+from data.sql_rewriter import QueryValidationError, prepare_query
+
+logger = logging.getLogger(__name__)
+
+class ExportInput(BaseModel):
+    query: str = Field(description="SQL SELECT query whose FULL result should be exported")
+    format: str = Field(default="csv", description="'csv' (gzip-compressed) or 'parquet'")
+
+class ExportTool(BaseTool):
+    name: str = "export_data"
+    description: str = """
+    Export the FULL result of a SQL SELECT query to a downloadable file
+    (gzip-compressed CSV by default, or Parquet).
+    Use this when the user wants to download or export the data behind an answer,
+    instead of printing rows in the chat.
+    Returns the file path: ALWAYS mention it in your response.
+    """
+    args_schema: Type[BaseModel] = ExportInput
+    db_path: Optional[str] = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+    # Role of the user, for the size limits in config.yaml (export_limits)
+    role: Optional[str] = None
+    # Optional callable(rows_written, bytes_written, max_rows) for progress display
+    progress_callback: Optional[Callable] = None
+
+    def _run(self, query: str, format: str = "csv") -> str:
+        fmt = format.lower().strip()
+        if fmt not in EXPORT_FORMATS:
+            return f"Error: Unknown export format '{format}'. Use one of: {', '.join(EXPORT_FORMATS)}"
+        limits = export_limits(self.role)
+        if not limits["max_rows"] or not limits["max_mb"]:
+            return f"Error: Role '{self.role}' is not allowed to export data"
+
+        path = export_path(fmt)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        progress = None
+        if self.progress_callback:
+            progress = lambda rows, size: self.progress_callback(rows, size, limits["max_rows"])
+        try:
+            with get_pool(db_path=self.db_path, databases=self.databases).connection() as conn:
+                result = export_query(
+                    conn,
+                    prepare_query(conn, query),
+                    path,
+                    fmt=fmt,
+                    max_rows=limits["max_rows"],
+                    max_bytes=limits["max_mb"] * 1024 * 1024,
+                    progress=progress,
+                )
+        except QueryValidationError as e:
+            return str(e)
+        except Exception as e:
+            logger.error(f"Export failed: {e}")
+            return f"Export Error: {str(e)}"
+
+        message = (
+            f"Success: Exported {result['rows']:,} rows to {result['path']} "
+            f"({result['bytes'] / 1024:,.0f} KB, {fmt})"
+        )
+        if result["truncated"]:
+            message += (
+                f"\nNOTE: The export was cut off at the limit for role '{self.role}' "
+                f"({limits['max_rows']:,} rows / {limits['max_mb']} MB). Tell the user the file is partial."
+            )
+        return message
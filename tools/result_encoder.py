@@ -0,0 +1,207 @@
+# tools/result_encoder.py
+import math
+
+import pandas as pd
+
+
+# Rough OpenAI average for English/CSV text; good enough for budgeting
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 1500
+MAX_TEXT_CHARS = 40
+MARKDOWN_MAX_ROWS = 20
+SUMMARY_TOP_VALUES = 3
+# Rows used to estimate sizes of large results without formatting all of them
+SIZE_SAMPLE_ROWS = 200
+
+
+def estimate_tokens(text):
+    """Approximate the number of model tokens in `text`."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _verbose_tokens(df):
+    """
+    Tokens the whole result would cost as a whitespace-padded to_string table
+    followed by a describe() block, i.e. the uncompressed baseline.
+    """
+    sample = df.head(SIZE_SAMPLE_ROWS)
+    width = 0
+    for col in sample.columns:
+        values = sample[col].astype(str).str.len()
+        width += max(len(str(col)), int(values.max()) if len(values) else 0) + 2
+    # describe() prints 8 statistics plus a header, ~12 characters per numeric column
+    n_numeric = len(df.select_dtypes(include=["number"]).columns)
+    describe_chars = 9 * (8 + 12 * n_numeric) if n_numeric else 0
+    return math.ceil((width * (len(df) + 1) + describe_chars) / CHARS_PER_TOKEN)
+
+
+def _drop_low_information(df):
+    """Drop all-null and constant columns; return (df, notes about what was dropped)."""
+    notes = []
+    keep = []
+    for col in df.columns:
+        series = df[col]
+        if series.isna().all():
+            notes.append(f"{col}: all null")
+        elif len(df) > 1 and series.nunique(dropna=False) == 1:
+            notes.append(f"{col}: always {series.iloc[0]!r}")
+        else:
+            keep.append(col)
+    if not keep:
+        # Never drop everything: a single-row or fully constant result is still the answer
+        return df, []
+    return df[keep], notes
+
+
+def _truncate_text(df, max_chars):
+    """Shorten long text values so one wide column can't eat the budget."""
+    df = df.copy()
+    for col in df.select_dtypes(include=["object", "string"]).columns:
+        values = df[col].astype(str)
+        long_values = values.str.len() > max_chars
+        if long_values.any():
+            df[col] = values.where(~long_values, values.str.slice(0, max_chars - 1) + "…")
+    return df
+
+
+def _to_csv(df):
+    return df.to_csv(index=False, float_format="%.6g").strip()
+
+
+def _markdown_cell(value):
+    """Cell text with pipes escaped and line breaks flattened so rows stay intact."""
+    if not isinstance(value, str) and pd.isna(value):
+        return ""
+    text = f"{value:.6g}" if isinstance(value, float) else str(value)
+    return " ".join(text.split()).replace("|", "\\|")
+
+
+def _to_markdown(df):
+    header = "| " + " | ".join(_markdown_cell(str(col)) for col in df.columns) + " |"
+    separator = "|" + "---|" * len(df.columns)
+    rows = ["| " + " | ".join(_markdown_cell(v) for v in row) + " |" for row in df.itertuples(index=False)]
+    return "\n".join([header, separator] + rows)
+
+
+def _cap_lines(lines, budget_tokens, what):
+    """Leading lines within budget_tokens, plus a note on how many were left out."""
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            kept.append(f"- ... {len(lines) - len(kept)} more {what} not shown")
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def _column_list(columns, budget_tokens):
+    """Comma-separated column names; wide results name as many as fit in budget_tokens."""
+    names = [str(col) for col in columns]
+    kept, used = [], 0
+    for name in names:
+        used += estimate_tokens(name + ", ")
+        if used > budget_tokens:
+            return ", ".join(kept) + f", ... ({len(names) - len(kept)} more)"
+        kept.append(name)
+    return ", ".join(kept)
+
+
+def _column_summary(df):
+    """One line per column (joined with newlines): numeric range/mean or distinct count and top values."""
+    lines = []
+    for col in df.columns:
+        series = df[col]
+        nulls = series.isna().mean()
+        null_note = f", {nulls:.0%} null" if nulls else ""
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            lines.append(
+                f"- {col} (numeric): min {series.min():.6g}, max {series.max():.6g}, "
+                f"mean {series.mean():.6g}{null_note}"
+            )
+        else:
+            counts = series.value_counts().head(SUMMARY_TOP_VALUES)
+            top = ", ".join(f"{value} ({count})" for value, count in counts.items())
+            lines.append(f"- {col} (text): {series.nunique()} distinct; top: {top}{null_note}")
+    return "\n".join(lines)
+
+
+def _csv_fits(df, budget_tokens):
+    """Whether the whole frame fits as CSV, extrapolating from a sample when large."""
+    if len(df) > SIZE_SAMPLE_ROWS:
+        sample_tokens = estimate_tokens(_to_csv(df.head(SIZE_SAMPLE_ROWS)))
+        if sample_tokens * len(df) / SIZE_SAMPLE_ROWS > budget_tokens:
+            return False
+    return estimate_tokens(_to_csv(df)) <= budget_tokens
+
+
+def _rows_that_fit(df, budget_tokens):
+    """Largest number of leading rows whose CSV stays within budget_tokens."""
+    # Every CSV row costs at least one token, which bounds the search
+    low, high = 0, max(0, min(len(df), budget_tokens))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(_to_csv(df.head(mid))) <= budget_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def encode_result(df, token_budget=DEFAULT_TOKEN_BUDGET, max_text_chars=MAX_TEXT_CHARS,
+                  total_rows=None, column_summary=None):
+    """
+    Encode a query result for the model within a token budget.
+
+    Small results are sent as a markdown table, mid-sized ones as compact CSV,
+    and anything larger as a per-column summary plus as many CSV rows as fit.
+
+    Args:
+        df: Query result
+        token_budget: Upper bound on tokens for the encoded text
+        max_text_chars: Longer text values are truncated to this length
+        total_rows: Row count of the full result when `df` holds only its
+            leading rows (streamed results); defaults to len(df)
+        column_summary: Precomputed per-column summary of the full result
+            (e.g. from StreamingProfiler), used instead of summarising `df`
+
+    Returns:
+        Dict with the encoded "text", the chosen "format" and the
+        "tokens_used"/"tokens_saved" (vs. the padded table plus describe())
+    """
+    complete = total_rows is None or total_rows <= len(df)
+    total_rows = len(df) if total_rows is None else total_rows
+    baseline_tokens = math.ceil(_verbose_tokens(df) * total_rows / max(len(df), 1))
+
+    # Constant-looking columns in a partial result may still vary further down
+    compact, dropped = _drop_low_information(df) if complete else (df, [])
+    compact = _truncate_text(compact, max_text_chars)
+
+    header = f"- Total rows: {total_rows}\n- Columns: {_column_list(compact.columns, token_budget // 4)}\n"
+    if dropped:
+        header += f"- Omitted columns: {'; '.join(dropped)}\n"
+    remaining = token_budget - estimate_tokens(header)
+
+    if complete and total_rows <= MARKDOWN_MAX_ROWS and estimate_tokens(_to_markdown(compact)) <= remaining:
+        fmt, body = "markdown", _to_markdown(compact)
+    elif complete and _csv_fits(compact, remaining):
+        fmt, body = "csv", "CSV:\n" + _to_csv(compact)
+    else:
+        # The summary has one line per column; wide results keep as many as fit
+        summary = "Column summary:\n" + _cap_lines(
+            (column_summary or _column_summary(compact)).splitlines(), remaining - 20, "columns"
+        )
+        n_rows = _rows_that_fit(compact, remaining - estimate_tokens(summary) - 10)
+        fmt, body = "summary", summary
+        if n_rows:
+            body += f"\n\nFirst {n_rows} rows (CSV):\n" + _to_csv(compact.head(n_rows))
+
+    text = header + "\n" + body
+    tokens_used = estimate_tokens(text)
+    return {
+        "text": text,
+        "format": fmt,
+        "tokens_used": tokens_used,
+        "tokens_saved": max(baseline_tokens - tokens_used, 0),
+    }
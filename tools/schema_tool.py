@@ -1,23 +1,73 @@
 # tools/schema_tool.py
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
-import sqlite3
-from typing import Type
+import logging
+import os
+from typing import Dict, Optional, Type
+from data.connections import get_pool, schema_alias
+from data.db_registry import DATABASES
+from data.shared_cache import cached, database_key
+from data.stats_catalog import format_table, load_catalog
+
+logger = logging.getLogger(__name__)
 
 class SchemaInput(BaseModel):
-    db_path: str = Field(description="Full path to the SQLite database file")
+    db_path: Optional[str] = Field(
+        default=None,
+        description="Full path to the SQLite database file (ignored in federated mode)"
+    )
 
 class SchemaTool(BaseTool):
     name: str = "inspect_schema"
     description: str = """
     Useful for seeing table names and their column definitions.
     ALWAYS use this tool before writing a SQL query to ensure column names are correct.
+    Also reports row counts, null fractions, distinct counts, value ranges,
+    most common values and foreign keys, so exploratory COUNT/DISTINCT
+    queries are usually unnecessary.
     """
     args_schema: Type[BaseModel] = SchemaInput
+    # Database of the agent; when set, a path passed by the model is ignored
+    db_path: Optional[str] = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+    # Serve the precomputed statistics catalog alongside column definitions
+    include_stats: bool = True
 
-    def _run(self, db_path: str) -> str:
+    def _run(self, db_path: Optional[str] = None) -> str:
+        if self.databases:
+            return self._federated_schema()
+        registered = {os.path.abspath(path) for path in DATABASES.values()}
+        if self.db_path:
+            db_path = self.db_path
+        elif not db_path or os.path.abspath(db_path) not in registered:
+            # Only registry databases get a connection pool and statistics sidecars
+            return f"Error inspecting schema: '{db_path}' is not a registered database"
         try:
-            conn = sqlite3.connect(db_path)
+            return self._describe(db_path)
+        except Exception as e:
+            return f"Error inspecting schema: {str(e)}"
+
+    def _describe(self, db_path: str, prefix: str = "") -> str:
+        """Schema of one database (shared across workers via the schema cache)."""
+        return cached(
+            "schema",
+            [database_key(db_path), prefix, self.include_stats],
+            lambda: self._describe_uncached(db_path, prefix),
+        )
+
+    def _describe_uncached(self, db_path: str, prefix: str = "") -> str:
+        """Schema of one database, with statistics when available."""
+        if self.include_stats:
+            try:
+                catalog = load_catalog(db_path)
+                return "\n\n".join(
+                    format_table(table, entry, prefix) for table, entry in catalog["tables"].items()
+                )
+            except Exception as e:
+                logger.warning(f"Statistics unavailable for {db_path}: {e}")
+
+        with get_pool(db_path=db_path).connection() as conn:
             cursor = conn.cursor()
             
             # Get list of tables
@@ -31,9 +81,21 @@ class SchemaTool(BaseTool):
                 columns = cursor.fetchall()
                 # Format: (id, name, type, notnull, default, pk)
                 col_str = ", ".join([f"{col[1]} ({col[2]})" for col in columns])
-                schema_info.append(f"Table: {table}\n  Columns: {col_str}")
-                
-            conn.close()
-            return "\n\n".join(schema_info)
+                schema_info.append(f"Table: {prefix}{table}\n  Columns: {col_str}")
+            
+        return "\n\n".join(schema_info)
+
+    def _federated_schema(self) -> str:
+        """List the tables of every attached database, namespaced by schema."""
+        try:
+            schema_info = [
+                self._describe(path, prefix=f"{schema_alias(name)}.")
+                for name, path in self.databases.items()
+            ]
+            return (
+                "Federated mode: prefix every table with its database schema "
+                "(e.g. northwind.[Order]). Cross-database JOINs are allowed.\n\n"
+                + "\n\n".join(schema_info)
+            )
         except Exception as e:
-            return f"Error inspecting schema: {str(e)}"
\ No newline at end of file
+            return f"Error inspecting schema: {str(e)}"
@@ -0,0 +1,207 @@
+# tools/sketches.py
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_HLL_PRECISION = 12   # 4096 registers, ~1.6% standard error
+DEFAULT_KLL_K = 200          # ~1% rank error on quantiles
+DEFAULT_TOP_K = 5
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def hash_values(series):
+    """
+    64-bit hashes of the non-null values of a Series (vectorized).
+
+    Numbers are hashed as float64: pandas reads an integer column as
+    float64 in chunks that contain NULLs, and 7 and 7.0 must hash alike.
+    """
+    values = series.dropna()
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        values = values.astype(np.float64)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+
+class HyperLogLog:
+    """Approximate distinct count in constant memory (2**precision bytes)."""
+
+    def __init__(self, precision=DEFAULT_HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, hashes):
+        if len(hashes) == 0:
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        # A sentinel bit below the shifted hash bounds the rank at 64 - p + 1
+        remainder = (hashes << p) | (np.uint64(1) << (p - np.uint64(1)))
+        # frexp gives remainder = mantissa * 2**exponent, so leading zeros = 64 - exponent
+        _, exponent = np.frexp(remainder.astype(np.float64))
+        rank = (65 - exponent).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            # Small-range correction (linear counting)
+            return self.m * np.log(self.m / zeros)
+        return float(raw)
+
+
+class KLLSketch:
+    """
+    Approximate quantiles in constant memory (KLL compactor hierarchy).
+
+    Level h holds items of weight 2**h; a full level is sorted and every
+    other item (random offset) is promoted to the level above.
+    """
+
+    def __init__(self, k=DEFAULT_KLL_K, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Keep one item back when the count is odd so weights stay exact
+                held, items = items[:len(items) % 2], items[len(items) % 2:]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = held
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, qs=QUANTILES):
+        if self.n == 0:
+            return [None for _ in qs]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2.0 ** h) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        cumulative /= cumulative[-1]
+        positions = np.searchsorted(cumulative, qs, side="left")
+        return [float(items[min(pos, len(items) - 1)]) for pos in positions]
+
+
+class TopK:
+    """Heavy hitters (Misra-Gries) with a bounded number of counters."""
+
+    def __init__(self, k=DEFAULT_TOP_K, capacity=None):
+        self.k = k
+        self.capacity = capacity or k * 20
+        self.counters = pd.Series(dtype="float64")
+        # Upper bound on how much any reported count may be underestimated
+        self.error = 0.0
+
+    def update(self, series):
+        counts = series.dropna().astype(str).value_counts()
+        if counts.empty:
+            return
+        merged = self.counters.add(counts, fill_value=0)
+        if len(merged) > self.capacity:
+            threshold = merged.nlargest(self.capacity + 1).iloc[-1]
+            merged = merged[merged > threshold] - threshold
+            self.error += threshold
+        self.counters = merged
+
+    def top(self, n=None):
+        counts = self.counters.nlargest(n or self.k)
+        return [(value, int(count)) for value, count in counts.items()]
+
+
+class StreamingProfiler:
+    """
+    Single-pass profile of a chunked query result.
+
+    Numeric columns get min/max/mean, approximate quantiles and distinct
+    count; text columns get approximate distinct count and top values.
+    Memory does not grow with the number of rows.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        # Column -> sketch state, or None while only nulls have been seen
+        self.columns = {}
+        self.pending_nulls = {}
+
+    def _new_column(self, series):
+        numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        stats = {"numeric": numeric, "nulls": 0, "hll": HyperLogLog()}
+        if numeric:
+            stats.update({"min": None, "max": None, "sum": 0.0, "count": 0, "kll": KLLSketch()})
+        else:
+            stats["topk"] = TopK()
+        return stats
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            stats = self.columns.get(col)
+            if stats is None:
+                if series.isna().all():
+                    # The column type is unknown until a non-null value shows up
+                    self.columns[col] = None
+                    self.pending_nulls[col] = self.pending_nulls.get(col, 0) + len(series)
+                    continue
+                stats = self.columns[col] = self._new_column(series)
+                stats["nulls"] += self.pending_nulls.pop(col, 0)
+
+            stats["nulls"] += int(series.isna().sum())
+            stats["hll"].update(hash_values(series))
+            if stats["numeric"]:
+                values = pd.to_numeric(series, errors="coerce").dropna().to_numpy(dtype=np.float64)
+                if len(values):
+                    low, high = values.min(), values.max()
+                    stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+                    stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+                    stats["sum"] += values.sum()
+                    stats["count"] += len(values)
+                    stats["kll"].update(values)
+            else:
+                stats["topk"].update(series)
+
+    def summary(self):
+        """One line per column, in the compact style of the result encoder."""
+        lines = []
+        for col, stats in self.columns.items():
+            if stats is None or (stats["numeric"] and not stats["count"]):
+                lines.append(f"- {col}: all null")
+                continue
+            null_note = f", {stats['nulls'] / self.rows:.0%} null" if stats["nulls"] else ""
+            distinct = f"~{stats['hll'].estimate():,.0f} distinct"
+            if stats["numeric"]:
+                p25, p50, p75 = stats["kll"].quantiles()
+                lines.append(
+                    f"- {col} (numeric): min {stats['min']:.6g}, p25 ~{p25:.6g}, median ~{p50:.6g}, "
+                    f"p75 ~{p75:.6g}, max {stats['max']:.6g}, mean {stats['sum'] / stats['count']:.6g}, "
+                    f"{distinct}{null_note}"
+                )
+            else:
+                # Misra-Gries only keeps values that stand out from the rest
+                top = ", ".join(f"{value} (~{count})" for value, count in stats["topk"].top()) or "no dominant values"
+                lines.append(f"- {col} (text): {distinct}; top: {top}{null_note}")
+        return "\n".join(lines)
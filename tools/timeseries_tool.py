@@ -0,0 +1,97 @@
+# tools/timeseries_tool.py
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+import pandas as pd
+import logging
+import re
+from typing import Dict, Optional, Type
+from data.connections import get_pool
+from data.sql_rewriter import QueryValidationError, prepare_query
+from data.timeseries import (
+    AUTO, DEFAULT_TARGET_POINTS, GRANULARITIES, choose_granularity, detect_date_columns,
+    range_query, series_query,
+)
+from tools.result_encoder import encode_result
+from tools.visualization_tool import VisualizationTool
+
+logger = logging.getLogger(__name__)
+
+# The series is small by construction; the model gets it within this budget
+SERIES_TOKEN_BUDGET = 600
+
+
+class TimeSeriesInput(BaseModel):
+    source: str = Field(
+        description="Table name, or a FROM clause with joins (e.g. \"[Order] o JOIN OrderDetail d ON d.OrderId = o.Id\")"
+    )
+    value: str = Field(default="COUNT(*)", description="Aggregate to plot per period, e.g. 'SUM(Total)' or 'COUNT(*)'")
+    date_column: Optional[str] = Field(
+        default=None, description="Date column (e.g. 'o.OrderDate'); detected automatically for a single table"
+    )
+    where: Optional[str] = Field(default=None, description="Optional SQL filter, without the WHERE keyword")
+    granularity: str = Field(default=AUTO, description="'auto', 'day', 'week', 'month', 'quarter' or 'year'")
+    title: str = Field(default="Trend over time", description="Title of the chart")
+    value_label: str = Field(default="value", description="Name of the plotted value, e.g. 'Sales'")
+    save_path: str = Field(description="File path to save the image (e.g., 'generated_images/trend.png')")
+
+
+class TimeSeriesTool(BaseTool):
+    name: str = "plot_time_series"
+    description: str = """
+    Plot a trend over time. Groups the rows by day/week/month/quarter/year in SQL
+    (granularity picked from the date range), aggregates the value per period and
+    draws a sorted line chart. Use this INSTEAD of analyze_data + data_visualization
+    for any "over time" / trend / per-month question.
+    Returns the chart path and the series; mention the path in your response.
+    """
+    args_schema: Type[BaseModel] = TimeSeriesInput
+    db_path: Optional[str] = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+    target_points: int = DEFAULT_TARGET_POINTS
+
+    def _run(self, source: str, save_path: str, value: str = "COUNT(*)", date_column: Optional[str] = None,
+             where: Optional[str] = None, granularity: str = AUTO, title: str = "Trend over time",
+             value_label: str = "value") -> str:
+        granularity = granularity.lower().strip()
+        if granularity != AUTO and granularity not in GRANULARITIES:
+            return f"Error: Unknown granularity '{granularity}'. Use auto or one of: {', '.join(GRANULARITIES)}"
+        value_label = re.sub(r"\W+", "_", value_label).strip("_") or "value"
+
+        try:
+            with get_pool(db_path=self.db_path, databases=self.databases).connection() as conn:
+                if not date_column:
+                    candidates = detect_date_columns(conn, source)
+                    if not candidates:
+                        return (
+                            f"Error: No date column found in '{source}'. "
+                            "Pass date_column explicitly (inspect the schema for date columns)."
+                        )
+                    date_column = f"[{candidates[0]}]"
+
+                start, end, rows = conn.execute(prepare_query(conn, range_query(source, date_column, where))).fetchone()
+                if not rows:
+                    return f"Error: No rows with a valid date in {date_column}"
+                if granularity == AUTO:
+                    granularity = choose_granularity(start, end, self.target_points)
+
+                query = prepare_query(
+                    conn, series_query(source, date_column, value, granularity, where, value_label)
+                )
+                df = pd.read_sql_query(query, conn)
+        except QueryValidationError as e:
+            return str(e)
+        except Exception as e:
+            logger.error(f"Time series failed: {e}")
+            return f"Error building time series: {str(e)}"
+
+        chart = VisualizationTool()._run(
+            df.to_csv(index=False), "line", title, "period", value_label, save_path
+        )
+        logger.info(f"Time series: {rows} rows -> {len(df)} {granularity} points ({start} .. {end})")
+        return (
+            f"{chart}\n"
+            f"Series: {len(df)} points by {granularity} from {rows:,} rows ({start} .. {end})\n"
+            f"SQL: {query}\n"
+            f"{encode_result(df, token_budget=SERIES_TOKEN_BUDGET)['text']}"
+        )
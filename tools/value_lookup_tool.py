@@ -0,0 +1,72 @@
+# tools/value_lookup_tool.py
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+import logging
+from typing import Dict, List, Optional, Type
+from data.connections import schema_alias
+from data.value_index import get_value_index
+
+logger = logging.getLogger(__name__)
+
+# Matches reported per term
+MATCHES_PER_TERM = 3
+
+
+def _sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class ValueLookupInput(BaseModel):
+    terms: List[str] = Field(
+        description="Names or categories as the user wrote them, e.g. ['germany', 'ac dc']"
+    )
+    table: Optional[str] = Field(default=None, description="Only look in this table (without schema prefix)")
+    column: Optional[str] = Field(default=None, description="Only look in this column")
+
+
+class ValueLookupTool(BaseTool):
+    name: str = "lookup_values"
+    description: str = """
+    Find the exact stored values for names and categories the user mentions
+    (countries, cities, artists, genres, statuses, ...) and the table.column
+    holding them. Use this INSTEAD of SELECT DISTINCT or LIKE queries to find
+    how a value is spelled, then filter with = on the returned value.
+    """
+    args_schema: Type[BaseModel] = ValueLookupInput
+    db_path: Optional[str] = None
+    # Federated mode: registry name -> path, all ATTACHed to one connection
+    databases: Optional[Dict[str, str]] = None
+
+    def _run(self, terms: List[str], table: Optional[str] = None, column: Optional[str] = None) -> str:
+        sources = (
+            {f"{schema_alias(name)}.": path for name, path in self.databases.items()}
+            if self.databases else {"": self.db_path}
+        )
+        # "northwind.[Customer]" -> "Customer"
+        table = table.split(".")[-1].strip("[]") if table else None
+        try:
+            indexes = {prefix: get_value_index(path) for prefix, path in sources.items()}
+        except Exception as e:
+            logger.error(f"Value index unavailable: {e}")
+            return f"Error looking up values: {str(e)}"
+
+        lines = ["Stored values matching the terms (best first; use them with =):"]
+        for term in terms:
+            matches = [
+                dict(match, table=prefix + match["table"])
+                for prefix, index in indexes.items()
+                for match in index.lookup(term, table=table, column=column)
+            ]
+            matches.sort(key=lambda match: (-match["score"], -match["rows"]))
+            if not matches:
+                lines.append(f"- '{term}': no close stored value (it may not be a stored name or category)")
+                continue
+            found = []
+            for match in matches[:MATCHES_PER_TERM]:
+                similarity = "" if match["score"] == 1.0 else f", similarity {match['score']:.2f}"
+                found.append(
+                    f"{match['table']}.{match['column']} = {_sql_literal(match['value'])} "
+                    f"({match['rows']} rows{similarity})"
+                )
+            lines.append(f"- '{term}': {', '.join(found)}")
+        return "\n".join(lines)
@@ -5,10 +5,20 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from io import StringIO
 from typing import Optional
+import logging
+import os
+import threading
+from data.shared_cache import database_key, get_cache, make_key, SHARED_CACHE_ENABLED
 
 # [Integration] Import your custom style function
+from styles import company_style
 from styles.company_style import apply_company_style 
 
+logger = logging.getLogger(__name__)
+
+# pyplot keeps global state; charts are also drawn by the dashboard scheduler thread
+_PLOT_LOCK = threading.Lock()
+
 class VisualizationInput(BaseModel):
     data_str: str = Field(description="CSV formatted string of data to plot")
     plot_type: str = Field(description="Type of plot: 'bar', 'line', 'scatter', 'hist', 'box'")
@@ -30,6 +40,30 @@ class VisualizationTool(BaseTool):
              x_column: Optional[str] = None, y_column: Optional[str] = None, 
              save_path: Optional[str] = "output_plot.png", *args, **kwargs):
         
+        # Identical charts (same data, options and style) are rendered once
+        # across all workers; the PNG bytes are kept in the shared render cache
+        cache = get_cache() if SHARED_CACHE_ENABLED else None
+        key = make_key(data_str, plot_type, title, x_column, y_column, database_key(company_style.__file__))
+        if cache is not None:
+            png = cache.get("render", key)
+            if png is not None:
+                try:
+                    with open(save_path, "wb") as f:
+                        f.write(png)
+                    logger.info(f"Chart served from render cache: {save_path}")
+                    return f"Success: Chart saved to {save_path}"
+                except OSError as e:
+                    return f"Visualization Error: {str(e)}"
+
+        with _PLOT_LOCK:
+            result = self._render(data_str, plot_type, title, x_column, y_column, save_path)
+        if cache is not None and result.startswith("Success") and os.path.exists(save_path):
+            with open(save_path, "rb") as f:
+                cache.set("render", key, f.read())
+        return result
+
+    def _render(self, data_str, plot_type, title, x_column, y_column, save_path):
+        """Draw the chart with the company style and save it to save_path."""
         # [Requirement] Apply the Company Style 
         apply_company_style()
 
@@ -41,6 +75,10 @@ class VisualizationTool(BaseTool):
                 df = pd.read_csv(StringIO(data_str), sep=None, engine='python')
 
             if df.empty: return "Error: Data is empty"
+
+            # Lines drawn through unsorted x values zigzag back and forth
+            if plot_type == "line" and x_column in df.columns:
+                df = df.sort_values(x_column, kind="stable")
             
             # Create Plot
             fig, ax = plt.subplots()